@@ -1,4 +1,6 @@
 import random
+import functools
+import itertools
 import numpy as np
 from operator import itemgetter
 
@@ -106,69 +108,205 @@ class Blood:
 
     # Get the usability of the blood's phenotype with respect to the distribution of either a given set of antigens, or of the major blood types, in the patient population.
     def get_usability(self, PARAMS, hospitals, antigens = []):
+        return vector_usability(PARAMS, self.vector, hospitals, antigens)
 
-        # TODO this is now hardcoded for the case where SCD patients are Africans and all others are Caucasions.
-        avg_daily_demand_african = sum([PARAMS.patgroup_distr[hospital.htype]["SCD"] * hospital.avg_daily_demand for hospital in hospitals])
-        avg_daily_demand_total = sum([hospital.avg_daily_demand for hospital in hospitals])
-        part_african = avg_daily_demand_african / avg_daily_demand_total
-
-        if antigens == []:
-            usability_ABO = 0
-            usability_RhD = 1
-
-            # Calculate the ABO-usability of this blood product, by summing all prevalences of the phenotypes that can receive this product.
-            ABO_v = self.vector[:2] 
-            ABO_g = PARAMS.ABO_phenotypes
-            for g in range(len(ABO_g)):
-                if all(v <= g for v, g in zip(ABO_v, ABO_g[g])):
-                    usability_ABO += PARAMS.ABO_prevalences["African"][g] * part_african
-                    usability_ABO += PARAMS.ABO_prevalences["Caucasian"][g] * (1 - part_african)
-
-            # Calculate the RhD-usability of this blood product, by summing all prevalences of the phenotypes that can receive this product.
-            # If the considered blood product is RhD negative, usability is always 1. Therefore usability is only calculated when the product is RhD positive.
-            Dpos = np.array([g[0] for g in PARAMS.Rhesus_phenotypes])
-            Dpos_prevalence = sum(np.array(PARAMS.Rhesus_prevalences["African"]) * part_african * Dpos) + sum(np.array(PARAMS.Rhesus_prevalences["Caucasian"]) * (1 - part_african) * Dpos)
-            if self.vector[2] == 1:
-                usability_RhD = Dpos_prevalence
-
-            # Return the product of all the invdiviual system usabilities to compute the final usabilty.
-            return usability_ABO * usability_RhD
 
-        else:
-            # Get intersection of all antigens given to consider, and all antigens in the model.
-            antigens = [ag for ag in (PARAMS.major + PARAMS.minor) if ag in antigens]
+# Get the usability of a phenotype vector with respect to the distribution of either a given set of antigens, or of the major blood types, in the patient population.
+def vector_usability(PARAMS, vector, hospitals, antigens = []):
+
+    part_african = get_part_african(PARAMS, hospitals)
+
+    if antigens == []:
+        usability_ABO = 0
+        usability_RhD = 1
 
-            usability_ABO = self.get_usability_system(["A", "B"], antigens, PARAMS.ABO_phenotypes, PARAMS.ABO_prevalences, part_african)
-            usability_Rhesus = self.get_usability_system(["D", "C", "c", "E", "e"], antigens, PARAMS.Rhesus_phenotypes, PARAMS.Rhesus_prevalences, part_african)
-            usability_Kell = self.get_usability_system(["K", "k"], antigens, PARAMS.Kell_phenotypes, PARAMS.Kell_prevalences, part_african)
-            usability_MNS = self.get_usability_system(["M", "N", "S", "s"], antigens, PARAMS.MNS_phenotypes, PARAMS.MNS_prevalences, part_african)
-            usability_Duffy = self.get_usability_system(["Fya", "Fyb"], antigens, PARAMS.Duffy_phenotypes, PARAMS.Duffy_prevalences, part_african)
-            usability_Kidd = self.get_usability_system(["Jka", "Jkb"], antigens, PARAMS.Kidd_phenotypes, PARAMS.Kidd_prevalences, part_african)
+        # Calculate the ABO-usability of this blood product, by summing all prevalences of the phenotypes that can receive this product.
+        ABO_v = vector[:2] 
+        ABO_g = PARAMS.ABO_phenotypes
+        for g in range(len(ABO_g)):
+            if all(v <= g for v, g in zip(ABO_v, ABO_g[g])):
+                usability_ABO += PARAMS.ABO_prevalences["African"][g] * part_african
+                usability_ABO += PARAMS.ABO_prevalences["Caucasian"][g] * (1 - part_african)
+
+        # Calculate the RhD-usability of this blood product, by summing all prevalences of the phenotypes that can receive this product.
+        # If the considered blood product is RhD negative, usability is always 1. Therefore usability is only calculated when the product is RhD positive.
+        Dpos = np.array([g[0] for g in PARAMS.Rhesus_phenotypes])
+        Dpos_prevalence = sum(np.array(PARAMS.Rhesus_prevalences["African"]) * part_african * Dpos) + sum(np.array(PARAMS.Rhesus_prevalences["Caucasian"]) * (1 - part_african) * Dpos)
+        if vector[2] == 1:
+            usability_RhD = Dpos_prevalence
 
         # Return the product of all the invdiviual system usabilities to compute the final usabilty.
-        return usability_ABO * usability_Rhesus * usability_Kell * usability_MNS * usability_Duffy * usability_Kidd
+        return usability_ABO * usability_RhD
 
+    else:
+        # Get intersection of all antigens given to consider, and all antigens in the model.
+        antigens = [ag for ag in (PARAMS.major + PARAMS.minor) if ag in antigens]
 
-    def get_usability_system(self, system_antigens, antigens, phenotypes, prevalences, part_african):
+        usability_ABO = get_usability_system(vector, ["A", "B"], antigens, PARAMS.ABO_phenotypes, PARAMS.ABO_prevalences, part_african)
+        usability_Rhesus = get_usability_system(vector, ["D", "C", "c", "E", "e"], antigens, PARAMS.Rhesus_phenotypes, PARAMS.Rhesus_prevalences, part_african)
+        usability_Kell = get_usability_system(vector, ["K", "k"], antigens, PARAMS.Kell_phenotypes, PARAMS.Kell_prevalences, part_african)
+        usability_MNS = get_usability_system(vector, ["M", "N", "S", "s"], antigens, PARAMS.MNS_phenotypes, PARAMS.MNS_prevalences, part_african)
+        usability_Duffy = get_usability_system(vector, ["Fya", "Fyb"], antigens, PARAMS.Duffy_phenotypes, PARAMS.Duffy_prevalences, part_african)
+        usability_Kidd = get_usability_system(vector, ["Jka", "Jkb"], antigens, PARAMS.Kidd_phenotypes, PARAMS.Kidd_prevalences, part_african)
 
-        # TODO now the usability is only calculated if all antigens of the system are included. Extend this to calculating it for only selected antigens.
-        if all(ag in antigens for ag in system_antigens):
-            
-            usability = 0
-            vector_indices = [antigens.index(k) for k in system_antigens]
+    # Return the product of all the invdiviual system usabilities to compute the final usabilty.
+    return usability_ABO * usability_Rhesus * usability_Kell * usability_MNS * usability_Duffy * usability_Kidd
 
-            # Calculate the ABO-usability of this blood product, by summing all prevalences of the phenotypes that can receive this product.
-            vector = [self.vector[i] for i in vector_indices]
-            for g in range(len(phenotypes)):
-                if all(v <= g for v, g in zip(vector, phenotypes[g])):
-                    usability += prevalences["African"][g] * part_african
-                    usability += prevalences["Caucasian"][g] * (1 - part_african)
 
-            return usability
+def get_usability_system(vector, system_antigens, antigens, phenotypes, prevalences, part_african):
+
+    # TODO now the usability is only calculated if all antigens of the system are included. Extend this to calculating it for only selected antigens.
+    if all(ag in antigens for ag in system_antigens):
+        
+        usability = 0
+        vector_indices = [antigens.index(k) for k in system_antigens]
+
+        # Calculate the ABO-usability of this blood product, by summing all prevalences of the phenotypes that can receive this product.
+        vector = [vector[i] for i in vector_indices]
+        for g in range(len(phenotypes)):
+            if all(v <= g for v, g in zip(vector, phenotypes[g])):
+                usability += prevalences["African"][g] * part_african
+                usability += prevalences["Caucasian"][g] * (1 - part_african)
+
+        return usability
+
+    else:
+        return 1
+
+
+# Get the part of the total demand of the given hospitals that comes from African patients.
+def get_part_african(PARAMS, hospitals):
+
+    # TODO this is now hardcoded for the case where SCD patients are Africans and all others are Caucasions.
+    avg_daily_demand_african = sum([PARAMS.patgroup_distr[hospital.htype]["SCD"] * hospital.avg_daily_demand for hospital in hospitals])
+    avg_daily_demand_total = sum([hospital.avg_daily_demand for hospital in hospitals])
+    return avg_daily_demand_african / avg_daily_demand_total
+
+
+# Get the usability of many phenotype vectors at once, with the same outcome as vector_usability for each row.
+def vectors_usability(PARAMS, vectors, part_african, antigens = []):
+
+    vectors = np.asarray(vectors)
+
+    if antigens == []:
+        # ABO-usability, and RhD-usability which is 1 for RhD negative products and the prevalence of RhD positive phenotypes otherwise.
+        usability_ABO = get_usability_systems(vectors[:,:2], PARAMS.ABO_phenotypes, PARAMS.ABO_prevalences, part_african)
+        Dpos = np.array([g[0] for g in PARAMS.Rhesus_phenotypes])
+        Dpos_prevalence = sum(np.array(PARAMS.Rhesus_prevalences["African"]) * part_african * Dpos) + sum(np.array(PARAMS.Rhesus_prevalences["Caucasian"]) * (1 - part_african) * Dpos)
+        usability_RhD = np.where(vectors[:,2] == 1, Dpos_prevalence, 1)
+
+        return usability_ABO * usability_RhD
+
+    else:
+        # Get intersection of all antigens given to consider, and all antigens in the model.
+        antigens = [ag for ag in (PARAMS.major + PARAMS.minor) if ag in antigens]
+
+        usability = np.ones(len(vectors))
+        for system_antigens, phenotypes, prevalences in [
+                (["A", "B"], PARAMS.ABO_phenotypes, PARAMS.ABO_prevalences),
+                (["D", "C", "c", "E", "e"], PARAMS.Rhesus_phenotypes, PARAMS.Rhesus_prevalences),
+                (["K", "k"], PARAMS.Kell_phenotypes, PARAMS.Kell_prevalences),
+                (["M", "N", "S", "s"], PARAMS.MNS_phenotypes, PARAMS.MNS_prevalences),
+                (["Fya", "Fyb"], PARAMS.Duffy_phenotypes, PARAMS.Duffy_prevalences),
+                (["Jka", "Jkb"], PARAMS.Kidd_phenotypes, PARAMS.Kidd_prevalences)]:
+
+            # Systems of which not all antigens are considered have a usability of 1, as in get_usability_system.
+            if all(ag in antigens for ag in system_antigens):
+                vector_indices = [antigens.index(k) for k in system_antigens]
+                usability = usability * get_usability_systems(vectors[:,vector_indices], phenotypes, prevalences, part_african)
+
+        return usability
+
+
+# For each row of the given vectors, sum the prevalences of all phenotypes of the system that can receive it. The prevalences
+# are added one phenotype at a time (cumsum), so that the outcome is exactly equal to that of get_usability_system.
+def get_usability_systems(vectors, phenotypes, prevalences, part_african):
+
+    receivable = (vectors[:,np.newaxis,:] <= np.array(phenotypes)[np.newaxis,:,:]).all(axis=2)
+    terms = np.array([prevalences["African"], prevalences["Caucasian"]]).T * np.array([part_african, 1 - part_african])
+    terms = receivable[:,:,np.newaxis] * terms[np.newaxis,:,:]
+
+    return np.cumsum(np.hstack([np.zeros([len(vectors), 1]), terms.reshape(len(vectors), -1)]), axis=1)[:,-1]
+
+
+# Bounded cache of product usabilities, keyed on the phenotype key, the set of antigens considered and the part of African
+# demand of the hospitals involved. Usabilities of phenotypes that are not yet cached are computed in bulk by vectors_usability.
+# When the cache is full, the entries that were added first are removed.
+class Usability_cache():
+
+    def __init__(self, maxsize = 100000):
+
+        self.maxsize = maxsize
+        self.values = {}
+        self.hits = 0       # number of products or requests whose usability was taken from the cache
+        self.misses = 0     # number of distinct phenotypes whose usability had to be computed
+
+    # Get the usability of all given products or requests, of which both the phenotype keys and vectors are given.
+    def lookup(self, PARAMS, keys, vectors, hospitals, antigens = []):
+
+        part_african = get_part_african(PARAMS, hospitals)
+        subset = tuple(antigens)
+
+        # Look up the usability of every distinct phenotype, and compute the ones that are missing all at once.
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        usability = np.array([self.values.get((k, subset, part_african), np.nan) for k in unique.tolist()])
+        missing = np.isnan(usability)
+        if missing.any():
+            usability[missing] = vectors_usability(PARAMS, np.asarray(vectors)[first[missing]], part_african, antigens)
+            self.store([(k, subset, part_african) for k in unique[missing].tolist()], usability[missing].tolist())
+
+        self.misses += int(missing.sum())
+        self.hits += len(keys) - int(missing.sum())
+
+        return usability[inverse.reshape(-1)]
+
+    # Add the given usabilities to the cache, removing the oldest entries if the maximum size would be exceeded.
+    def store(self, entries, values):
+
+        excess = len(self.values) + len(entries) - self.maxsize
+        for entry in list(itertools.islice(self.values, max(0, excess))):
+            del self.values[entry]
+        self.values.update(zip(entries[-self.maxsize:], values[-self.maxsize:]))
+
+
+# Sample random phenotypes for many products or requests at once, given their ethnicities as indices in PARAMS.ethnicities. For each blood
+# group system, a phenotype is drawn according to the prevalences in the corresponding ethnical population, as in the Blood constructor.
+# Optionally, a major blood group (e.g. "A+", or "" to sample it as well) can be given for each product.
+def sample_phenotypes(PARAMS, ethnicities, rng, majors=None):
+
+    ethnicities = np.asarray(ethnicities)
+    systems = [(PARAMS.ABO_phenotypes, PARAMS.ABO_prevalences), (PARAMS.Rhesus_phenotypes, PARAMS.Rhesus_prevalences), (PARAMS.Kell_phenotypes, PARAMS.Kell_prevalences),
+               (PARAMS.MNS_phenotypes, PARAMS.MNS_prevalences), (PARAMS.Duffy_phenotypes, PARAMS.Duffy_prevalences), (PARAMS.Kidd_phenotypes, PARAMS.Kidd_prevalences)]
+
+    vectors = []
+    for phenotypes, prevalences in systems:
+        vectors.append(np.array(phenotypes, dtype=np.uint8)[sample_categories([prevalences[eth] for eth in PARAMS.ethnicities], ethnicities, rng)])
+    vectors = np.hstack(vectors)
+
+    # For the given major blood groups, set the A and B antigens accordingly, and sample the other Rhesus antigens based on their prevalences given RhD.
+    if majors is not None:
+        majors = np.asarray(majors, dtype=str)
+        given = majors != ""
+        vectors[given,0] = np.char.find(majors[given], "A") >= 0
+        vectors[given,1] = np.char.find(majors[given], "B") >= 0
+
+        Rhesus_D = np.array([genotype[0] for genotype in PARAMS.Rhesus_phenotypes])
+        weights = [np.array(PARAMS.Rhesus_prevalences[eth]) * (Rhesus_D == D) for eth in PARAMS.ethnicities for D in [1, 0]]
+        rows = 2 * ethnicities[given] + (np.char.find(majors[given], "+") < 0)
+        vectors[given,2:7] = np.array(PARAMS.Rhesus_phenotypes, dtype=np.uint8)[sample_categories(weights, rows, rng)]
+
+    antigens_vector = ["A", "B", "D", "C", "c", "E", "e", "K", "k", "M", "N", "S", "s", "Fya", "Fyb", "Jka", "Jkb"]
+    return vectors[:,[antigens_vector.index(ag) for ag in (PARAMS.major + PARAMS.minor)]]
+
+
+# For each given row index, draw a category according to the weights in the corresponding row of the given table, using cumulative weights.
+def sample_categories(weights, rows, rng):
+
+    cumulative = np.cumsum(np.array(weights, dtype=float), axis=1)
+    cumulative /= cumulative[:,-1:]
+    u = rng.random(len(rows))
+    return np.minimum((cumulative[rows] <= u[:,np.newaxis]).sum(axis=1), cumulative.shape[1] - 1)
 
-        else:
-            return 1
-            
 
 # Obtain the major blood group from a blood antigen vector.
 def vector_to_major(vector):
@@ -192,41 +330,110 @@ def vector_to_major(vector):
 # For each inventory product i∈I and request r∈R, T[i,r] = 1 if product i 
 # will not yet be outdated by the time request r needs to be issued.
 def timewise_possible(SETTINGS, PARAMS, I, R, day):
-    
+
     T = np.zeros([len(I), len(R)])
-    for i in I.keys():
-        for r in R.keys():
-            T[i,r] = 1 if (PARAMS.max_age - 1 - I[i].age) >= (R[r].day_issuing - day) else 0
+    T[:,:] = (PARAMS.max_age - 1 - I.age[:,np.newaxis]) >= (R.day_issuing[np.newaxis,:] - day)
     return T
 
+
+# For each request r∈R, t[r] = 1 if its issuing day is the given day, 0 if it lies further in the future, and 2 if it is one day earlier.
+# The single-hospital model passes today as the given day, the multi-hospital model passes tomorrow, so that today's requests get t[r] = 2.
+def issuing_urgency(R, day):
+    return 1 - np.minimum(1, R.day_issuing - day)
+
+
+# Sparse index of all pairs (i,r) for which product i∈I is both compatible with request r∈R (C) and not outdated before r has to be issued (T).
+# The pairs are ordered by product and then by request, and are the only pairs for which the models create an assignment variable.
+def eligible_pairs(C, T):
+    return [(i, r) for i, r in np.argwhere((C == 1) & (T == 1)).tolist()]
+
+
+# Pack binary antigen vectors (one row per product or request) into integer phenotype keys. The first antigen
+# is the most significant bit, so that the keys are equal to those of Blood.vector_to_bloodgroup_index.
+def vectors_to_keys(vectors):
+
+    vectors = np.asarray(vectors, dtype=np.uint32)
+    bits = np.left_shift(np.uint32(1), np.arange(vectors.shape[-1] - 1, -1, -1, dtype=np.uint32))
+    return (vectors * bits).sum(axis=-1, dtype=np.uint32)
+
+
+# Unpack integer phenotype keys into binary antigen vectors of the given length, the inverse of vectors_to_keys.
+def keys_to_vectors(keys, length):
+
+    keys = np.asarray(keys, dtype=np.uint32)
+    return ((keys[...,np.newaxis] >> np.arange(length - 1, -1, -1, dtype=np.uint32)) & 1).astype(np.uint8)
+
+
+# Get the packed key of a set of antigens, given by their names.
+def antigens_to_key(PARAMS, antigens):
+    return vectors_to_keys([1 if ag in antigens else 0 for ag in (PARAMS.major + PARAMS.minor)])
+
+
+# Lookup tables over all 2^17 possible sets of antigens, packed into an integer key. For each patient group p and set m,
+# compatible[p,m] = 1 if m contains none of the antigens that are a 'must' for p, and penalty[p,m] is the total weight of
+# mismatching on all antigens in m. The tables only depend on the matching strategy, and are computed once per strategy.
+@functools.lru_cache(maxsize=None)
+def phenotype_lookup(PARAMS, strategy, patgroup_musts):
+
+    antigens = PARAMS.major + PARAMS.minor
+    sets = np.arange(2 ** len(antigens), dtype=np.uint32)
+
+    # For each patient group, the packed set of antigens on which a mismatch is not allowed.
+    if ("patgroups" in strategy) or patgroup_musts:
+        musts = vectors_to_keys(PARAMS.patgroup_must_mask)
+    else:
+        musts = np.full(len(PARAMS.patgroups), antigens_to_key(PARAMS, PARAMS.major), dtype=np.uint32)
+    compatible = (sets[np.newaxis,:] & musts[:,np.newaxis]) == 0
+
+    # Mismatch weights for each patient group and antigen, where the relimm and major strategies use the same weights for all groups.
+    if "patgroups" in strategy:
+        w = np.array(PARAMS.patgroup_weights.loc[PARAMS.patgroups, antigens])
+    elif "relimm" in strategy:
+        w = np.tile(np.array(PARAMS.relimm_weights[antigens])[0], (len(PARAMS.patgroups), 1))
+    else:
+        w = np.zeros([len(PARAMS.patgroups), len(antigens)])
+    bits = (sets[:,np.newaxis] >> np.arange(len(antigens) - 1, -1, -1, dtype=np.uint32)) & 1
+    penalty = w @ bits.T
+
+    return compatible, penalty
+
+
+# Packed set of all antigens that have an effect in the MINRAR models: the major antigens (usability), the antigens on which a mismatch is
+# not allowed for some patient group, and the antigens with a nonzero mismatch weight for some patient group (which also weight substitutions).
+# Products or requests that have the same phenotype on these antigens are interchangeable in the models.
+def relevant_antigens_key(SETTINGS, PARAMS):
+
+    antigens = PARAMS.major + PARAMS.minor
+    compatible, penalty = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
+    bits = np.array([antigens_to_key(PARAMS, [ag]) for ag in antigens], dtype=np.uint32)
+    relevant = (penalty[:,bits] != 0).any(axis=0) | (compatible[:,bits] == False).any(axis=0) | np.isin(antigens, PARAMS.major)
+
+    return vectors_to_keys(relevant)
+
+
+# For each product i and request r, M[i,r] is the packed set of antigens for which i is positive and r is negative. Products and
+# requests are grouped by phenotype key, so that the sets are only computed once for every pair of distinct phenotypes.
+# If fyb_rule is True, Fyb is excluded for requests that are negative for Fya, as Fy(a-b-) patients are only matched on Fya.
+def mismatched_antigens(PARAMS, keys_i, keys_r, fyb_rule = True):
+
+    ui, inv_i = np.unique(keys_i, return_inverse=True)
+    ur, inv_r = np.unique(keys_r, return_inverse=True)
+
+    M = ui[:,np.newaxis] & ~ur[np.newaxis,:]
+    if fyb_rule:
+        M[:,(ur & antigens_to_key(PARAMS, ["Fya"])) == 0] &= ~antigens_to_key(PARAMS, ["Fyb"])
+
+    return M[inv_i.reshape(-1)][:,inv_r.reshape(-1)]
+
+
 # For each inventory product i∈I and request r∈R, C[i,r] = 1 if 
 # i and r are compatible on the major and mandatory antigens.
 def precompute_compatibility(SETTINGS, PARAMS, I, R):
 
-    antigens = PARAMS.major + PARAMS.minor
-    C = np.zeros([len(I), len(R)])
-
-    if ("patgroups" in SETTINGS.strategy) or SETTINGS.patgroup_musts:
-        for r in R.keys():
-            # pg = R[r].patgroup
-            # r_string = R[r].vector_strings[pg]
-            for i in I.keys():
-                # if not_compatible(int(r_string), int(I[i].vector_strings[pg]), len(r_string)) == 0:
-                    # C[i,r] = 1
-                v_musts_ir = [(I[i].vector[k], R[r].vector[k]) for k in range(len(antigens)) if PARAMS.patgroup_weights.loc[R[r].patgroup,antigens[k]] == 10]
-                if all(vi <= vr for vi, vr in v_musts_ir):
-                    C[i,r] = 1
+    compatible, _ = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
 
-    else:
-        # for r in R.keys():
-        #     r_string = R[r].vector_string
-        #     for i in I.keys():
-        #         if not_compatible(int(r_string), int(I[i].vector_string), len(r_string)) == 0:
-        #             C[i,r] = 1
-        num_major = len(PARAMS.major)
-        for i in I.keys():
-            for r in R.keys():
-                if all(vi <= vr for vi, vr in zip(I[i].vector[:num_major], R[r].vector[:num_major])):
-                    C[i,r] = 1
+    # Product i is compatible with request r if it is not positive for any of the request's must-antigens that r is negative for.
+    C = np.zeros([len(I), len(R)])
+    C[:,:] = compatible[R.patgroup[np.newaxis,:], mismatched_antigens(PARAMS, I.keys, R.keys, fyb_rule = False)]
 
     return C
\ No newline at end of file
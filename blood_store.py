@@ -0,0 +1,84 @@
+import numpy as np
+import copy
+
+from blood import *
+
+
+class Blood_store():
+
+    # Names of all properties that are stored as a numpy array with one entry per product or request.
+    columns = ["vectors", "keys", "age", "index", "ethnicity", "major", "patgroup", "num_units", "day_issuing", "day_available", "allocated_from_dc"]
+
+    # An instance of this class holds a set of inventory products or patient requests in columnar form. The properties of
+    # a Blood instance are stored as arrays, where ethnicity, major blood group and patient group are stored as indices in
+    # PARAMS.ethnicities, PARAMS.ABOD and PARAMS.patgroups respectively (patient group -1 for inventory products).
+    def __init__(self, PARAMS, vectors = None, index = -1, ethnicity = 0, patgroup = -1, num_units = 0, day_issuing = 0, day_available = 0, age = 0):
+
+        antigens = PARAMS.major + PARAMS.minor
+
+        if vectors is None:
+            vectors = np.zeros([0, len(antigens)])
+        self.vectors = np.array(vectors, dtype=np.uint8).reshape(-1, len(antigens))
+        n = len(self.vectors)
+
+        # Phenotype key of each product or request, packing the antigen vector into one integer.
+        self.keys = vectors_to_keys(self.vectors)
+
+        # All other properties are either given per product or request, or as a single value that holds for all.
+        self.age = np.array(np.broadcast_to(age, n), dtype=int)
+        self.index = np.array(np.broadcast_to(index, n), dtype=int)
+        self.ethnicity = np.array(np.broadcast_to(ethnicity, n), dtype=np.int8)
+        self.patgroup = np.array(np.broadcast_to(patgroup, n), dtype=np.int8)
+        self.num_units = np.array(np.broadcast_to(num_units, n), dtype=int)
+        self.day_issuing = np.array(np.broadcast_to(day_issuing, n), dtype=int)
+        self.day_available = np.array(np.broadcast_to(day_available, n), dtype=int)
+        self.allocated_from_dc = np.zeros(n, dtype=int)
+
+        # Index of the major blood group in PARAMS.ABOD, looked up from the phenotypes on antigens A, B and D.
+        majors = [PARAMS.ABOD.index(vector_to_major([a, b, d])) for a in range(2) for b in range(2) for d in range(2)]
+        self.major = np.array(majors, dtype=np.int8)[(4 * self.vectors[:,0]) + (2 * self.vectors[:,1]) + self.vectors[:,2]]
+
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+    # Add all products or requests of another store to the end of this store.
+    def extend(self, other):
+        for col in self.columns:
+            setattr(self, col, np.concatenate([getattr(self, col), getattr(other, col)]))
+
+
+    # Get a new store containing only the selected products or requests, given by a boolean mask or an array of indices.
+    def select(self, selection):
+        store = copy.copy(self)
+        for col in self.columns:
+            setattr(store, col, getattr(self, col)[selection])
+        return store
+
+
+    # Remove all products or requests for which the given boolean mask is True.
+    def remove(self, mask):
+        for col in self.columns:
+            setattr(self, col, getattr(self, col)[~mask])
+
+
+    # Get all columns of the store as a dictionary of arrays, with the given prefix added to the column names.
+    def to_arrays(self, prefix = ""):
+        return {prefix + col : getattr(self, col) for col in self.columns}
+
+
+    # Replace all columns of the store by the arrays in the given dictionary, as obtained from to_arrays with the same prefix.
+    def set_arrays(self, arrays, prefix = ""):
+        for col in self.columns:
+            setattr(self, col, np.array(arrays[prefix + col]))
+
+
+    # Increase the age of all products by one day, except for products that are outdated at the end of this day.
+    def increase_age(self, PARAMS):
+        self.age[self.age < (PARAMS.max_age-1)] += 1
+
+
+    # Get the usability of all products or requests, as calculated by Blood.get_usability, using the cache of usabilities per phenotype.
+    def get_usability(self, PARAMS, hospitals, antigens = []):
+        return PARAMS.usability_cache.lookup(PARAMS, self.keys, self.vectors, hospitals, antigens)
@@ -1,8 +1,11 @@
 import pandas as pd
+import numpy as np
 import pickle
 import sys
 
 from blood import *
+from blood_store import *
+from scenario import *
 
 class Distribution_center():
     
@@ -12,8 +15,8 @@ class Distribution_center():
         self.name = f"dc_{e}"
 
         try:
-            # Read the supply that was generated using SETTINGS.mode = "supply"
-            self.supply_data = pd.read_csv(SETTINGS.home_dir + f"supply/{SETTINGS.supply_size}/cau{round(SETTINGS.donor_eth_distr[0]*100)}_afr{round(SETTINGS.donor_eth_distr[1]*100)}_asi{round(SETTINGS.donor_eth_distr[2]*100)}_{e}.csv")
+            # Read the supply that was generated using SETTINGS.mode = "supply", and store it in columnar form, in the order in which it will be received.
+            self.supply = load_supply(PARAMS, SETTINGS.home_dir + f"supply/{SETTINGS.supply_size}/cau{round(SETTINGS.donor_eth_distr[0]*100)}_afr{round(SETTINGS.donor_eth_distr[1]*100)}_asi{round(SETTINGS.donor_eth_distr[2]*100)}_{e}")
         except:
             print("Error: No supply data available. Generate supply data by changing the 'self.mode' variable in the 'settings.py' file to 'supply' and run main again.")
             sys.exit(1)
@@ -27,50 +30,38 @@ class Distribution_center():
             self.inventory_size = SETTINGS.inv_size_factor_dc * sum([hospital.avg_daily_demand for hospital in hospitals])
 
             # Initialize the inventory with products from the supply data, where the product's age is uniformly distributed between 0 and the maximum shelf life.
-            inventory = []
+            self.inventory = Blood_store(PARAMS)
             n_products = round(self.inventory_size / PARAMS.max_age)
             for age in range(PARAMS.max_age):
-                inventory += self.sample_supply_single_day(PARAMS, n_products, age)
-
-            self.inventory = inventory
+                self.inventory.extend(self.sample_supply_single_day(PARAMS, n_products, age))
 
 
     # Update the distribution centers's inventory at the end of a day in the simulation.
     def update_inventory(self, SETTINGS, PARAMS, x, day):
 
-        I = {i : self.inventory[i] for i in range(len(self.inventory))}
-        remove = []
-
         # Remove all products from inventory that will be shipped to a hospital.
         xi = x.sum(axis=1)
-        remove += [i for i in I.keys() if xi[i] >= 1]
+        shipped = xi >= 1
 
         # If a product will be outdated at the end of this day, remove from inventory, otherwise increase its age.
-        for i in I.keys():
-            if I[i].age >= (PARAMS.max_age-1):
-                remove.append(i)
-            else:
-                I[i].age += 1
+        outdated = self.inventory.age >= (PARAMS.max_age-1)
 
-        self.inventory = [I[i] for i in I.keys() if i not in remove]
+        self.inventory.remove(shipped | outdated)
+        self.inventory.increase_age(PARAMS)
         
         # Supply the inventory upto its capacity with new products from the supply data.
-        self.inventory += self.sample_supply_single_day(PARAMS, max(0, self.inventory_size - len(self.inventory)))
+        self.inventory.extend(self.sample_supply_single_day(PARAMS, max(0, self.inventory_size - len(self.inventory))))
 
 
     # Read the required number of products from the supply data and add these products to the distribution center's inventory.
     def sample_supply_single_day(self, PARAMS, n_products, age = 0):
 
-        # Select the next part of the supply scenario.
-        data = self.supply_data.iloc[self.supply_index : self.supply_index + n_products]
+        # Select the next part of the supply scenario. Except for the age, the columns of the selected store are views on the supply data.
+        data = self.supply.select(slice(self.supply_index, self.supply_index + n_products))
+        data.age = np.full(len(data), age, dtype=int)
         self.supply_index += n_products
 
-        # Transform the newly received supply, as read from the data file, to instances of the Blood class.
-        supply = []
-        for i in data.index:
-            supply.append(Blood(PARAMS, index = data.loc[i,"Index"], ethnicity = data.loc[i,"Ethnicity"], major = vector_to_major([data.loc[i,a] for a in PARAMS.major]), minor = [data.loc[i,a] for a in PARAMS.minor], age = age))
-
-        return supply
+        return data
 
 
     def pickle(self, path):
@@ -1,10 +1,10 @@
 import numpy as np
 import pandas as pd
-import random
 import math
 import os
 
 from blood import *
+from scenario import *
 
 
 class Demand:
@@ -44,71 +44,53 @@ class Demand:
             self._p = mean / ((self._k + 1) - self._q + mean)
 
 
-    # Generate a list of random requests according to the given distribution.
-    def sample_requests_for_day(self, SETTINGS, PARAMS, day_index, df, htype):
-        
-        # Keep sampling new requests for today until the required number of requests is reached.
-        num_units_requested = self.sample_number_of_units()
-        num_units = 0
-        while num_units < num_units_requested:
-            r = self.get_random_request(SETTINGS, PARAMS, day_index, htype)
-            df.loc[len(df)] = [r.day_issuing, r.day_available, r.num_units, r.patgroup, r.ethnicity] + r.vector
-            num_units += r.num_units
-
-        return df
-
-
-    # Sample a number of units requested based on parameters as computed in the constructor of this class.
+    # Sample the numbers of units requested for n days at once, based on the parameters as computed in the constructor of this class.
     # Source: https://www.win.tue.nl/~iadan/alqt/fit.pdf
-    def sample_number_of_units(self):
-        # For sampling the geometric distribution we use (1-p) as parameter and subtract one to account for the difference in 
-        # definitions for the geometric distribution. See https://en.wikipedia.org/wiki/Geometric_distribution#:~:text=The%20geometric%20distribution%20gives%20the,%2C%203%2C%20
-        # Paper uses the definition on the right, whereas the implementation uses the definition on the left.
+    def sample_numbers_of_units(self, n, rng):
 
-        # Sample geometric.
+        # Sample mixed geometric. The paper's geometric distribution starts at 0, whereas numpy's starts at 1, so its parameter is (1-p)
+        # and one is subtracted from each sample.
         if self._a >= 1:
-            if random.random() < self._q1:
-                return self.sample_geometric(1 - self._p1) - 1
-            else:
-                return self.sample_geometric(1 - self._p2) - 1
-        
-        # Sample negative binomial (repeated geometric sampling).
-        else: 
-            sum = 0
-            if random.random() < self._q:
-                i = 0
-                while i < self._k:
-                    sum += self.sample_geometric(1 - self._p) - 1
-                    i += 1
-            else:
-                i = 0
-                while i < self._k+1:
-                    sum += self.sample_geometric(1 - self._p) - 1
-                    i += 1
-            return sum
-
-
-    def get_random_request(self, SETTINGS, PARAMS, day_issuing, htype):
-
-        # Determine the patient group, lead time, number of units and ethnicity of the patient request.
-        patgroup = random.choices(PARAMS.patgroups, weights = [PARAMS.patgroup_distr[htype][pg] for pg in PARAMS.patgroups], k=1)[0]
-        lead_time = random.choices(range(14), weights = PARAMS.request_lead_time_probabilities[patgroup], k=1)[0]
-        num_units = random.choices(range(1,5), weights = PARAMS.request_num_units_probabilities[patgroup], k=1)[0]
-
-        # The antigen phenotypes for patients with sickle cell disease are modelled according to prevales in the African population,
-        # while patients of all other patient groups are modelled in accordance with the Caucasian population.
-        if patgroup == "SCD":
-            ethnicity = "African"
+            return np.where(rng.random(n) < self._q1, rng.geometric(1 - self._p1, n), rng.geometric(1 - self._p2, n)) - 1
+
+        # Sample mixed negative binomial, as the sum of k or k+1 geometric samples (minus one each) is negative binomially distributed.
         else:
-            ethnicity = "Caucasian"
+            k = np.where(rng.random(n) < self._q, self._k, self._k + 1)
+            return np.where(k > 0, rng.negative_binomial(np.maximum(k, 1), 1 - self._p), 0)
+
+
+# Generate all requests for the given number of days at once, using the demand distributions per day of the week, assuming that the first
+# day is a Monday. For each day, requests are sampled until their total number of units reaches the number of units requested that day.
+def sample_demand(PARAMS, daily_distributions, duration, htype, rng):
+
+    # Sample the number of units requested for each day.
+    weekdays = np.arange(duration) % 7
+    units_requested = np.zeros(duration, dtype=int)
+    for weekday_index in range(7):
+        units_requested[weekdays == weekday_index] = daily_distributions[weekday_index].sample_numbers_of_units((weekdays == weekday_index).sum(), rng)
+
+    # As every request is for at least one unit, no more candidate requests than units requested are needed per day.
+    day_issuing = np.repeat(np.arange(duration), units_requested)
+    patgroup = sample_categories([[PARAMS.patgroup_distr[htype][pg] for pg in PARAMS.patgroups]], np.zeros(len(day_issuing), dtype=int), rng)
+    lead_time = sample_categories([PARAMS.request_lead_time_probabilities[pg] for pg in PARAMS.patgroups], patgroup, rng)
+    num_units = sample_categories([PARAMS.request_num_units_probabilities[pg] for pg in PARAMS.patgroups], patgroup, rng) + 1
 
-        # Create a Blood instance using the generated information.
-        return Blood(PARAMS, ethnicity = ethnicity, patgroup = patgroup, num_units=num_units, day_issuing=day_issuing, day_available=max(0, day_issuing - lead_time))
+    # Keep a candidate request only if the units of the preceding requests on the same day do not yet reach the number of units requested.
+    cumulative_units = np.concatenate([[0], np.cumsum(num_units)])
+    units_before = cumulative_units[:-1] - np.repeat(cumulative_units[np.cumsum(units_requested) - units_requested], units_requested)
+    keep = units_before < np.repeat(units_requested, units_requested)
+    day_issuing, patgroup, lead_time, num_units = day_issuing[keep], patgroup[keep], lead_time[keep], num_units[keep]
 
-    # Sample a geometric distribution with parameter p (mean = 1/p)
-    # This method is a replacement for MathNet.Numerics.Distributions.Geometric(p)
-    def sample_geometric(self, p):
-        return int(math.ceil(math.log(1 - random.random()) / math.log(1 - p)))
+    # The antigen phenotypes for patients with sickle cell disease are modelled according to prevales in the African population,
+    # while patients of all other patient groups are modelled in accordance with the Caucasian population.
+    ethnicity = np.where(np.array(PARAMS.patgroups)[patgroup] == "SCD", PARAMS.ethnicities.index("African"), PARAMS.ethnicities.index("Caucasian"))
+    vectors = sample_phenotypes(PARAMS, ethnicity, rng)
+
+    df = pd.DataFrame({"Day Needed" : day_issuing, "Day Available" : np.maximum(0, day_issuing - lead_time), "Num Units" : num_units,
+                        "Patient Type" : np.array(PARAMS.patgroups)[patgroup], "Ethnicity" : np.array(PARAMS.ethnicities)[ethnicity]})
+    df[PARAMS.major + PARAMS.minor] = vectors
+
+    return df
 
 
 # Generate a given number of demand files, where each file contains all demand for one simulation episode.
@@ -129,31 +111,18 @@ def generate_demand(SETTINGS, PARAMS, htype, avg_daily_demand):
     if os.path.exists(path) == False:
         os.mkdir(path)
 
-    # Find already existing demand files of the chosen size and duration, and make sure not to overwrite them.
-    i = 0
-    while os.path.exists(SETTINGS.home_dir + f"demand/{avg_daily_demand}/{duration}/{htype}_{i}.csv"):
-        i += 1
-
-    # For every episode in the given range, generate requests for all days of the simulation.
-    for _ in range(SETTINGS.episodes[0],SETTINGS.episodes[1]):
-
-        print(f"Generating demand '{htype}_{i}'.")
-
-        # Initialize distributions for each day of the week.
-        daily_distributions = []
-        for weekday_index in range(7):
-            daily_distributions.append(Demand(weekday_index, avg_daily_demand))
-
-        df = pd.DataFrame(columns = ["Day Needed", "Day Available", "Num Units", "Patient Type", "Ethnicity"] + PARAMS.major + PARAMS.minor)
-
-        # Generate requests for each day in the simulation, using the demand distributions per day of the week, assuming that the first day is a Monday.
-        requests = []
-        for day_index in range(duration):
-            df = daily_distributions[day_index%7].sample_requests_for_day(SETTINGS, PARAMS, day_index, df, htype)
-
-        df.to_csv(SETTINGS.home_dir + f"demand/{avg_daily_demand}/{duration}/{htype}_{i}.csv", index=False)
+    # Generate the demand files for all hospitals of this type in every episode in the given range, where hospital i in episode e reads
+    # demand file e * n + i, with n the number of hospitals of this type. Each file contains requests for all days of the simulation.
+    n = SETTINGS.n_hospitals[htype]
+    generate_scenarios(SETTINGS, PARAMS, sample_demand_scenario, (htype, avg_daily_demand, duration), path + f"/{htype}", "demand", range(SETTINGS.episodes[0] * n, SETTINGS.episodes[1] * n))
 
-        i += 1
 
+# Sample a single demand scenario, containing requests for all days of the simulation.
+def sample_demand_scenario(SETTINGS, PARAMS, htype, avg_daily_demand, duration, rng):
 
+    # Initialize distributions for each day of the week.
+    daily_distributions = []
+    for weekday_index in range(7):
+        daily_distributions.append(Demand(weekday_index, avg_daily_demand))
 
+    return sample_demand(PARAMS, daily_distributions, duration, htype, rng)
@@ -0,0 +1,173 @@
+import numpy as np
+import time
+
+from scipy.optimize import linear_sum_assignment
+
+from blood import *
+from blood_store import *
+from presolve import *
+
+
+# Single-hospital setup: match the hospital's inventory products to its requests with the heuristic policy given by SETTINGS.heuristic_policy,
+# instead of solving the MINRAR model. The assignments, shortages and mismatches are returned in the same form as by minrar_single_hospital.
+def heuristic_single_hospital(SETTINGS, PARAMS, hospital, day, df):
+
+    start = time.perf_counter()
+
+    products, requests = hospital.inventory, hospital.requests
+    eligible = (precompute_compatibility(SETTINGS, PARAMS, products, requests) == 1) & (timewise_possible(SETTINGS, PARAMS, products, requests, day) == 1)
+    cost = matching_costs(SETTINGS, PARAMS, products, requests, [hospital])
+
+    # Assign a higher shortage penalty to requests with today as their issuing date, as in the MINRAR model.
+    shortage = (len(requests) * issuing_urgency(requests, day)) + 1
+
+    x = match_requests(SETTINGS, eligible, cost, shortage, products.age, requests, requests.get_usability(PARAMS, [hospital]))
+    y, z = shortages_and_mismatches(PARAMS, requests, [(x, products.keys)])
+
+    stop = time.perf_counter()
+    print(f"{SETTINGS.heuristic_policy} matching: {(stop - start):0.4f} seconds")
+    df.set(day, hospital.name, "calc time", stop - start)
+
+    return df, x, y, z
+
+
+# Multi-hospital setup: match the inventories of all hospitals and the distribution center to the requests of all hospitals with the heuristic
+# policy given by SETTINGS.heuristic_policy. All requests are matched as one problem, where each hospital's products are only eligible for its
+# own requests, and products of the distribution center are eligible for requests of all hospitals, but not for requests issued today.
+def heuristic_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df):
+
+    start = time.perf_counter()
+
+    H = range(len(hospitals))
+    Ih = np.cumsum([0] + [len(hospitals[h].inventory) for h in H])     # Rows of each hospital's products, followed by the dc's products.
+    Rh = np.cumsum([0] + [len(hospitals[h].requests) for h in H])      # Columns of each hospital's requests.
+
+    eligible = np.zeros([Ih[-1] + len(dc.inventory), Rh[-1]], dtype=bool)
+    cost = np.zeros(eligible.shape)
+    shortage = np.zeros(Rh[-1])
+    usability = np.zeros(Rh[-1])
+
+    for h in H:
+        products, requests = hospitals[h].inventory, hospitals[h].requests
+        cols = slice(Rh[h], Rh[h+1])
+
+        eligible[Ih[h]:Ih[h+1],cols] = (precompute_compatibility(SETTINGS, PARAMS, products, requests) == 1) & (timewise_possible(SETTINGS, PARAMS, products, requests, day) == 1)
+        eligible[Ih[-1]:,cols] = (precompute_compatibility(SETTINGS, PARAMS, dc.inventory, requests) == 1) & (timewise_possible(SETTINGS, PARAMS, dc.inventory, requests, day) == 1)
+        eligible[Ih[-1]:,cols] &= (requests.day_issuing > day)[np.newaxis,:]
+
+        # The MINRAR model does not charge the fifo and usability penalties for products of the distribution center.
+        cost[Ih[h]:Ih[h+1],cols] = matching_costs(SETTINGS, PARAMS, products, requests, [hospitals[h]])
+        cost[Ih[-1]:,cols] = matching_costs(SETTINGS, PARAMS, dc.inventory, requests, [hospitals[h]], fifo = False)
+
+        # Requests issued today get the highest shortage penalty, followed by those issued tomorrow, as in the MINRAR model.
+        shortage[cols] = (len(requests) * issuing_urgency(requests, day + 1)) + 1
+        usability[cols] = requests.get_usability(PARAMS, [hospitals[h]])
+
+    # Match all products to all requests at once, and split the assignments by hospital.
+    age = np.concatenate([hospitals[h].inventory.age for h in H] + [dc.inventory.age])
+    requests = Blood_store(PARAMS)
+    for h in H:
+        requests.extend(hospitals[h].requests)
+    x = match_requests(SETTINGS, eligible, cost, shortage, age, requests, usability)
+
+    xh, xdc, y, z = [], [], [], []
+    for h in H:
+        xh.append(x[Ih[h]:Ih[h+1],Rh[h]:Rh[h+1]])
+        xdc.append(x[Ih[-1]:,Rh[h]:Rh[h+1]])
+        yh, zh = shortages_and_mismatches(PARAMS, hospitals[h].requests, [(xh[h], hospitals[h].inventory.keys), (xdc[h], dc.inventory.keys)])
+        y.append(yh)
+        z.append(zh)
+
+    stop = time.perf_counter()
+    print(f"{SETTINGS.heuristic_policy} matching: {(stop - start):0.4f} seconds")
+    for hospital in hospitals:
+        df.set(day, hospital.name, "calc time", stop - start)
+
+    return df, xh, xdc, y, z
+
+
+# For each product i and request r, the cost of issuing i to r: the weighted mismatches of the pair (with the same factor 5 as in the MINRAR
+# model) plus the pair's coefficient in the MINRAR model's second objective (see assignment_costs).
+def matching_costs(SETTINGS, PARAMS, products, requests, hospitals, fifo = True):
+
+    _, penalty = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
+    mismatch = penalty[requests.patgroup[np.newaxis,:], mismatched_antigens(PARAMS, products.keys, requests.keys)]
+    return (5 * mismatch) + assignment_costs(SETTINGS, PARAMS, products, requests, hospitals, fifo)
+
+
+# Match products to requests with the policy given by SETTINGS.heuristic_policy, where eligible[i,r] and cost[i,r] give for each product i
+# and request r whether i may be issued to r and at what cost, and shortage[r] the penalty for not fully satisfying r. Requests are only
+# issued products if all their requested units can be satisfied. Returns x, with x[i,r] = 1 if product i is issued to request r.
+#   "fifo": requests are served in order of their issuing dates, each by the oldest eligible products.
+#   "greedy": requests are served in order of their issuing dates and, within a day, from the lowest to the highest usability, as these are
+#             the hardest to match, each by the cheapest eligible products.
+#   "flow": all units requested are matched at once by a minimum cost assignment, where leaving a unit unsatisfied costs an equal part of its
+#           request's shortage penalty. Requests that are only partially satisfied are left short afterwards.
+def match_requests(SETTINGS, eligible, cost, shortage, age, requests, usability):
+
+    if SETTINGS.heuristic_policy == "fifo":
+        order = np.argsort(requests.day_issuing, kind="stable")
+        return match_greedily(eligible, np.broadcast_to(-age[:,np.newaxis], eligible.shape), order, requests.num_units)
+
+    elif SETTINGS.heuristic_policy == "greedy":
+        order = np.lexsort([usability, requests.day_issuing])
+        return match_greedily(eligible, cost, order, requests.num_units)
+
+    else:
+        return match_min_cost(eligible, cost, shortage, requests.num_units)
+
+
+# Serve the requests one by one in the given order, each by the cheapest products that are eligible for it and not yet issued.
+# Products with equal costs are issued in the order of their positions.
+def match_greedily(eligible, cost, order, num_units):
+
+    x = np.zeros(eligible.shape)
+    available = np.ones(len(eligible), dtype=bool)
+
+    for r in order.tolist():
+        candidates = np.flatnonzero(eligible[:,r] & available)
+        if len(candidates) < num_units[r]:
+            continue
+        issued = candidates[np.argsort(cost[candidates,r], kind="stable")[:num_units[r]]]
+        x[issued,r] = 1
+        available[issued] = False
+
+    return x
+
+
+# Match all units requested at once, as a minimum cost assignment of products to units. Each unit also has its own dummy product, which
+# represents leaving the unit unsatisfied, so that a complete assignment always exists.
+def match_min_cost(eligible, cost, shortage, num_units):
+
+    units = np.repeat(np.arange(eligible.shape[1]), num_units)
+    unit_cost = np.where(eligible[:,units], cost[:,units], np.inf)
+    dummy_cost = np.full([len(units), len(units)], np.inf)
+    np.fill_diagonal(dummy_cost, shortage[units] / num_units[units])
+
+    rows, cols = linear_sum_assignment(np.vstack([unit_cost, dummy_cost]))
+    issued = rows < len(eligible)
+
+    x = np.zeros(eligible.shape)
+    x[rows[issued], units[cols[issued]]] = 1
+
+    # Requests that are not fully satisfied are short, and do not keep any of their products.
+    x[:,x.sum(axis=0) < num_units] = 0
+
+    return x
+
+
+# Get the shortages y and mismatches z that result from assigning products to a hospital's requests, in the form of the MINRAR model's variables.
+# The assignments are given as pairs (x, keys) of an assignment matrix and the phenotype keys of its products, one for each inventory.
+def shortages_and_mismatches(PARAMS, requests, assignments):
+
+    y = (sum([x.sum(axis=0) for x, _ in assignments]) < requests.num_units).astype(float)
+
+    # Packed set of antigens on which any of the products issued to each request mismatches.
+    mismatched = np.zeros(len(requests), dtype=np.uint32)
+    for x, keys in assignments:
+        mismatched |= np.bitwise_or.reduce(np.where(x == 1, mismatched_antigens(PARAMS, keys, requests.keys), np.uint32(0)), axis=0)
+
+    bits = np.array([antigens_to_key(PARAMS, [ag]) for ag in PARAMS.major + PARAMS.minor], dtype=np.uint32)
+    z = ((mismatched[:,np.newaxis] & bits[np.newaxis,:]) != 0).astype(float)
+
+    return y, z
@@ -1,8 +1,11 @@
 import pandas as pd
+import numpy as np
 import pickle
 import sys
 
 from blood import *
+from blood_store import *
+from scenario import *
 
 class Hospital():
     
@@ -15,34 +18,39 @@ class Hospital():
 
         try:
             # Read the demand that was generated using SETTINGS.mode = "demand".
-            self.demand_data = pd.read_csv(SETTINGS.home_dir + f"demand/{self.avg_daily_demand}/{SETTINGS.test_days + SETTINGS.init_days}/{htype}_{e}.csv")
+            demand = load_demand(PARAMS, SETTINGS.home_dir + f"demand/{self.avg_daily_demand}/{SETTINGS.test_days + SETTINGS.init_days}/{htype}_{e}")
         except:
             print("Error: No demand data available. Generate demand data by changing the 'self.mode' variable in the 'settings.py' file to 'demand' and run main again.")
             sys.exit(1)
 
-        # TODO maybe have inventory and requests already be a index-product dictionary as used in MINRAR?
-        self.inventory = []
-        self.requests = []
+        # Store all demand in columnar form, ordered by the day that the requests become known, so that the requests becoming
+        # known on day d are rows demand_offsets[d] up to demand_offsets[d+1] of the store. Each request's index is its row in this store.
+        self.demand = demand.select(np.argsort(demand.day_available, kind="stable"))
+        self.demand.index = np.arange(len(self.demand))
+        self.demand_offsets = np.searchsorted(self.demand.day_available, np.arange(SETTINGS.init_days + SETTINGS.test_days + 1))
+
+        # Inventory products and patient requests, both stored in columnar form.
+        self.inventory = Blood_store(PARAMS)
+        self.requests = Blood_store(PARAMS)
+
+        # Persistent MINRAR model of this hospital, only used if SETTINGS.model_builder is "incremental".
+        self.model = None
+
+        # Pairs of product index and request index of the assignments in the last solution, used to warm-start the next day's solve.
+        self.assigned = set()
 
 
     # At the end of a day in the simulation, remove all issued or outdated products, and increase the age of remaining products.
     def update_inventory(self, SETTINGS, PARAMS, x, day):
 
-        I = {i : self.inventory[i] for i in range(len(self.inventory))}
-        remove = []
-
         # Remove all products form inventory that were issued to requests with today as their issuing date
-        for r in [r for r in range(len(self.requests)) if self.requests[r].day_issuing == day]:
-            remove += list(np.where(x[:,r]==1)[0])
+        issued = (x[:,self.requests.day_issuing == day] == 1).any(axis=1)
 
         # If a product will be outdated at the end of this day, remove from inventory, otherwise increase its age.
-        for i in I.keys():
-            if I[i].age >= (PARAMS.max_age-1):
-                remove.append(i)
-            else:
-                I[i].age += 1
+        outdated = self.inventory.age >= (PARAMS.max_age-1)
  
-        self.inventory = [I[i] for i in I.keys() if i not in remove]
+        self.inventory.remove(issued | outdated)
+        self.inventory.increase_age(PARAMS)
 
         # Return the number of products to be supplied, in order to fill the inventory upto its maximum capacity.
         return max(0, self.inventory_size - len(self.inventory))
@@ -50,15 +58,8 @@ class Hospital():
 
     def sample_requests_single_day(self, PARAMS, day = 0):
 
-        # Select the part of the demand scenario belonging to the given day.
-        data = self.demand_data.loc[self.demand_data["Day Available"] == day]
-
-        # Transform the new requests, as read from the data file, to instances of the Blood class.
-        requests = []
-        for i in data.index:
-            requests.append(Blood(PARAMS, ethnicity = data.loc[i,"Ethnicity"], patgroup = data.loc[i,"Patient Type"], major = vector_to_major([data.loc[i,a] for a in PARAMS.major]), minor = [data.loc[i,a] for a in PARAMS.minor], num_units = data.loc[i,"Num Units"], day_issuing = data.loc[i,"Day Needed"], day_available = data.loc[i, "Day Available"]))
-
-        self.requests += requests
+        # Add the part of the demand scenario belonging to the given day to the store of requests.
+        self.requests.extend(self.demand.select(slice(self.demand_offsets[day], self.demand_offsets[day+1])))
 
 
     def pickle(self, path):
@@ -1,42 +1,43 @@
 import time
 import numpy as np
 
+from blood import *
+
 # After obtaining the optimal variable values from the solved model, write corresponding results to a csv file.
 def log_results(SETTINGS, PARAMS, df, hospital, day, x=[], y=[], z=[], a=[], b=[]):
 
-    antigens = PARAMS.major + PARAMS.minor
-
     # Name of the hospital (e.g. "reg_2" or "uni_0").
     name = hospital.name
 
     # Gather some parameters.
-    I = {i : hospital.inventory[i] for i in range(len(hospital.inventory))}
-    R = {r : hospital.requests[r] for r in range(len(hospital.requests))}
+    I = hospital.inventory
+    R = hospital.requests
     ABOD_names = PARAMS.ABOD
     patgroups = PARAMS.patgroups
-    ethnicities = ["Caucasian", "African", "Asian"]
+    ethnicities = PARAMS.ethnicities
+
+    # The row of today's results for this hospital, and the offsets of all columns within it.
+    row = df.row(day, name)
+    o = df.offsets
+    if len(o) == 0:
+        o.update(column_offsets(PARAMS, df))
 
     # Most results will be calculated only considering the requests that are issued today.
-    r_today = [r for r in R.keys() if R[r].day_issuing == day]
-
-    df.loc[(day,name),"logged"] = True
-    df.loc[(day,name),"num patients"] = len(r_today)                                                                            # number of patients
-    df.loc[(day,name),"num units requested"] = sum([R[r].num_units for r in r_today])                                           # number of units requested
-    for eth in ethnicities:
-        df.loc[(day,name),f"num {eth} patients"] = sum([1 for r in r_today if R[r].ethnicity == eth])                           # number of patients per ethnicity
-    for p in patgroups:
-        df.loc[(day,name),f"num {p} patients"] = sum([1 for r in r_today if R[r].patgroup == p])                                # number of patients per patient group
-        df.loc[(day,name),f"num units requested {p}"] = sum([R[r].num_units for r in r_today if R[r].patgroup == p])            # number of units requested per patient group
-        df.loc[(day,name),f"num allocated at dc {p}"] = sum([R[r].allocated_from_dc for r in R.keys() if R[r].patgroup == p])   # number of products allocated from the distribution center per patient group
-
-    for u in range(1,5):
-        df.loc[(day,name),f"num requests {u} units"] = sum([1 for r in r_today if R[r].num_units == u])                         # number of requests asking for [1-4] units
-
-    df.loc[(day,name),"num supplied products"] = sum([1 for ip in I.values() if ip.age == 0])                                   # number of products added to the inventory at the end of the previous day
-    for major in ABOD_names:
-        df.loc[(day,name),f"num supplied {major}"] = sum([1 for ip in I.values() if ip.major == major and ip.age == 0])         # number of products per major blood group added to the inventory at the end of the previous day
-        df.loc[(day,name),f"num requests {major}"] = sum([1 for r in r_today if R[r].major == major])                           # number of patients per major blood group
-        df.loc[(day,name),f"num {major} in inventory"] = sum([1 for ip in I.values() if ip.major == major])                     # number of products in inventory per major blood group
+    r_today = np.where(R.day_issuing == day)[0]
+
+    row[o["logged"]] = 1
+    row[o["num patients"]] = len(r_today)                                                                                               # number of patients
+    row[o["num units requested"]] = R.num_units[r_today].sum()                                                                          # number of units requested
+    row[o["num eth patients"]] = np.bincount(R.ethnicity[r_today], minlength=len(ethnicities))                                         # number of patients per ethnicity
+    row[o["num pg patients"]] = np.bincount(R.patgroup[r_today], minlength=len(patgroups))                                             # number of patients per patient group
+    row[o["num units requested pg"]] = np.bincount(R.patgroup[r_today], weights=R.num_units[r_today], minlength=len(patgroups))        # number of units requested per patient group
+    row[o["num allocated at dc pg"]] = np.bincount(R.patgroup, weights=R.allocated_from_dc, minlength=len(patgroups))                  # number of products allocated from the distribution center per patient group
+    row[o["num requests units"]] = np.bincount(R.num_units[r_today], minlength=5)[1:5]                                                  # number of requests asking for [1-4] units
+
+    row[o["num supplied products"]] = (I.age == 0).sum()                                                                                # number of products added to the inventory at the end of the previous day
+    row[o["num supplied major"]] = np.bincount(I.major[I.age == 0], minlength=len(ABOD_names))                                          # number of products per major blood group added to the inventory at the end of the previous day
+    row[o["num requests major"]] = np.bincount(R.major[r_today], minlength=len(ABOD_names))                                             # number of patients per major blood group
+    row[o["num major in inventory"]] = np.bincount(I.major, minlength=len(ABOD_names))                                                  # number of products in inventory per major blood group
 
     # print("Objective:",sum(y[r] * ((1 - min(1, R[r].day_issuing - day)) + 1) for r in R.keys()) + sum(sum(z[r,k] * self.w[self.P[R[r].patgroup],k] for k in self.A.values()) for r in R.keys()))
     # print("Shortages:", sum(y[r] * ((1 - min(1, R[r].day_issuing - day)) + 1) for r in R.keys()))
@@ -66,47 +67,37 @@ def log_results(SETTINGS, PARAMS, df, hospital, day, x=[], y=[], z=[], a=[], b=[
     #         if (x[i,r] > 0) and (x[i,r] < 1):
     #             print(i, r, x[i,r])
 
-    age_sum = 0
-    issued_sum = 0
-    for r in r_today:
-        # Get all products from inventory that were issued to request r.
-        issued = np.where(x[:,r]==1)[0]
-        rq = R[r]
-
-        mismatch = {ag:0 for ag in antigens}
-        for ip in [I[i] for i in issued]:
-            age_sum += ip.age
-            issued_sum += 1
-            df.loc[(day,name),f"{ip.major} to {rq.major}"] += 1                                 # number of products per major blood group issued to requests per major blood group
-            df.loc[(day,name),f"{ip.ethnicity} to {rq.ethnicity}"] += 1                         # number of products per ethnicity issued to requests per ethnicity
-            
-            # Get all antigens k on which product ip and request rq are mismatched.
-            for ag in [antigens[k] for k in range(len(antigens)) if ip.vector[k] > rq.vector[k]]:
-                # Fy(a-b-) should only be matched on Fy(a), not on Fy(b). -> Fy(b-) only mismatch when Fy(a+)
-                if (ag != "Fyb") or (rq.vector[antigens.index("Fya")] == 1):
-                    mismatch[ag] = 1
-                    df.loc[(day,name),[f"num mismatched units {rq.patgroup} {ag}"]] += 1        # number of mismatched units per patient group and antigen
-
-        for ag in antigens:
-            df.loc[(day,name),[f"num mismatches {rq.patgroup} {ag}"]] += mismatch[ag]           # number of mismatched patients per patient group and antigen
-            df.loc[(day,name),[f"num mismatches {rq.ethnicity} {ag}"]] += mismatch[ag]          # number of mismatched patients per patient ethnicity and antigen
-
-    df.loc[(day,name),f"avg issuing age"] = age_sum / max(1, issued_sum)                        # average age of all issued products
-
-    for ip in [I[i] for i in I.keys() if (xi[i] == 0) and (I[i].age >= (PARAMS.max_age-1))]:
-        df.loc[(day,name),"num outdates"] += 1                                                  # number of outdated inventory products
-        df.loc[(day,name),f"num outdates {ip.major}"] += 1                                      # number of outdated inventory products per major blood group
-
-    df.loc[(day,name),"num unavoidable shortages"] = max(0, sum([R[r].num_units for r in r_today]) - len(I))                # difference between the number of requested units and number of products in inventory, in case the former is larger
-    for r in [r for r in r_today if y[r] == 1]:
-        rq = R[r]
-        df.loc[(day,name),"num shortages"] += 1                                                 # number of today's requests that were left unsatisfied
-        df.loc[(day,name),f"num shortages {rq.major}"] += 1                                     # number of unsatisfied requests per major blood group
-        df.loc[(day,name),f"num shortages {rq.patgroup}"] += 1                                  # number of unsatisfied requests per patient group
-        df.loc[(day,name),f"num {rq.patgroup} {int(rq.num_units - xr[r])} units short"] += 1    # difference between the number units requested and issued
+    # All pairs of a product i and one of today's requests r such that i is issued to r.
+    issued, n = np.where(x[:,r_today] == 1)
+    r = r_today[n]
+
+    # For each issued product, the antigens on which it mismatches its request.
+    # Fy(a-b-) should only be matched on Fy(a), not on Fy(b). -> Fy(b-) only mismatch when Fy(a+)
+    M = (mismatched_antigens(PARAMS, I.keys, R.keys[r_today])[issued, n][:,np.newaxis] & o["bits"][np.newaxis,:]) != 0
+    patient_mismatched = np.zeros([len(r_today), len(o["bits"])], dtype=bool)
+    np.logical_or.at(patient_mismatched, n, M)
+
+    np.add.at(row, o["major to major"][I.major[issued], R.major[r]], 1)                                                     # number of products per major blood group issued to requests per major blood group
+    np.add.at(row, o["eth to eth"][I.ethnicity[issued], R.ethnicity[r]], 1)                                                 # number of products per ethnicity issued to requests per ethnicity
+    np.add.at(row, o["num mismatched units pg ag"][R.patgroup[r]][M], 1)                                                    # number of mismatched units per patient group and antigen
+    np.add.at(row, o["num mismatches pg ag"][R.patgroup[r_today]][patient_mismatched], 1)                                   # number of mismatched patients per patient group and antigen
+    np.add.at(row, o["num mismatches eth ag"][R.ethnicity[r_today]][patient_mismatched], 1)                                 # number of mismatched patients per patient ethnicity and antigen
+
+    row[o["avg issuing age"]] = I.age[issued].sum() / max(1, len(issued))                                                   # average age of all issued products
+
+    outdated = np.where((xi == 0) & (I.age >= (PARAMS.max_age-1)))[0]
+    row[o["num outdates"]] += len(outdated)                                                                                 # number of outdated inventory products
+    np.add.at(row, o["num outdates major"][I.major[outdated]], 1)                                                           # number of outdated inventory products per major blood group
+
+    row[o["num unavoidable shortages"]] = max(0, R.num_units[r_today].sum() - len(I))                                      # difference between the number of requested units and number of products in inventory, in case the former is larger
+    short = r_today[y[r_today] == 1]
+    row[o["num shortages"]] += len(short)                                                                                   # number of today's requests that were left unsatisfied
+    np.add.at(row, o["num shortages major"][R.major[short]], 1)                                                             # number of unsatisfied requests per major blood group
+    np.add.at(row, o["num shortages pg"][R.patgroup[short]], 1)                                                             # number of unsatisfied requests per patient group
+    np.add.at(row, o["num pg units short"][R.patgroup[short], (R.num_units[short] - xr[short]).astype(int) - 1], 1)        # difference between the number units requested and issued
 
     if SETTINGS.line == "off":
-        df.loc[(day,name),"products available today"] = ",".join([str(i) for i in I.keys() if a[i,day] - b[i,day] == 1])    # this number should be equal to the inventory size provided in the settings
+        df.set(day, name, "products available today", ",".join([str(i) for i in range(len(I)) if a[i,day] - b[i,day] == 1]))     # this number should be equal to the inventory size provided in the settings
     
 
     # Write the values found to pickle files.
@@ -117,4 +108,40 @@ def log_results(SETTINGS, PARAMS, df, hospital, day, x=[], y=[], z=[], a=[], b=[
     # with open(SETTINGS.generate_filename("results") + f"z_{SETTINGS.strategy}_{hospital.htype[:3]}_{e}.pickle", "wb") as f:
     #     pickle.dump(z, f)
     
-    return df 
\ No newline at end of file
+    return df 
+
+
+# Offsets of the columns written by log_results within a row of the results recorder, where columns per major blood group, ethnicity,
+# patient group, number of units or antigen are collected in arrays that are indexed by the corresponding PARAMS indices.
+def column_offsets(PARAMS, df):
+
+    c = df.columns
+    antigens = PARAMS.major + PARAMS.minor
+    ABOD_names = PARAMS.ABOD
+    patgroups = PARAMS.patgroups
+    ethnicities = PARAMS.ethnicities
+
+    o = {col : c[col] for col in ["logged", "num patients", "num units requested", "num supplied products", "avg issuing age", "num outdates", "num shortages", "num unavoidable shortages"]}
+    o["bits"] = np.array([int(antigens_to_key(PARAMS, [ag])) for ag in antigens])
+
+    o["num eth patients"] = np.array([c[f"num {eth} patients"] for eth in ethnicities])
+    o["num pg patients"] = np.array([c[f"num {pg} patients"] for pg in patgroups])
+    o["num units requested pg"] = np.array([c[f"num units requested {pg}"] for pg in patgroups])
+    o["num allocated at dc pg"] = np.array([c[f"num allocated at dc {pg}"] for pg in patgroups])
+    o["num requests units"] = np.array([c[f"num requests {u} units"] for u in range(1,5)])
+    o["num supplied major"] = np.array([c[f"num supplied {m}"] for m in ABOD_names])
+    o["num requests major"] = np.array([c[f"num requests {m}"] for m in ABOD_names])
+    o["num major in inventory"] = np.array([c[f"num {m} in inventory"] for m in ABOD_names])
+
+    o["major to major"] = np.array([[c[f"{mi} to {mr}"] for mr in ABOD_names] for mi in ABOD_names])
+    o["eth to eth"] = np.array([[c[f"{ei} to {er}"] for er in ethnicities] for ei in ethnicities])
+    o["num mismatched units pg ag"] = np.array([[c[f"num mismatched units {pg} {ag}"] for ag in antigens] for pg in patgroups])
+    o["num mismatches pg ag"] = np.array([[c[f"num mismatches {pg} {ag}"] for ag in antigens] for pg in patgroups])
+    o["num mismatches eth ag"] = np.array([[c[f"num mismatches {eth} {ag}"] for ag in antigens] for eth in ethnicities])
+
+    o["num outdates major"] = np.array([c[f"num outdates {m}"] for m in ABOD_names])
+    o["num shortages major"] = np.array([c[f"num shortages {m}"] for m in ABOD_names])
+    o["num shortages pg"] = np.array([c[f"num shortages {pg}"] for pg in patgroups])
+    o["num pg units short"] = np.array([[c[f"num {pg} {u} units short"] for u in range(1,5)] for pg in patgroups])
+
+    return o
@@ -2,6 +2,7 @@ from settings import *
 from params import *
 from demand import *
 from supply import *
+from scenario import *
 from simulation import *
 from reinforcement_learning import *
 
@@ -14,16 +15,19 @@ def main():
     for path in ["results", "results/"+SETTINGS.model_name]:
         SETTINGS.check_dir_existence(path)
 
-    # Sample demand for each day in the simulation, and write to a csv file.
+    # Sample demand for each day in the simulation, for all hospitals of each type, and write to a csv file.
     if SETTINGS.mode == "demand":
         for htype in SETTINGS.n_hospitals.keys():
-            for _ in range(SETTINGS.n_hospitals[htype]):
-                generate_demand(SETTINGS, PARAMS, htype, SETTINGS.avg_daily_demand[htype])
+            generate_demand(SETTINGS, PARAMS, htype, SETTINGS.avg_daily_demand[htype])
 
     # Sample RBC units to be used as supply in the simulation, and write to csv file.
     elif SETTINGS.mode == "supply":
         generate_supply(SETTINGS, PARAMS)
 
+    # Convert all existing csv scenarios to the binary scenario format.
+    elif SETTINGS.mode == "convert":
+        convert_scenarios(SETTINGS, PARAMS)
+
     # Run the simulation, using either linear programming or reinforcement learning to determine the matching strategy.
     elif SETTINGS.mode == "optimize":
 
@@ -37,16 +41,29 @@ def main():
         print(f"Using {SETTINGS.strategy} strategy for matching, with patgroup_musts = {SETTINGS.patgroup_musts}.")
 
         if SETTINGS.method == "LP":
-            simulation(SETTINGS, PARAMS)
+            if SETTINGS.solver == "highs" and (SETTINGS.model_builder != "matrix" or SETTINGS.line != "on"):
+                print("Parameter 'solver' is set to 'highs', which requires online optimization and the 'matrix' model_builder.")
+            elif SETTINGS.solver == "highs" and SETTINGS.tie_break == "pool":
+                print("Parameter 'solver' is set to 'highs', which does not keep a pool of optimal solutions. Use the 'hierarchical' tie_break.")
+            elif SETTINGS.decomposition not in [None, "lagrangian", "rationing"] or SETTINGS.decomposition_rounds < 1:
+                print("Parameter 'decomposition' should be None, 'lagrangian' or 'rationing', with at least 1 decomposition round.")
+            else:
+                simulation(SETTINGS, PARAMS)
+        elif SETTINGS.method == "heuristic":
+            if SETTINGS.heuristic_policy in ["fifo", "greedy", "flow"] and SETTINGS.line == "on":
+                simulation(SETTINGS, PARAMS)
+            else:
+                print("Parameter 'method' is set to 'heuristic', which requires online optimization and a 'heuristic_policy' of 'fifo', 'greedy' or 'flow'.")
         elif SETTINGS.method == "RL":
             reinforcement_learning(SETTINGS, PARAMS)
         else:
-            print("Parameter 'mode' is set to 'optimize', but no existing method for optimization is given. Try 'RL' or 'LP'.")
+            print("Parameter 'mode' is set to 'optimize', but no existing method for optimization is given. Try 'RL', 'LP' or 'heuristic'.")
     else:
         print("No mode for running the code is given. Please change the 'mode' parameter in 'settings.py' to one of the following values:")
         print("'demand': generate demand scenarios")
         print("'supply': generate supply scenarios")
-        print("'optimize': for optimizing RBC matching, either using LP or RL method")
+        print("'optimize': for optimizing RBC matching, either using LP, RL or a heuristic method")
+        print("'convert': convert csv demand and supply scenarios to the binary scenario format")
 
 
 if __name__ == "__main__":
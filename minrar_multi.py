@@ -1,15 +1,58 @@
 from gurobipy import *
 import numpy as np
+import scipy.sparse as sp
 import time
 import math
+import os
+import copy
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 
 from blood import *
 from log import *
+from presolve import *
+from minrar_single import *
+from read_solution import *
+from results_recorder import *
+from solver import *
 
 
-# Multi-hospital setup: MINRAR model for matching simultaniously in multiple hospitals.
+# Multi-hospital setup: MINRAR model for matching simultaniously in multiple hospitals. If SETTINGS.presolve is True, requests whose assignment
+# can be fixed beforehand are assigned greedily from their hospital's inventory, and only the remaining products and requests are passed to the solver.
+# If SETTINGS.decomposition is set, the model is solved as one subproblem per hospital instead (see solve_minrar_decomposed).
 def minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df):
 
+    solve = solve_minrar_multiple_hospitals if SETTINGS.decomposition == None else solve_minrar_decomposed
+
+    if SETTINGS.presolve == False:
+        return solve(SETTINGS, PARAMS, dc, hospitals, day, df)
+
+    # Products from the distribution center can not be issued to requests with today as their issuing date.
+    presolves, residuals = [], []
+    for hospital in hospitals:
+        eligible = (precompute_compatibility(SETTINGS, PARAMS, hospital.inventory, hospital.requests) == 1) & (timewise_possible(SETTINGS, PARAMS, hospital.inventory, hospital.requests, day) == 1)
+        eligible_dc = (precompute_compatibility(SETTINGS, PARAMS, dc.inventory, hospital.requests) == 1) & (timewise_possible(SETTINGS, PARAMS, dc.inventory, hospital.requests, day) == 1)
+        eligible_dc &= (hospital.requests.day_issuing > day)[np.newaxis,:]
+        presolves.append(Preassignment(SETTINGS, PARAMS, hospital, eligible, presolve_costs(SETTINGS, PARAMS, hospital.inventory, hospital.requests, [hospital]),
+                                        eligible_dc, presolve_costs(SETTINGS, PARAMS, dc.inventory, hospital.requests, [hospital], fifo = False)))
+        residuals.append(presolves[-1].residual(hospital))
+
+    df, xh, xdc, y, z = solve(SETTINGS, PARAMS, dc, residuals, day, df, num_requests = [len(hospital.requests) for hospital in hospitals])
+
+    for h, (hospital, presolve) in enumerate(zip(hospitals, presolves)):
+        presolve.restore(hospital, residuals[h])
+        df.set(day, hospital.name, "num presolved requests", presolve.num_removed())
+        xh[h], xdc[h], y[h], z[h] = presolve.expand_x(xh[h]), presolve.expand_x(xdc[h], other = True), presolve.expand_y(y[h]), presolve.expand_z(PARAMS, z[h])
+
+    return df, xh, xdc, y, z
+
+
+# Solve the multi-hospital MINRAR model for all products and requests of the given hospitals and the distribution center. If given, prices gives
+# for each product of the distribution center an additional cost of issuing it (used by solve_minrar_decomposed). The shortage penalties of
+# hospital h are based on num_requests[h], which is the hospital's own number of requests by default, and that of the full problem if the
+# hospitals are the presolve's residuals.
+def solve_minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df, prices = None, num_requests = None):
+
     start = time.perf_counter()
 
     ################
@@ -22,6 +65,9 @@ def minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df):
     A_minor = {k : A[k] for k in PARAMS.minor}
     A_no_Fyb = {k : A[k] for k in antigens if k != "Fyb"}
 
+    # Packed key of each single antigen, to test whether it is contained in a packed set of antigens.
+    bits = [int(antigens_to_key(PARAMS, [ag])) for ag in antigens]
+
     # Mapping of the patient groups to their index in the list of patient groups.
     P = {PARAMS.patgroups[i] : i for i in range(len(PARAMS.patgroups))}
 
@@ -34,127 +80,429 @@ def minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df):
         w = np.array([0] * len(antigens))
 
     # Sets of all hospitals, their inventory products and patient requests.
-    H = {h : hospitals[h] for h in range(len(hospitals))}
-    R = {h : {} for h in H.keys()}
-    Ih = {h : {} for h in H.keys()}
-    for h in H.keys():
-        R[h] = {r : hospitals[h].requests[r] for r in range(len(hospitals[h].requests))}        # Requests for each hospital.
-        Ih[h] = {i : hospitals[h].inventory[i] for i in range(len(hospitals[h].inventory))}     # Products in hospital inventories.
-    Idc = {i : dc.inventory[i] for i in range(len(dc.inventory))}                               # Products in the distribution center's inventory.
+    H = range(len(hospitals))
+    R = [range(len(hospitals[h].requests)) for h in H]         # Requests for each hospital.
+    Ih = [range(len(hospitals[h].inventory)) for h in H]       # Products in hospital inventories.
+    Idc = range(len(dc.inventory))                              # Products in the distribution center's inventory.
+
+    # Antigen phenotypes and other properties of all inventory products and patient requests.
+    vr = [hospitals[h].requests.vectors.tolist() for h in H]
+    ageh = [hospitals[h].inventory.age.tolist() for h in H]
+    agedc = dc.inventory.age.tolist()
+    num_units = [hospitals[h].requests.num_units.tolist() for h in H]
+    day_issuing = [hospitals[h].requests.day_issuing.tolist() for h in H]
+    pg = [hospitals[h].requests.patgroup.tolist() for h in H]
 
     # Get the usability of all inventory products, in both the hospitals and the distribution center, and for all
     # patient requests with respect to the distribution of major blood types in the patient population.
-    bih = {h : [Ih[h][i].get_usability(PARAMS, [hospitals[h]]) for i in Ih[h].keys()] for h in H.keys()}
-    bidc = [Idc[i].get_usability(PARAMS, hospitals) for i in Idc.keys()]
-    br = {h : [R[h][r].get_usability(PARAMS, [hospitals[h]]) for r in R[h].keys()] for h in H.keys()}
+    bih = [hospitals[h].inventory.get_usability(PARAMS, [hospitals[h]]).tolist() for h in H]
+    bidc = dc.inventory.get_usability(PARAMS, hospitals).tolist()
+    br = [hospitals[h].requests.get_usability(PARAMS, [hospitals[h]]).tolist() for h in H]
 
     # Matrices containing a 1 if product i∈I is compatible with request r∈R, 0 otherwise.
-    Ch = {h : precompute_compatibility(SETTINGS, PARAMS, Ih[h], R[h]) for h in H.keys()}    # The product in the hospital's inventory is compatible on major and manditory antigens.
-    Cdc = {h : precompute_compatibility(SETTINGS, PARAMS, Idc, R[h]) for h in H.keys()}     # The product in the distribution center's inventory is compatible on major and manditory antigens.
-    Th = {h : timewise_possible(SETTINGS, PARAMS, Ih[h], R[h], day) for h in H.keys()}      # The product in the hospital's inventory is not outdated before issuing date of request.
-    Tdc = {h : timewise_possible(SETTINGS, PARAMS, Idc, R[h], day) for h in H.keys()}       # The product in the distribution center's inventory is not outdated before issuing date of request.
+    Ch = [precompute_compatibility(SETTINGS, PARAMS, hospitals[h].inventory, hospitals[h].requests) for h in H]     # The product in the hospital's inventory is compatible on major and manditory antigens.
+    Cdc = [precompute_compatibility(SETTINGS, PARAMS, dc.inventory, hospitals[h].requests) for h in H]              # The product in the distribution center's inventory is compatible on major and manditory antigens.
+    Th = [timewise_possible(SETTINGS, PARAMS, hospitals[h].inventory, hospitals[h].requests, day) for h in H]       # The product in the hospital's inventory is not outdated before issuing date of request.
+    Tdc = [timewise_possible(SETTINGS, PARAMS, dc.inventory, hospitals[h].requests, day) for h in H]                # The product in the distribution center's inventory is not outdated before issuing date of request.
+
+    # For each product i and request r, M[h][i][r] is the packed set of antigens on which i mismatches r, for products in both the hospital's
+    # and the distribution center's inventory. The penalty for substituting antigens that r is positive for by a product that is negative for
+    # them is looked up per pair of distinct phenotypes, over the minor antigens (objective) and over all antigens (selecting between solutions).
+    _, penalty = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
+    Mh = [mismatched_antigens(PARAMS, hospitals[h].inventory.keys, hospitals[h].requests.keys).tolist() for h in H]
+    Mdc = [mismatched_antigens(PARAMS, dc.inventory.keys, hospitals[h].requests.keys).tolist() for h in H]
+    Sh = [mismatched_antigens(PARAMS, hospitals[h].requests.keys, hospitals[h].inventory.keys, fyb_rule = False).T for h in H]
+    Sdc = [mismatched_antigens(PARAMS, hospitals[h].requests.keys, dc.inventory.keys, fyb_rule = False).T for h in H]
+    subst_h = [penalty[hospitals[h].requests.patgroup[np.newaxis,:], Sh[h] & antigens_to_key(PARAMS, PARAMS.minor)].tolist() for h in H]
+    subst_dc = [penalty[hospitals[h].requests.patgroup[np.newaxis,:], Sdc[h] & antigens_to_key(PARAMS, PARAMS.minor)].tolist() for h in H]
+    subst_all_h = [penalty[hospitals[h].requests.patgroup[np.newaxis,:], Sh[h]] for h in H]
+    subst_all_dc = [penalty[hospitals[h].requests.patgroup[np.newaxis,:], Sdc[h]] for h in H]
 
     # For each request r∈R, t[r] = 1 if the issuing day is today, 0 if it lies in the future.
-    # t = [[1 - min(1, R[h][r].day_issuing - day) for r in R[h].keys()] for h in H.keys()]
+    # t = [[1 - min(1, day_issuing[h][r] - day) for r in R[h]] for h in H]
 
     # t[r] = 2 if issuing day of r is today, t[r] = 1 if it is tomorrow, and t[r] = 0 if it is more than one day in the future.
-    t = [[1 - min(1, R[h][r].day_issuing - (day+1)) for r in R[h].keys()] for h in H.keys()]
+    t = [issuing_urgency(hospitals[h].requests, day + 1).tolist() for h in H]
+
+    # Shortage penalty of each request, which is highest for requests with today as their issuing date, followed by those issued tomorrow.
+    shortage = [((len(R[h]) if num_requests == None else num_requests[h]) * np.array(t[h])) + 1 for h in H]
+
+    # For each hospital, all pairs of products i and requests r that are both compatible and timewise possible. Products
+    # from the distribution center can not be issued to requests with today as their issuing date.
+    Eh = [tuplelist(eligible_pairs(Ch[h], Th[h])) for h in H]
+    Edc = [tuplelist(eligible_pairs(Cdc[h], Tdc[h] * (np.array(t[h]) < 2)[np.newaxis,:])) for h in H]
+
+    # For each hospital, all pairs of requests r and antigens k that r is negative for, as r can never be mismatched on antigens it is positive for.
+    Z = [[(r,k) for r in R[h] for k in A.values() if vr[h][r][k] == 0] for h in H]
+
+    # Mismatch penalty of each z[h][r,k] with (r,k)∈Z[h], and the fifo penalty, usability penalty and minor antigen substitution penalty
+    # of each xh[h][i,r] with (i,r)∈Eh[h], which together make up the second objective. Products from the distribution center are only
+    # charged the substitution penalty.
+    if "patgroups" in SETTINGS.strategy:
+        cz = [[w[pg[h][r],k] for r, k in Z[h]] for h in H]
+    else:
+        cz = [[w[k] for r, k in Z[h]] for h in H]
+    cxh = [[0.5 ** ((PARAMS.max_age - ageh[h][i] - 1) / 5) + (bih[h][i] - br[h][r]) + (subst_h[h][i][r] if pg[h][r] in [P["Wu45"], P["Other"]] else 0) for i, r in Eh[h]] for h in H]
+    cxdc = [[subst_dc[h][i][r] if pg[h][r] in [P["Wu45"], P["Other"]] else 0 for i, r in Edc[h]] for h in H]
+    if prices is not None:
+        cxdc = [[c + prices[i] for c, (i, r) in zip(cxdc[h], Edc[h])] for h in H]
 
     ############
     ## GUROBI ##
     ############
 
-    model = Model(name="model")
-    if SETTINGS.show_gurobi_output == False:
-        model.Params.LogToConsole = 0
-    if SETTINGS.gurobi_threads != None:
-        model.setParam('Threads', SETTINGS.gurobi_threads)
-    if SETTINGS.gurobi_timeout != None:
-        model.setParam('TimeLimit', SETTINGS.gurobi_timeout)
+    model = new_minrar_model(SETTINGS)
+
+    # Build the model's variables, constraints and objectives, either with quicksum expressions or from sparse coefficient matrices.
+    if SETTINGS.model_builder == "matrix":
+        xh, xdc, y, z = build_minrar_multi_matrix(model, H, R, Ih, Idc, Eh, Edc, Z, Mh, Mdc, bits, num_units, shortage, cz, cxh, cxdc)
+    else:
+        xh, xdc, y, z = build_minrar_multi_quicksum(model.model, H, R, Ih, Idc, Eh, Edc, Z, Mh, Mdc, bits, num_units, shortage, cz, cxh, cxdc)
+
+    stop = time.perf_counter()
+    print(f"model initialization: {(stop - start):0.4f} seconds")
+
+    # Instead of selecting between a pool of optimal solutions afterwards, let the solver apply the same tie-breaking criteria to today's requests.
+    if SETTINGS.tie_break == "hierarchical":
+        today = [set([r for r in R[h] if day_issuing[h][r] == day]) for h in H]
+        xh_today = [[(i, r) for i, r in Eh[h] if r in today[h]] for h in H]
+        xdc_today = [[(i, r) for i, r in Edc[h] if r in today[h]] for h in H]
+        z_today = [[(r, k) for r, k in Z[h] if r in today[h]] for h in H]
+        x_today_vars = [([xh[h][key] for key in xh_today[h]], [xdc[h][key] for key in xdc_today[h]]) for h in H]
+        set_tie_break_objectives(model, [([z[h][key] for key in z_today[h]], [w[pg[h][r],k] if "patgroups" in SETTINGS.strategy else w[k] for r, k in z_today[h]]) for h in H],
+                                    [term for h in H for term in [(x_today_vars[h][0], [ageh[h][i] for i, r in xh_today[h]]), (x_today_vars[h][1], [agedc[i] for i, r in xdc_today[h]])]],
+                                    [term for h in H for term in [(x_today_vars[h][0], [bih[h][i] - br[h][r] for i, r in xh_today[h]]), (x_today_vars[h][1], [bidc[i] - br[h][r] for i, r in xdc_today[h]])]],
+                                    [term for h in H for term in [(x_today_vars[h][0], [subst_all_h[h][i,r] for i, r in xh_today[h]]), (x_today_vars[h][1], [subst_all_dc[h][i,r] for i, r in xdc_today[h]])]])
+
+    # Start from yesterday's assignments of products to requests that are both still present, where products may have moved
+    # from the distribution center to the hospital in the meantime.
+    if SETTINGS.warm_start:
+        for h in H:
+            set_assignment_start(model, xh[h], hospitals[h].inventory, hospitals[h].requests, hospitals[h].assigned)
+            set_assignment_start(model, xdc[h], dc.inventory, hospitals[h].requests, hospitals[h].assigned)
+
+    start = time.perf_counter()
+    time_to_optimal = model.optimize()
+    stop = time.perf_counter()
+    print(f"Optimize: {(stop - start):0.4f} seconds, optimal solution found after {time_to_optimal:0.4f} seconds")
+
+    # With hierarchical tie-breaking, the best solution found is already the preferred one.
+    sc = model.num_solutions
+    print(f"Solutions found: {sc}")
+
+    # Create numpy arrays filled with zeros, and write the variable values of all solutions found into them.
+    xh_vars, xdc_vars, y_vars, z_vars = xh, xdc, y, z
+    xh = [np.zeros([sc, len(Ih[h]), len(R[h])]) for h in H]
+    xdc = [np.zeros([sc, len(Idc), len(R[h])]) for h in H]
+    y = [np.zeros([sc, len(R[h])]) for h in H]
+    z = [np.zeros([sc, len(R[h]), len(A)]) for h in H]
+
+    for s in range(sc):
+        for h in H:
+            xh[h][s] = variable_values(model, xh_vars[h], [len(Ih[h]), len(R[h])], s)
+            xdc[h][s] = variable_values(model, xdc_vars[h], [len(Idc), len(R[h])], s)
+            y[h][s] = variable_values(model, y_vars[h], [len(R[h])], s)
+            z[h][s] = variable_values(model, z_vars[h], [len(R[h]), len(A)], s)
+
+    if sc > 1:
+
+        # Score all solutions found on today's requests, summed over all hospitals and over the products of both the hospitals and the
+        # distribution center, and select the preferred one.
+        today = [hospitals[h].requests.day_issuing == day for h in H]
+        weights = [w[hospitals[h].requests.patgroup] if "patgroups" in SETTINGS.strategy else np.broadcast_to(w, [len(R[h]), len(A)]) for h in H]
+        mismatch = sum([score_mismatches(z[h], today[h], weights[h]) for h in H])
+        scores = sum([score_assignments(xh[h], today[h], hospitals[h].inventory.age, np.subtract.outer(bih[h], br[h]), subst_all_h[h])
+                    + score_assignments(xdc[h], today[h], dc.inventory.age, np.subtract.outer(bidc, br[h]), subst_all_dc[h]) for h in H])
+        best = select_solution(mismatch, *scores)
+
+        for h in H:
+            xh[h] = xh[h][best]
+            xdc[h] = xdc[h][best]
+            y[h] = y[h][best]
+            z[h] = z[h][best]
+
+    else:
+        for h in H:
+            xh[h] = xh[h][0]
+            xdc[h] = xdc[h][0]
+            y[h] = y[h][0]
+            z[h] = z[h][0]
+
+    # Remember today's assignments, to warm-start tomorrow's solve, and record the status, size and solve times of the model for all hospitals.
+    for h in H:
+        hospitals[h].assigned = assigned_pairs(xh[h], hospitals[h].inventory, hospitals[h].requests) | assigned_pairs(xdc[h], dc.inventory, hospitals[h].requests)
+        df.set(day, hospitals[h].name, "gurobi status", model.status_code)
+        df.set(day, hospitals[h].name, "nvars", model.num_vars)
+        df.set(day, hospitals[h].name, "calc time", model.optimization_time)
+        df.set(day, hospitals[h].name, "time to optimal", time_to_optimal)
+
+
+    return df, xh, xdc, y, z
+
+
+# Solve the multi-hospital MINRAR model by decomposition, with one subproblem per hospital: the multi-hospital model for that hospital alone, with
+# its own inventory and the products of the distribution center that it is allowed to use. Subproblems are solved independently, in parallel
+# processes if SETTINGS.decomposition_workers > 1. Products of the distribution center are grouped into classes of interchangeable products (see
+# product_classes), and for up to SETTINGS.decomposition_rounds rounds, the classes of which the hospitals together issue more products than
+# the distribution center has (overused classes) are coordinated with the method given by SETTINGS.decomposition:
+#   "lagrangian": the constraint that each product of the distribution center is issued at most once is relaxed, with a price for each class
+#                 that is added to the cost of issuing its products. After each round, the prices of overused classes rise and those of
+#                 classes with unused products fall (a subgradient step), and all hospitals are solved again.
+#   "rationing": the products of each overused class are rationed over the hospitals issuing them (see ration_classes), and the hospitals
+#                that do not get all products they issued are solved again, with access to the products they got only.
+# After each round, the solutions are repaired into a feasible allocation (see repair_overused), and the repaired allocation with the lowest
+# objective without prices over all rounds is kept. Both methods are heuristics: neither the prices nor the rationing are guaranteed to improve
+# the allocation from one round to the next, so more rounds never make the result worse, but need not make it better either. Finally, the products
+# of each class are dealt to the hospitals issuing them. Returns the same values as solve_minrar_multiple_hospitals.
+def solve_minrar_decomposed(SETTINGS, PARAMS, dc, hospitals, day, df, num_requests = None):
 
-    model.Params.PoolSearchMode = 2
-    model.Params.PoolSolutions = 50
-    model.Params.PoolGap = 0
+    start = time.perf_counter()
+
+    H = range(len(hospitals))
+    classes, counts = product_classes(SETTINGS, PARAMS, dc.inventory)
+
+    # Products of the distribution center that each hospital may use. The products of a class are interchangeable, so a hospital never
+    # needs more of them than the number of units it requests in total.
+    allowed = [products_up_to(classes, np.full(len(classes), hospitals[h].requests.num_units.sum())) for h in H]
+    prices = np.zeros(len(dc.inventory))
+    solutions = [None for h in H]
+
+    # Shortage penalty of each request, as in the first objective, to decide which hospitals need the products of an overused class most.
+    num_requests = [len(hospitals[h].requests) for h in H] if num_requests == None else num_requests
+    shortage = [(num_requests[h] * issuing_urgency(hospitals[h].requests, day + 1)) + 1 for h in H]
+
+    # Divide the machine's cores over the parallel processes, to limit the number of threads used by the solver.
+    workers = min(SETTINGS.decomposition_workers, len(hospitals))
+    if workers > 1:
+        SETTINGS = copy.copy(SETTINGS)
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        SETTINGS.gurobi_threads = threads if SETTINGS.gurobi_threads == None else min(threads, SETTINGS.gurobi_threads)
+
+    with (ProcessPoolExecutor(max_workers = workers) if workers > 1 else contextlib.nullcontext()) as pool:
+
+        unsolved = list(H)
+        best, best_objective = None, np.inf
+        for n in range(SETTINGS.decomposition_rounds):
+
+            # Solve the subproblems of all hospitals whose prices or allowed products have changed.
+            for h, solution in zip(unsolved, solve_subproblems(SETTINGS, PARAMS, dc, [hospitals[h] for h in unsolved], day, [allowed[h] for h in unsolved], prices, [num_requests[h] for h in unsolved], pool)):
+                solutions[h] = solution
+            issued = sum([np.bincount(classes, weights=np.round(solutions[h][1]).sum(axis=1), minlength=len(classes)) for h in H])
+            overused = issued > counts
+            print(f"Decomposition round {n}: {len(unsolved)} subproblems solved, {overused.sum()} overused classes.")
+
+            # Repair this round's solutions into a feasible allocation, and keep the one with the lowest objective (without prices) so far.
+            repaired = repair_overused(SETTINGS, PARAMS, dc, hospitals, day, solutions, shortage, classes, counts, overused, allowed, num_requests)
+            objective = decomposed_objective(SETTINGS, PARAMS, dc, hospitals, repaired, shortage)
+            if objective < best_objective:
+                best, best_objective = repaired, objective
+            if overused.any() == False or n == SETTINGS.decomposition_rounds - 1:
+                break
+
+            # Change the price of each class by 5 (the factor of the mismatch penalties) per product that is overused or left, with diminishing steps.
+            if SETTINGS.decomposition == "lagrangian":
+                prices = np.maximum(0, prices[classes] + (5 * (issued - counts)[classes] / (n + 1)))
+                unsolved = list(H)
+            # Restrict the hospitals that do not get all products they issued from overused classes to the products they got.
+            else:
+                quotas = ration_classes(solutions, shortage, classes, counts, overused)
+                unsolved = [h for h in H if quotas[h] is not None]
+                for h in unsolved:
+                    allowed[h] &= quotas[h]
+
+    solutions = best
+    print(f"Decomposition objective: {best_objective:0.4f}")
+
+    # Deal the products of each class to the hospitals issuing them, in order of hospitals and requests, as the hospitals may have issued
+    # the same products of a class. All products of a class are interchangeable, so this does not change any of the objectives.
+    R = np.cumsum([0] + [len(hospitals[h].requests) for h in H])
+    xdc = np.hstack([np.round(solutions[h][1]) for h in H])
+    aggregated = np.zeros(xdc.shape)
+    np.add.at(aggregated, classes, xdc)
+    xdc = disaggregate(aggregated, classes)
+
+    # Record the time of the complete decomposition and the status and size of each hospital's last subproblem, and remember today's assignments
+    # to warm-start tomorrow's solve.
+    stop = time.perf_counter()
+    xh, y, z = [solutions[h][0] for h in H], [solutions[h][2] for h in H], [solutions[h][3] for h in H]
+    xdc = [xdc[:,R[h]:R[h+1]] for h in H]
+    for h in H:
+        hospitals[h].assigned = assigned_pairs(xh[h], hospitals[h].inventory, hospitals[h].requests) | assigned_pairs(xdc[h], dc.inventory, hospitals[h].requests)
+        df.set(day, hospitals[h].name, "gurobi status", solutions[h][5])
+        df.set(day, hospitals[h].name, "nvars", solutions[h][6])
+        df.set(day, hospitals[h].name, "calc time", stop - start)
+        df.set(day, hospitals[h].name, "time to optimal", solutions[h][4])
+
+    return df, xh, xdc, y, z
+
+
+# Repair the given solutions of all hospitals into a feasible allocation of the distribution center's products: the hospitals that do not get
+# all products of the overused classes (see ration_classes) are solved again one by one, without prices, each with access to the products that
+# are left by all other hospitals, so that no class is overused anymore. Returns the repaired solutions, leaving the given ones as they were.
+def repair_overused(SETTINGS, PARAMS, dc, hospitals, day, solutions, shortage, classes, counts, overused, allowed, num_requests):
+
+    H = range(len(hospitals))
+    solutions = list(solutions)
+    if overused.any() == False:
+        return solutions
+
+    quotas = ration_classes(solutions, shortage, classes, counts, overused)
+    for h in [h for h in H if quotas[h] is not None]:
+        left = counts - sum([np.bincount(classes, weights=np.round(solutions[g][1]).sum(axis=1), minlength=len(classes)) for g in H if g != h])
+        solutions[h] = solve_subproblem(SETTINGS, PARAMS, dc, hospitals[h], day, allowed[h] & products_up_to(classes, left), None, num_requests[h])
+    print(f"Solved {sum([quotas[h] is not None for h in H])} subproblems again to resolve all overused classes.")
+
+    return solutions
+
+
+# Objective of the multi-hospital MINRAR model, without any prices, for the given solutions of all hospitals: the shortage penalties, the
+# mismatch penalties and the penalties of the products issued from both the hospitals' inventories and the distribution center.
+def decomposed_objective(SETTINGS, PARAMS, dc, hospitals, solutions, shortage):
+
+    antigens = PARAMS.major + PARAMS.minor
+    objective = 0
+    for h in range(len(hospitals)):
+        xh, xdc, y, z = [np.round(solutions[h][k]) for k in range(4)]
+        requests = hospitals[h].requests
+        if "patgroups" in SETTINGS.strategy:
+            w = np.array(PARAMS.patgroup_weights.loc[PARAMS.patgroups, antigens])[requests.patgroup]
+        elif "relimm" in SETTINGS.strategy:
+            w = np.array(PARAMS.relimm_weights[antigens])[0][np.newaxis,:]
+        else:
+            w = np.zeros([1, len(antigens)])
+        objective += (y * shortage[h]).sum() + (5 * z * w).sum()
+        objective += (xh * assignment_costs(SETTINGS, PARAMS, hospitals[h].inventory, requests, [hospitals[h]])).sum()
+        objective += (xdc * assignment_costs(SETTINGS, PARAMS, dc.inventory, requests, [hospitals[h]], fifo = False)).sum()
+
+    return objective
+
+
+# Solve the subproblems of the given hospitals, in the processes of the given pool if there is one, where allowed gives the products of the
+# distribution center that each hospital may use, prices the price of each product of the distribution center, and num_requests the number
+# of requests that each hospital's shortage penalties are based on.
+def solve_subproblems(SETTINGS, PARAMS, dc, hospitals, day, allowed, prices, num_requests, pool):
+
+    if pool == None:
+        return [solve_subproblem(SETTINGS, PARAMS, dc, hospitals[h], day, allowed[h], prices, num_requests[h]) for h in range(len(hospitals))]
+
+    futures = [pool.submit(solve_subproblem, SETTINGS, PARAMS, dc, hospitals[h], day, allowed[h], prices, num_requests[h]) for h in range(len(hospitals))]
+    return [future.result() for future in futures]
+
+
+# Solve the subproblem of a single hospital, against the products of the distribution center that it may use only. Returns its xh, xdc (over all
+# products of the distribution center), y and z, the time at which the optimal solution was found, and the status and number of variables of the
+# model. The hospital's assignments are left as they were, so that all rounds start from yesterday's assignments, whether or not they are solved
+# in parallel.
+def solve_subproblem(SETTINGS, PARAMS, dc, hospital, day, allowed, prices, num_requests):
+
+    subproblem_dc = copy.copy(dc)
+    subproblem_dc.inventory = dc.inventory.select(allowed)
+
+    df = Results_recorder(["gurobi status", "nvars", "calc time", "time to optimal"], [(day, hospital.name)])
+    assigned = hospital.assigned
+    df, xh, xdc, y, z = solve_minrar_multiple_hospitals(SETTINGS, PARAMS, subproblem_dc, [hospital], day, df, None if prices is None else prices[allowed], [num_requests])
+    hospital.assigned = assigned
+
+    x = np.zeros([len(dc.inventory), len(hospital.requests)])
+    x[allowed] = xdc[0]
+    return xh[0], x, y[0], z[0], df.get(day, hospital.name, "time to optimal"), df.get(day, hospital.name, "gurobi status"), df.get(day, hospital.name, "nvars")
+
+
+# Ration the products of each overused class over the hospitals issuing them: all products issued from the class are ordered by the shortage
+# penalty of the request they are issued to (and by hospital in case of ties), and the first products get one of the class's products. Returns
+# for each hospital that does not get all products it issued the products of the distribution center it may still use, and None otherwise.
+def ration_classes(solutions, shortage, classes, counts, overused):
+
+    # Hospital, class and shortage penalty of every product issued from an overused class, in the order in which they are rationed.
+    h, c, penalty = [], [], []
+    for g in range(len(solutions)):
+        i, r = np.nonzero(np.round(solutions[g][1]) * overused[classes][:,np.newaxis])
+        h += [g] * len(i)
+        c += classes[i].tolist()
+        penalty += shortage[g][r].tolist()
+    order = np.lexsort([h, -np.array(penalty)])
+    h, c = np.array(h, dtype=int)[order], np.array(c, dtype=int)[order]
+
+    # Rank of each product issued within its class, and the number of products of each class that each hospital gets.
+    ranked = np.argsort(c, kind="stable")
+    rank = np.empty(len(c), dtype=int)
+    rank[ranked] = np.arange(len(c)) - np.searchsorted(c[ranked], c[ranked])
+    got = rank < counts[c]
+
+    quotas = [None for g in range(len(solutions))]
+    for g in np.unique(h[~got]).tolist():
+        quota = np.where(overused, 0, counts) + np.bincount(c[(h == g) & got], minlength=len(classes))
+        quotas[g] = products_up_to(classes, quota)
+
+    return quotas
+
+
+# Select the given number of products of each class (given per class representative), the first ones in order of their positions.
+def products_up_to(classes, numbers):
+
+    order = np.argsort(classes, kind="stable")
+    rank = np.empty(len(classes), dtype=int)
+    rank[order] = np.arange(len(classes)) - np.searchsorted(classes[order], classes[order])
+    return rank < numbers[classes]
+
+
+# Add the variables, constraints and objectives of the multi-hospital MINRAR model to the given Gurobi model, using quicksum expressions.
+# The xh, xdc, y and z variables are returned as lists with one tupledict per hospital.
+def build_minrar_multi_quicksum(model, H, R, Ih, Idc, Eh, Edc, Z, Mh, Mdc, bits, num_units, shortage, cz, cxh, cxdc):
 
     ###############
     ## VARIABLES ##
     ###############
 
     # For each hospital h∈H:
-        # xh: For eachrequest r∈R[h] and product i∈Ih[h] (hospital's inventory), xh[h][i,r] = 1 if r is satisfied by i, 0 otherwise.
-        # xdc: For each request r∈R[h] and i∈Idc (distribution center's inventory), xdc[h][i,r] = 1 if r is satisfied by i, 0 otherwise.
+        # xh: For each eligible pair of request r∈R[h] and product i∈Ih[h] (hospital's inventory), xh[h][i,r] = 1 if r is satisfied by i, 0 otherwise.
+        # xdc: For each eligible pair of request r∈R[h] and i∈Idc (distribution center's inventory), xdc[h][i,r] = 1 if r is satisfied by i, 0 otherwise.
         # y: For each request r∈R[h], y[h][r] = 1 if request r can not be fully satisfied (shortage), 0 otherwise.
-        # z: For each request r∈R[h] and antigen k∈A, z[h][r,k] = 1 if request r is mismatched on antigen k, 0 otherwise.
-    xh = [model.addVars(len(Ih[h]), len(R[h]), name=f"xh{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H.keys()]
-    xdc = [model.addVars(len(Idc), len(R[h]), name=f"xdc{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H.keys()]
-    y = [model.addVars(len(R[h]), name=f"y{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H.keys()]
-    z = [model.addVars(len(R[h]), len(A), name=f"z{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H.keys()]
+        # z: For each request r∈R[h] and antigen k∈A that r is negative for, z[h][r,k] = 1 if request r is mismatched on antigen k, 0 otherwise.
+    xh = [model.addVars(Eh[h], name=f"xh{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H]
+    xdc = [model.addVars(Edc[h], name=f"xdc{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H]
+    y = [model.addVars(len(R[h]), name=f"y{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H]
+    z = [model.addVars(Z[h], name=f"z{h}", vtype=GRB.BINARY, lb=0, ub=1) for h in H]
 
     model.update()
     model.ModelSense = GRB.MINIMIZE
 
-    for h in H.keys():
-        for r in R[h].keys():
-
-            # Remove variable xh[h][i,r] if the match is not timewise or antigen compatible.
-            for i in Ih[h].keys():
-                if (Ch[h][i,r] == 0) or (Th[h][i,r] == 0):
-                    model.remove(xh[h][i,r])
-            
-            # Remove variable xdc[h][i,r] if the match is not timewise or antigen compatible.
-            for i in Idc.keys():
-                if (Cdc[h][i,r] == 0) or (Tdc[h][i,r] == 0):
-                    model.remove(xdc[h][i,r])
-
-            for k in A.values():
-                if R[h][r].vector[k] == 1:
-                    model.remove(z[h][r,k])
-
-            # Remove variable xdc[h][i,r] if the issuing date of request r is today.
-            if t[h][r] == 2:
-                for i in Idc.keys():
-                    model.remove(xdc[h][i,r])
-
     #################
     ## CONSTRAINTS ##
     #################
 
     ncons = 0
 
-    for h in H.keys():
+    for h in H:
 
         Rh = R[h]
         Ihh = Ih[h]
 
         # Force y[r] to 1 if not all requested units are satisfied (either from the hospital's own inventory or from the dc's inventory).
-        # model.addConstrs(Rh[r].num_units - quicksum(xh[h][i,r] for i in Ihh.keys()) - quicksum(xdc[h][i,r] for i in Idc.keys()) <= Rh[r].num_units * y[h][r] for r in Rh.keys())
-        model.addConstrs((y[h][r] * Rh[r].num_units) + quicksum(xh[h][i,r] for i in Ihh.keys()) + quicksum(xdc[h][i,r] for i in Idc.keys()) >= Rh[r].num_units for r in Rh.keys())
+        # model.addConstrs(num_units[h][r] - quicksum(xh[h][i,r] for i in Ihh) - quicksum(xdc[h][i,r] for i in Idc) <= num_units[h][r] * y[h][r] for r in Rh)
+        model.addConstrs((y[h][r] * num_units[h][r]) + xh[h].sum('*', r) + xdc[h].sum('*', r) >= num_units[h][r] for r in Rh)
         ncons += len(Rh)
 
         # Force x[i,r] to 0 if a match between product i∈I and request r∈R is incompatible on antigens that are a 'must'.
         # Force x[i,r] to 0 if product i∈I is outdated before request r∈R has to be issued.
-        # model.addConstrs(xh[h][i,r] <= Ch[h][i,r] * Th[h][i,r] for i in Ihh.keys() for r in Rh.keys())
-        # model.addConstrs(xdc[h][i,r] <= Cdc[h][i,r] * Tdc[h][i,r] for i in Idc.keys() for r in Rh.keys())
+        # model.addConstrs(xh[h][i,r] <= Ch[h][i,r] * Th[h][i,r] for i in Ihh for r in Rh)
+        # model.addConstrs(xdc[h][i,r] <= Cdc[h][i,r] * Tdc[h][i,r] for i in Idc for r in Rh)
         # ncons += (len(Ihh) * len(Rh)) + (len(Idc) * len(Rh))
 
         # Force z[r,k] to 1 if at least one of the products i∈I that are issued to request r∈R mismatches on antigen k∈A.
-        model.addConstrs(quicksum(xh[h][i,r] * Ihh[i].vector[k] * (1 - Rh[r].vector[k]) for i in Ihh.keys()) <= z[h][r,k] * Rh[r].num_units for r in Rh.keys() for k in A_no_Fyb.values())
-        model.addConstrs(quicksum(xdc[h][i,r] * Idc[i].vector[k] * (1 - Rh[r].vector[k]) for i in Idc.keys()) <= z[h][r,k] * Rh[r].num_units for r in Rh.keys() for k in A_no_Fyb.values())
-        ncons += (len(Rh) * len(A_no_Fyb)) + (len(Rh) * len(A_no_Fyb))
-
-        # A request can only be mismatched on Fyb if it is positive for Fya.
-        model.addConstrs(quicksum(xh[h][i,r] * Ihh[i].vector[A["Fyb"]] * (1 - Rh[r].vector[A["Fyb"]]) * Rh[r].vector[A["Fya"]] for i in Ihh.keys()) <= z[h][r,A["Fyb"]] * Rh[r].num_units for r in Rh.keys())
-        model.addConstrs(quicksum(xdc[h][i,r] * Idc[i].vector[A["Fyb"]] * (1 - Rh[r].vector[A["Fyb"]]) * Rh[r].vector[A["Fya"]] for i in Idc.keys()) <= z[h][r,A["Fyb"]] * Rh[r].num_units for r in Rh.keys())
-        ncons += len(Rh) + len(Rh.keys())
+        # A request can only be mismatched on Fyb if it is positive for Fya, which is already accounted for in Mh and Mdc.
+        model.addConstrs(quicksum(xh[h][i,r] for i, r in Eh[h].select('*', r) if Mh[h][i][r] & bits[k]) <= z[h][r,k] * num_units[h][r] for r, k in Z[h])
+        model.addConstrs(quicksum(xdc[h][i,r] for i, r in Edc[h].select('*', r) if Mdc[h][i][r] & bits[k]) <= z[h][r,k] * num_units[h][r] for r, k in Z[h])
+        ncons += len(Z[h]) + len(Z[h])
 
         # For each request, the number of products allocated by the hospital and DC together should not exceed the number of units requested.
-        model.addConstrs(quicksum(xh[h][i,r] for i in Ihh.keys()) + quicksum(xdc[h][i,r] for i in Idc.keys()) <= Rh[r].num_units for r in Rh.keys())
+        model.addConstrs(xh[h].sum('*', r) + xdc[h].sum('*', r) <= num_units[h][r] for r in Rh)
         # ncons += len(Rh)
 
         # For each inventory product i∈I, ensure that i can not be issued more than once.
-        model.addConstrs(quicksum(xh[h][i,r] for r in Rh.keys()) <= 1 for i in Ihh.keys())
+        model.addConstrs(xh[h].sum(i, '*') <= 1 for i in Ihh)
         ncons += len(Ihh)
-    model.addConstrs(quicksum(quicksum(xdc[h][i,r] for r in R[h].keys()) for h in H.keys()) <= 1 for i in Idc.keys())
+    model.addConstrs(quicksum(xdc[h].sum(i, '*') for h in H) <= 1 for i in Idc)
     ncons += len(Idc)
 
     print("ncons:",ncons)
@@ -165,116 +513,88 @@ def minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df):
     ################
 
     # Assign a higher shortage penalty to requests with today as their issuing date.
-    model.setObjective(expr = quicksum(quicksum(y[h][r] * ((len(R[h]) * t[h][r]) + 1) for r in R[h].keys()) for h in H.keys()))         # Shortages.
+    model.setObjective(expr = quicksum(quicksum(y[h][r] * shortage[h][r] for r in R[h]) for h in H))         # Shortages.
 
-    if "patgroups" in SETTINGS.strategy:
-        model.setObjectiveN(expr = 5 * quicksum(quicksum(quicksum(z[h][r,k] * w[P[R[h][r].patgroup],k] for r in R[h].keys()) for h in H.keys()) for k in A.values())
-                                    + quicksum(quicksum(0.5 ** ((PARAMS.max_age - Ih[h][i].age - 1) / 5) * xh[h][i,r] for i in Ih[h].keys() for r in R[h].keys()) for h in H.keys())
-                                    # + quicksum(quicksum(quicksum(0.5 ** ((PARAMS.max_age - Idc[i].age - 1) / 5) * xdc[h][i,r] for r in R[h].keys()) for h in H.keys()) for i in Idc.keys())
-                                    + quicksum(quicksum((bih[h][i] - br[h][r]) * xh[h][i,r] for i in Ih[h].keys() for r in R[h].keys()) for h in H.keys())
-                                    # + quicksum(quicksum(quicksum((bidc[i] - br[h][r]) * xdc[h][i,r] for r in R[h].keys()) for h in H.keys()) for i in Idc.keys())
-                                    + quicksum(quicksum(quicksum(xh[h][i,r] * w[P[R[h][r].patgroup],k] * (1 - Ih[h][i].vector[k]) * R[h][r].vector[k] for r in [r for r in R[h].keys() if R[h][r].patgroup in ["Wu45", "Other"]] for i in Ih[h].keys()) for h in H.keys()) for k in A_minor.values())
-                                    + quicksum(quicksum(quicksum(xdc[h][i,r] * w[P[R[h][r].patgroup],k] * (1 - Idc[i].vector[k]) * R[h][r].vector[k] for r in [r for r in R[h].keys() if R[h][r].patgroup in ["Wu45", "Other"]]) for h in H.keys()) for i in Idc.keys() for k in A_minor.values())
-                                    , index=1, priority=0, name="other")
-    else:
-        model.setObjectiveN(expr = 5 * quicksum(quicksum(quicksum(z[h][r,k] * w[k] for r in R[h].keys()) for h in H.keys()) for k in A.values())
-                                    + quicksum(quicksum(0.5 ** ((PARAMS.max_age - Ih[h][i].age - 1) / 5) * xh[h][i,r] for i in Ih[h].keys() for r in R[h].keys()) for h in H.keys())
-                                    # + quicksum(quicksum(quicksum(0.5 ** ((PARAMS.max_age - Idc[i].age - 1) / 5) * xdc[h][i,r] for r in R[h].keys()) for h in H.keys()) for i in Idc.keys())
-                                    + quicksum(quicksum((bih[h][i] - br[h][r]) * xh[h][i,r] for i in Ih[h].keys() for r in R[h].keys()) for h in H.keys())
-                                    # + quicksum(quicksum(quicksum((bidc[i]  - br[h][r]) * xdc[h][i,r] for r in R[h].keys()) for h in H.keys()) for i in Idc.keys())
-                                    + quicksum(quicksum(quicksum(xh[h][i,r] * w[k] * (1 - Ih[h][i].vector[k]) * R[h][r].vector[k] for r in [r for r in R[h].keys() if R[h][r].patgroup in ["Wu45", "Other"]] for i in Ih[h].keys()) for h in H.keys()) for k in A_minor.values())
-                                    + quicksum(quicksum(quicksum(xdc[h][i,r] * w[k] * (1 - Idc[i].vector[k]) * R[h][r].vector[k] for r in [r for r in R[h].keys() if R[h][r].patgroup in ["Wu45", "Other"]]) for h in H.keys()) for i in Idc.keys() for k in A_minor.values())
-                                    , index=1, priority=0, name="other")
+    # Second objective: mismatches, fifo penalty, usability penalty, and minor antigen substitution.
+    model.setObjectiveN(expr = 5 * quicksum(quicksum(z[h][r,k] * cz[h][j] for j, (r, k) in enumerate(Z[h])) for h in H)
+                                + quicksum(quicksum(xh[h][i,r] * cxh[h][e] for e, (i, r) in enumerate(Eh[h])) for h in H)
+                                + quicksum(quicksum(xdc[h][i,r] * cxdc[h][e] for e, (i, r) in enumerate(Edc[h])) for h in H)
+                                , index=1, priority=0, name="other")
 
-    stop = time.perf_counter()
-    print(f"model initialization: {(stop - start):0.4f} seconds")
+    return xh, xdc, y, z
 
-    start = time.perf_counter()
-    model.optimize()
-    stop = time.perf_counter()
-    print(f"Optimize: {(stop - start):0.4f} seconds")
 
-    sc = model.SolCount
-    print(f"Solutions found: {sc}")
+# Add the same variables, constraints and objectives as build_minrar_multi_quicksum, but assembled from sparse coefficient matrices
+# (one column per variable), so that the model can be solved by any of the solvers of Solver_model.
+def build_minrar_multi_matrix(model, H, R, Ih, Idc, Eh, Edc, Z, Mh, Mdc, bits, num_units, shortage, cz, cxh, cxdc):
 
-    # Create numpy arrays filled with zeros.
-    xh = [np.zeros([sc, len(Ih[h]), len(R[h])]) for h in H.keys()]
-    xdc = [np.zeros([sc, len(Idc), len(R[h])]) for h in H.keys()]
-    y = [np.zeros([sc, len(R[h])]) for h in H.keys()]
-    z = [np.zeros([sc, len(R[h]), len(A)]) for h in H.keys()]
+    xh, xdc, y, z = [], [], [], []
+    X_Idc = []
 
-    for s in range(sc):
+    for h in H:
 
-        model.Params.SolutionNumber = s
-    
-        for h in range(len(hospitals)):
-            for var in model.getVars():
-                var_name = re.split(r'\W+', var.varName)[0]
-                if var_name == f"xh{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    xh[h][s, index0, index1] = var.X
-                if var_name == f"xdc{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    xdc[h][s, index0, index1] = var.X
-                if var_name == f"y{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    y[h][s, index0] = var.X
-                if var_name == f"z{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    z[h][s, index0, index1] = var.X
+        # Product and request of each eligible pair, and the index of each z-variable per request and antigen.
+        eh_i, eh_r = np.array(Eh[h], dtype=int).reshape(-1, 2).T
+        edc_i, edc_r = np.array(Edc[h], dtype=int).reshape(-1, 2).T
+        z_index = np.full([len(R[h]), len(bits)], -1)
+        for j, (r, k) in enumerate(Z[h]):
+            z_index[r,k] = j
 
-    if sc > 1:
+        ###############
+        ## VARIABLES ##
+        ###############
 
-        R_today = {h : [r for r in R[h].keys() if R[h][r].day_issuing == day] for h in H.keys()}
+        # xh, xdc, y and z as in build_minrar_multi_quicksum, with the same variable names.
+        xh.append(model.add_vars(len(Eh[h]), GRB.BINARY, names=[f"xh{h}[{i},{r}]" for i, r in Eh[h]]))
+        xdc.append(model.add_vars(len(Edc[h]), GRB.BINARY, names=[f"xdc{h}[{i},{r}]" for i, r in Edc[h]]))
+        y.append(model.add_vars(len(R[h]), GRB.BINARY, names=[f"y{h}[{r}]" for r in R[h]]))
+        z.append(model.add_vars(len(Z[h]), GRB.BINARY, names=[f"z{h}[{r},{k}]" for r, k in Z[h]]))
 
-        # For each solution found, the mismatch penalty for requests that need to be issued today.
-        if "patgroups"in SETTINGS.strategy:
-            mismatch_today = {s : sum([sum([z[h][s,r,k] * w[P[R[h][r].patgroup],k] for r in R_today[h]]) for h in H.keys() for k in A.values()]) for s in range(sc)}
-        else:
-            mismatch_today = {s : sum([sum([z[h][s,r,k] * w[k] for r in R_today[h]]) for h in H.keys() for k in A.values()]) for s in range(sc)}
-        best = [s for s in mismatch_today.keys() if mismatch_today[s] == min(mismatch_today.values())]
-        print(best)
-        
-        if len(best) > 1:
-            avg_age_today = {s : sum([sum([sum([xh[h][s,i,r] for r in R_today[h]]) * Ih[h][i].age for i in Ih[h].keys()]) + sum([sum([xdc[h][s,i,r] for r in R_today[h]]) * Idc[i].age for i in Idc.keys()]) for h in H.keys()]) / sum([sum(sum(xh[h][s])) + sum(sum(xdc[h][s])) for h in H.keys()]) for s in best}
-            best = [s for s in avg_age_today.keys() if avg_age_today[s] == max(avg_age_today.values())]
-            print(best)
-
-            if len(best) > 1:
-                usab_today = {s : sum([sum([(bih[h][i] - br[h][r]) * xh[h][s,i,r] for i in Ih[h].keys() for r in R_today[h]]) + sum([(bidc[i] - br[h][r]) * xdc[h][s,i,r] for i in Idc.keys() for r in R_today[h]]) for h in H.keys()]) for s in best}
-                best = [s for s in usab_today.keys() if usab_today[s] == min(usab_today.values())]
-                print(best)
-
-                if len(best) > 1:
-                    if "patgroups"in SETTINGS.strategy:
-                        substitution_today = {s : sum([sum([xh[h][s,i,r] * w[P[R[h][r].patgroup],k] * (1 - Ih[h][i].vector[k]) * R[h][r].vector[k] for k in A.values() for r in R_today[h] for i in Ih[h].keys()]) for h in H.keys()]) + sum([sum([xdc[h][s,i,r] * w[P[R[h][r].patgroup],k] * (1 - Idc[i].vector[k]) * R[h][r].vector[k] for k in A.values() for r in R_today[h] for i in Idc.keys()]) for h in H.keys()]) for s in best}
-                    else:
-                        substitution_today = {s : sum([sum([xh[h][s,i,r] * w[k] * (1 - Ih[h][i].vector[k]) * R[h][r].vector[k] for k in A.values() for r in R_today[h] for i in Ih[h].keys()]) for h in H.keys()]) + sum([sum([xdc[h][s,i,r] * w[k] * (1 - Idc[i].vector[k]) * R[h][r].vector[k] for k in A.values() for r in R_today[h] for i in Idc.keys()]) for h in H.keys()]) for s in best}
-                    best = [s for s in substitution_today.keys() if substitution_today[s] == min(substitution_today.values())]
-                    print(best)
-
-        for h in H.keys():
-            xh[h] = xh[h][best[0]]
-            xdc[h] = xdc[h][best[0]]
-            y[h] = y[h][best[0]]
-            z[h] = z[h][best[0]]
+        #################
+        ## CONSTRAINTS ##
+        #################
 
-    else:
-        for h in H.keys():
-            xh[h] = xh[h][0]
-            xdc[h] = xdc[h][0]
-            y[h] = y[h][0]
-            z[h] = z[h][0]
+        # Incidence matrices of the eligible pairs with their requests and products.
+        Xh_R = sp.csr_matrix((np.ones(len(eh_r)), (eh_r, np.arange(len(eh_r)))), shape=(len(R[h]), len(eh_r)))
+        Xdc_R = sp.csr_matrix((np.ones(len(edc_r)), (edc_r, np.arange(len(edc_r)))), shape=(len(R[h]), len(edc_r)))
+        Xh_I = sp.csr_matrix((np.ones(len(eh_i)), (eh_i, np.arange(len(eh_i)))), shape=(len(Ih[h]), len(eh_i)))
+        X_Idc.append(sp.csr_matrix((np.ones(len(edc_i)), (edc_i, np.arange(len(edc_i)))), shape=(len(Idc), len(edc_i))))
 
-    
-    # df.loc[(day,hospital.name),"gurobi status"] = model.status
-    # df.loc[(day,hospital.name),"nvars"] = len(model.getVars())
+        # Force y[r] to 1 if not all requested units are satisfied (either from the hospital's own inventory or from the dc's inventory).
+        model.add_constrs([(sp.diags(np.array(num_units[h], dtype=float)), y[h]), (Xh_R, xh[h]), (Xdc_R, xdc[h])], ">", np.array(num_units[h], dtype=float))
+
+        # Force z[r,k] to 1 if at least one of the products that are issued to request r∈R[h] mismatches on antigen k∈A, for the products in
+        # the hospital's and in the distribution center's inventory separately, where X_Z[j,e] = 1 if the product of eligible pair e mismatches
+        # its request on the antigen of z-variable j.
+        z_units = -sp.diags(np.array([num_units[h][r] for r, _ in Z[h]], dtype=float))
+        for x, M, e_i, e_r in [(xh[h], Mh[h], eh_i, eh_r), (xdc[h], Mdc[h], edc_i, edc_r)]:
+            M_E = np.array(M, dtype=np.uint32).reshape(-1, len(R[h]))[e_i, e_r] if len(e_i) > 0 else np.zeros(0, dtype=np.uint32)
+            e, k = np.nonzero((M_E[:,np.newaxis] & np.array(bits, dtype=np.uint32)[np.newaxis,:]) != 0)
+            X_Z = sp.csr_matrix((np.ones(len(e)), (z_index[e_r[e], k], e)), shape=(len(Z[h]), len(e_i)))
+            model.add_constrs([(X_Z, x), (z_units, z[h])], "<", np.zeros(len(Z[h])))
 
+        # For each request, the number of products allocated by the hospital and DC together should not exceed the number of units requested.
+        model.add_constrs([(Xh_R, xh[h]), (Xdc_R, xdc[h])], "<", np.array(num_units[h], dtype=float))
 
-    return df, xh, xdc, y, z
+        # For each inventory product i∈Ih[h], ensure that i can not be issued more than once.
+        model.add_constrs([(Xh_I, xh[h])], "<", np.ones(len(Ih[h])))
+
+    # For each product of the distribution center, ensure that it can not be issued more than once, over all hospitals together.
+    model.add_constrs([(X_Idc[h], xdc[h]) for h in H], "<", np.ones(len(Idc)))
+
+    ################
+    ## OBJECTIVES ##
+    ################
+
+    # Assign a higher shortage penalty to requests with today as their issuing date.
+    model.set_objective([(y[h], np.array(shortage[h], dtype=float)) for h in H])
+
+    # Second objective: mismatches, fifo penalty, usability penalty, and minor antigen substitution.
+    model.set_objective([(z[h], 5 * np.array(cz[h])) for h in H] + [(xh[h], np.array(cxh[h])) for h in H] + [(xdc[h], np.array(cxdc[h])) for h in H], index=1, priority=0, name="other")
+
+    # Return the variables as tupledicts with the same indices as those of build_minrar_multi_quicksum.
+    return ([tupledict(zip(Eh[h], list(xh[h]))) for h in H], [tupledict(zip(Edc[h], list(xdc[h]))) for h in H],
+            [tupledict(enumerate(list(y[h]))) for h in H], [tupledict(zip(Z[h], list(z[h]))) for h in H])
 
 
 # Multi-hospital setup: allocate products to each of the hospitals to restock them upto their maximum capacity.
@@ -286,33 +606,27 @@ def allocate_remaining_supply_from_dc(SETTINGS, PARAMS, day, inventory, hospital
     ## GUROBI ##
     ############
 
-    model = Model(name="model")
-    if SETTINGS.show_gurobi_output == False:
-        model.Params.LogToConsole = 0
-    if SETTINGS.gurobi_threads != None:
-        model.setParam('Threads', SETTINGS.gurobi_threads)
-    if SETTINGS.gurobi_timeout != None:
-        model.setParam('TimeLimit', SETTINGS.gurobi_timeout)
+    model = Solver_model(SETTINGS)
 
     ################
     ## PARAMETERS ##
     ################
 
     # Sets of all hospitals and of the distribution center's inventory products.
-    H = {h : hospitals[h] for h in range(len(hospitals))}
-    I = {i : inventory[i] for i in range(len(inventory))}
+    H = range(len(hospitals))
+    I = range(len(inventory))
+    age = inventory.age.tolist()
     
     # Get the usability of all inventory products with respect to the distribution of major blood types in the patient population.
-    bi = [I[i].get_usability(PARAMS, hospitals, antigens=PARAMS.minor) for i in I.keys()]
+    bi = inventory.get_usability(PARAMS, hospitals, antigens=PARAMS.minor).tolist()
 
 
     ###############
     ## VARIABLES ##
     ###############
 
-    # For each inventory product i∈I, x[i,h] = 1 if product i will be shipped to hospital h, 0 otherwise.
-    x = model.addVars(len(I), len(hospitals), name='x', vtype=GRB.BINARY, lb=0, ub=1)
-    model.update()
+    # For each inventory product i∈I, x[i,h] = 1 if product i will be shipped to hospital h, 0 otherwise (ordered by product, then by hospital).
+    x = model.add_vars(len(I) * len(H), GRB.BINARY, names=[f"x[{i},{h}]" for i in I for h in H])
 
 
     #################
@@ -320,24 +634,21 @@ def allocate_remaining_supply_from_dc(SETTINGS, PARAMS, day, inventory, hospital
     #################
 
     # Force x[i,h] to 1 if product i∈I was already allocated to hospital h∈H in the previous optimization.
-    model.addConstrs(x[i,h] >= allocations_from_dc[i,h] for i in I.keys() for h in H.keys())
+    model.add_constrs([(sp.identity(len(I) * len(H), format="csr"), x)], ">", np.asarray(allocations_from_dc, dtype=float).reshape(-1))
 
     # Make sure the number of supplied products is at least the necessary amount to restock each hospital completely.
-    model.addConstrs(quicksum(x[i,h] for i in I.keys()) >= supply_sizes[h] for h in H.keys())
+    model.add_constrs([(sp.kron(np.ones([1, len(I)]), sp.identity(len(H)), format="csr"), x)], ">", np.array(supply_sizes, dtype=float))
 
     # For each inventory product i∈I, ensure that i can not be allocated more than once.
-    model.addConstrs(quicksum(x[i,h] for h in H.keys()) <= 1 for i in I.keys())
+    model.add_constrs([(sp.kron(sp.identity(len(I)), np.ones([1, len(H)]), format="csr"), x)], "<", np.ones(len(I)))
 
 
     ################
     ## OBJECTIVES ##
     ################
 
-    model.setObjective(expr = quicksum(0.5 ** ((PARAMS.max_age - I[i].age - 1) / 5) * x[i,h] for i in I.keys() for h in H.keys())   # FIFO penalties.
-                            + quicksum(bi[i] * x[i,h] for i in I.keys() for h in H.keys()))                                         # Product usability on major antigens.
-
-    # Minimize the objective functions.
-    model.ModelSense = GRB.MINIMIZE
+    # FIFO penalties and product usability on major antigens.
+    model.set_objective([(x, np.repeat([0.5 ** ((PARAMS.max_age - age[i] - 1) / 5) + bi[i] for i in I], len(H)))])
 
     stop = time.perf_counter()
     # print(f"model initialization: {(stop - start):0.4f} seconds")
@@ -352,9 +663,9 @@ def allocate_remaining_supply_from_dc(SETTINGS, PARAMS, day, inventory, hospital
     stop = time.perf_counter()
     # print(f"optimize: {(stop - start):0.4f} seconds")
 
-    print(PARAMS.status_code[model.status])
+    print(PARAMS.status_code[model.status_code])
 
-    return model
+    return model, tupledict(zip([(i, h) for i in I for h in H], list(x)))
 
 
     
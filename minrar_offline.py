@@ -5,6 +5,7 @@ import math
 
 from blood import *
 from log import *
+from solver import *
 
 # Single-hospital scenario with Offline solving.
 def minrar_offline(SETTINGS, PARAMS, hospital, days):
@@ -15,13 +16,9 @@ def minrar_offline(SETTINGS, PARAMS, hospital, days):
     ## GUROBI ##
     ############
 
-    model = Model(name="model")
-    if SETTINGS.show_gurobi_output == False:
-        model.Params.LogToConsole = 0
-    if SETTINGS.gurobi_threads != None:
-        model.setParam('Threads', SETTINGS.gurobi_threads)
-    if SETTINGS.gurobi_timeout != None:
-        model.setParam('TimeLimit', SETTINGS.gurobi_timeout)
+    # The offline model is always solved by Gurobi, and is built directly with Gurobi's modelling objects.
+    solver_model = Solver_model(SETTINGS, solver="gurobi")
+    model = solver_model.model
 
     ################
     ## PARAMETERS ##
@@ -33,6 +30,9 @@ def minrar_offline(SETTINGS, PARAMS, hospital, days):
     A_minor = {k : A[k] for k in PARAMS.minor}
     A_no_Fyb = {k : A[k] for k in antigens if k != "Fyb"}
 
+    # Packed key of each single antigen, to test whether it is contained in a packed set of antigens.
+    bits = [int(antigens_to_key(PARAMS, [ag])) for ag in antigens]
+
     # Mapping of the patient groups to their index in the list of patient groups.
     P = {PARAMS.patgroups[i] : i for i in range(len(PARAMS.patgroups))}
 
@@ -45,127 +45,119 @@ def minrar_offline(SETTINGS, PARAMS, hospital, days):
         w = np.array([0] * len(antigens))
 
     # Sets of all inventory products and patient requests.
-    I = {i : hospital.inventory[i] for i in range(len(hospital.inventory))}
-    R = {r : hospital.requests[r] for r in range(len(hospital.requests))}
+    I = range(len(hospital.inventory))
+    R = range(len(hospital.requests))
+
+    # Antigen phenotypes and other properties of all inventory products and patient requests.
+    ki = hospital.inventory.keys.tolist()
+    vr = hospital.requests.vectors.tolist()
+    num_units = hospital.requests.num_units.tolist()
+    day_issuing = hospital.requests.day_issuing.tolist()
+    pg = hospital.requests.patgroup.tolist()
 
     # List of pairs of inventory products that should be supplied in that order.
     consecutive_Is = [(i,i+1) for i in range(len(hospital.inventory)-1)]
 
     # Matrix containing a 1 if product i∈I is compatible with request r∈R on the major and manditory antigens, 0 otherwise.
-    C = precompute_compatibility(SETTINGS, PARAMS, I, R)
+    C = precompute_compatibility(SETTINGS, PARAMS, hospital.inventory, hospital.requests)
+
+    # TODO write proof for these numbers.
+    # The minimum and maximum index i∈I that can be available in the inventory on each day.
+    i_min, i_max = {}, {}
+    cumulative_requests = 0
+    for day in days:
+        i_min[day] = hospital.inventory_size * np.floor(day / PARAMS.max_age)
+        i_max[day] = cumulative_requests + (hospital.inventory_size * (1 + np.ceil(day / PARAMS.max_age)))
+        cumulative_requests += day_issuing.count(day)
+
+    # For each product i∈I and request r∈R, Q[i,r] = 1 if i can be present in the inventory on the day that r is issued.
+    # Requests that are issued after the last simulated day can be satisfied by any product.
+    Q = np.ones([len(I), len(R)], dtype=bool)
+    for r in [r for r in R if day_issuing[r] in days]:
+        Q[:,r] = (np.array(I) >= i_min[day_issuing[r]]) & (np.array(I) <= i_max[day_issuing[r]])
+
+    # All pairs of products i∈I and requests r∈R that are compatible and can meet in the inventory, all pairs of requests r∈R and
+    # antigens k∈A on which r can be mismatched (a request can only be mismatched on Fyb if it is positive for Fya), and all pairs of
+    # products i∈I and days for which i can be present in the inventory.
+    E = tuplelist(eligible_pairs(C, Q))
+    Z = [(r,k) for r in R for k in A.values() if (day_issuing[r] not in days) or ((vr[r][k] == 0) and ((k != A["Fyb"]) or (vr[r][A["Fya"]] == 1)))]
+    D = [(i,day) for i in I for day in days if (i >= i_min[day]) and (i <= i_max[day])]
 
     ###############
     ## VARIABLES ##
     ###############
 
-    # x: For each request r∈R and inventory product i∈I, x[i,r] = 1 if r is satisfied by i, 0 otherwise.
+    # x: For each eligible pair of request r∈R and inventory product i∈I, x[i,r] = 1 if r is satisfied by i, 0 otherwise.
     # y: For each request r∈R, y[r] = 1 if request r can not be fully satisfied (shortage), 0 otherwise.
-    # z: For each request r∈R and antigen k∈A, z[r,k] = 1 if request r is mismatched on antigen k, 0 otherwise.
+    # z: For each request r∈R and antigen k∈A that r can be mismatched on, z[r,k] = 1 if request r is mismatched on antigen k, 0 otherwise.
     # p: 1 if product i has already been sampled on some day, 0 if not (yet) sampled.
     # d: 1 if product i has already been issued, 0 if not (yet) issued.
 
     print("Creating x.")
-    x = model.addVars(len(I), len(R), name='x', vtype=GRB.BINARY, lb=0, ub=1)
+    x = model.addVars(E, name='x', vtype=GRB.BINARY, lb=0, ub=1)
     print("Creating y.")
     y = model.addVars(len(R), name='y', vtype=GRB.BINARY, lb=0, ub=1)
     print("Creating z.")
-    z = model.addVars(len(R), len(A), name='z', vtype=GRB.BINARY, lb=0, ub=1)
+    z = model.addVars(Z, name='z', vtype=GRB.BINARY, lb=0, ub=1)
 
     print("Creating a.")
     a = model.addVars(len(I), len(days), name='a', vtype=GRB.BINARY, lb=0, ub=1)
     print("Creating b.")
-    b = model.addVars(len(I), len(days), name='b', vtype=GRB.BINARY, lb=0, ub=1)
-
-    model.update()
-
-    # Remove variable x[i,r] if the match is not timewise or antigen compatible.
-    for r in R.keys():
-        for i in I.keys():
-            if C[i,r] == 0:
-                model.remove(x[i,r])
+    b = model.addVars(D, name='b', vtype=GRB.BINARY, lb=0, ub=1)
 
     #################
     ## CONSTRAINTS ##
     #################
 
-    nvars = (len(I)*len(R)) + len(R) + (len(R)*len(A)) + (len(I)*len(days)) + (len(I)*len(days))
+    nvars = len(x) + len(y) + len(z) + len(a) + len(b)
     ncons = 0
 
-    cumulative_requests = 0
     for day in days:
         print("Day:", day)
-        r_today = [r for r in R.keys() if R[r].day_issuing == day]
-
-        # TODO write proof for these numbers.
-        # The minimum and maximum index i∈I that can currently be available in the inventory.
-        i_min = hospital.inventory_size * np.floor(day / PARAMS.max_age)
-        i_max = cumulative_requests + (hospital.inventory_size * (1 + np.ceil(day / PARAMS.max_age)))
-
-        cumulative_requests += len(r_today)
+        r_today = [r for r in R if day_issuing[r] == day]
 
         for r in r_today:
 
-            for k in A_no_Fyb.values():
-                if R[r].vector[k] == 0:
-                    # Force z[r,k] to 1 if at least one of the products i∈I that are issued to request r∈R mismatches on antigen k∈A.
-                    model.addConstr(quicksum(x[i,r] for i in [i for i in I.keys() if I[i].vector[k] == 1]) <= z[r,k] * R[r].num_units)
-                    ncons += 1
-                else:
-                    model.remove(z[r,k])
-                    nvars -= 1
-                  
-            # A request can only be mismatched on Fyb if it is positive for Fya.  
-            if (R[r].vector[A["Fyb"]] == 0) and (R[r].vector[A["Fya"]] == 1):
-                # Force z[r,k] to 1 if at least one of the products i∈I that are issued to request r∈R mismatches on antigen Fyb.
-                model.addConstr(quicksum(x[i,r] for i in [i for i in I.keys() if I[i].vector[A["Fyb"]] == 1]) <= z[r,A["Fyb"]] * R[r].num_units)
+            # Force z[r,k] to 1 if at least one of the products i∈I that are issued to request r∈R mismatches on antigen k∈A.
+            for k in [k for k in A.values() if (r,k) in z]:
+                model.addConstr(quicksum(x[i,r] for i, r in E.select('*', r) if ki[i] & bits[k]) <= z[r,k] * num_units[r])
                 ncons += 1
-            else:
-                model.remove(z[r,A["Fyb"]])
-                nvars -= 1
-
-            for i in I.keys():
-                # Only include these constraints for products that are possibly present in the inventory.
-                if (i >= i_min) and (i <= i_max):
 
-                    # A product can only be assigned to a request if it is present in inventory at the day request r is issued.
-                    model.addConstr(x[i,r] <= a[i,R[r].day_issuing] - b[i,R[r].day_issuing])
-                    ncons += 1
-
-                else:
-                    model.remove(x[i,r])
-                    nvars -= 1
+            # A product can only be assigned to a request if it is present in inventory at the day request r is issued.
+            for i, r in E.select('*', r):
+                model.addConstr(x[i,r] <= a[i,day_issuing[r]] - b[i,day_issuing[r]])
+                ncons += 1
 
-        for i in I.keys():
-            # Only include these constraints for products that are possibly present in the inventory.
-            if (i >= i_min) and (i <= i_max):
+        for i in [i for i, d in D if d == day]:
 
-                # b[i,day] is forced to 1 as soon as product i is issued.
-                model.addConstr(quicksum(x[i,r] * R[r].day_issuing for r in R.keys()) <= b[i,day] * day)
-                if day in days[PARAMS.max_age:-(PARAMS.max_age-1)]:
-                    # Max-age days after product i has become available, b[i,day] is forced to 1.
-                    model.addConstr(a[i,day-PARAMS.max_age] <= b[i,day])
+            # A product that is possibly present in the inventory can not be issued before it has become available.
+            if len(r_today) > 0:
+                model.addConstr(b[i,day] <= a[i,day])
+                ncons += 1
 
-                ncons += 2
+            # b[i,day] is forced to 1 as soon as product i is issued.
+            model.addConstr(quicksum(x[i,r] * day_issuing[r] for i, r in E.select(i, '*')) <= b[i,day] * day)
+            if day in days[PARAMS.max_age:-(PARAMS.max_age-1)]:
+                # Max-age days after product i has become available, b[i,day] is forced to 1.
+                model.addConstr(a[i,day-PARAMS.max_age] <= b[i,day])
 
-            else:
-                model.remove(b[i,day])
-                nvars -= 1
+            ncons += 2
 
     # The products should become available in the same order as sampled.
     model.addConstrs(a[j,day] <= a[i,day] for i,j in [(i,j) for (i,j) in consecutive_Is] for day in days)
     ncons += len(consecutive_Is) * len(days)
     
     # At every day during the simulation, the total number of products present in inventory should sum up to the hospital's inventory size.
-    model.addConstrs(quicksum(a[i,day] - b[i,day] for i in I.keys()) == hospital.inventory_size for day in days)
+    model.addConstrs(quicksum(a[i,day] for i in I) - b.sum('*', day) == hospital.inventory_size for day in days)
     # print("constraints inventory total: ", len(days))
     ncons += len(days)
 
     # For each inventory product i∈I, ensure that i can not be issued more than once.
-    model.addConstrs(quicksum(x[i,r] for r in R.keys()) <= 1 for i in I.keys())
+    model.addConstrs(x.sum(i, '*') <= 1 for i in I)
     ncons += len(I)
 
     # Force y[r] to 1 if not all requested units are satisfied.
-    model.addConstrs(R[r].num_units - quicksum(x[i,r] for i in I.keys()) <= R[r].num_units * y[r] for r in R.keys())
+    model.addConstrs(num_units[r] - x.sum('*', r) <= num_units[r] * y[r] for r in R)
     # print("constraints shortages: ", len(R))
     ncons += len(R)
 
@@ -179,14 +171,14 @@ def minrar_offline(SETTINGS, PARAMS, hospital, days):
     ################
 
     # Assign a higher shortage penalty to requests with today as their issuing date.
-    model.setObjectiveN(expr = quicksum(y[r] for r in R.keys()), index=0, priority=1, name="shortages") 
+    model.setObjectiveN(expr = quicksum(y[r] for r in R), index=0, priority=1, name="shortages") 
     if "patgroups" in SETTINGS.strategy:
-        model.setObjectiveN(expr = quicksum(z[r,k] * w[P[R[r].patgroup],k] for k in A.values() for r in R.keys())   # Mismatches on minor antigens.
-                                   + quicksum(1 - quicksum(x[i,r] for r in R.keys()) for i in I.keys()) * len(R)    # Number of outdates.
+        model.setObjectiveN(expr = quicksum(z[r,k] * w[pg[r],k] for r, k in Z)     # Mismatches on minor antigens.
+                                   + quicksum(1 - x.sum(i, '*') for i in I) * len(R)      # Number of outdates.
                                    , index=1, priority=0, name="other")
     else:
-        model.setObjectiveN(expr = quicksum(z[r,k] * w[k] for k in A.values() for r in R.keys())                    # Mismatches on minor antigens.
-                                   + quicksum(1 - quicksum(x[i,r] for r in R.keys()) for i in I.keys()) * len(R)    # Number of outdates.
+        model.setObjectiveN(expr = quicksum(z[r,k] * w[k] for r, k in Z)           # Mismatches on minor antigens.
+                                   + quicksum(1 - x.sum(i, '*') for i in I) * len(R)      # Number of outdates.
                                    , index=1, priority=0, name="other")
     
     # Minimize the objective functions.
@@ -207,4 +199,4 @@ def minrar_offline(SETTINGS, PARAMS, hospital, days):
 
     print(PARAMS.status_code[model.status])
     
-    return model
+    return solver_model, (x, y, z, a, b)
@@ -1,14 +1,37 @@
 from gurobipy import *
 import numpy as np
+import scipy.sparse as sp
 import time
 import math
 
 from blood import *
 from log import *
+from presolve import *
+from read_solution import *
+from solver import *
 
-# Single-hospital setup: MINRAR model for matching within a single hospital.
+# Single-hospital setup: MINRAR model for matching within a single hospital. If SETTINGS.presolve is True, requests whose assignment can be fixed
+# beforehand are assigned greedily, and only the remaining products and requests are passed to the solver.
 def minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df):
 
+    if SETTINGS.presolve == False:
+        return solve_minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df)
+
+    eligible = (precompute_compatibility(SETTINGS, PARAMS, hospital.inventory, hospital.requests) == 1) & (timewise_possible(SETTINGS, PARAMS, hospital.inventory, hospital.requests, day) == 1)
+    presolve = Preassignment(SETTINGS, PARAMS, hospital, eligible, presolve_costs(SETTINGS, PARAMS, hospital.inventory, hospital.requests, [hospital]))
+
+    residual = presolve.residual(hospital)
+    df, x, y, z = solve_minrar_single_hospital(SETTINGS, PARAMS, residual, day, df, num_requests = len(hospital.requests))
+    presolve.restore(hospital, residual)
+
+    df.set(day, hospital.name, "num presolved requests", presolve.num_removed())
+    return df, presolve.expand_x(x), presolve.expand_y(y), presolve.expand_z(PARAMS, z)
+
+
+# Solve the single-hospital MINRAR model for all products and requests of the given hospital. The shortage penalties are based on the given number
+# of requests, which is the hospital's own number of requests by default, and that of the full problem if the hospital is the presolve's residual.
+def solve_minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df, num_requests = None):
+
     start = time.perf_counter()
 
     ################
@@ -21,6 +44,9 @@ def minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df):
     A_minor = {k : A[k] for k in PARAMS.minor}
     A_no_Fyb = {k : A[k] for k in antigens if k != "Fyb"}
 
+    # Packed key of each single antigen, to test whether it is contained in a packed set of antigens.
+    bits = [int(antigens_to_key(PARAMS, [ag])) for ag in antigens]
+
     # Mapping of the patient groups to their index in the list of patient groups.
     P = {PARAMS.patgroups[i] : i for i in range(len(PARAMS.patgroups))}
 
@@ -33,184 +59,439 @@ def minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df):
         w = np.array([0] * len(antigens))
 
     # Sets of all inventory products and patient requests.
-    I = {i : hospital.inventory[i] for i in range(len(hospital.inventory))}
-    R = {r : hospital.requests[r] for r in range(len(hospital.requests))}
+    I = range(len(hospital.inventory))
+    R = range(len(hospital.requests))
+
+    # Antigen phenotypes and other properties of all inventory products and patient requests.
+    vr = hospital.requests.vectors.tolist()
+    age = hospital.inventory.age.tolist()
+    num_units = hospital.requests.num_units.tolist()
+    day_issuing = hospital.requests.day_issuing.tolist()
+    pg = hospital.requests.patgroup.tolist()
 
     # Get the usability of all inventory products and patient requests with respect to the
     # distribution of major blood types in the patient population.
-    bi = [I[i].get_usability(PARAMS, [hospital]) for i in I.keys()]
-    br = [R[r].get_usability(PARAMS, [hospital]) for r in R.keys()]
+    bi = hospital.inventory.get_usability(PARAMS, [hospital]).tolist()
+    br = hospital.requests.get_usability(PARAMS, [hospital]).tolist()
 
-    # print([f"{I[i].index}:{bi[i]}" for i in I.keys()])
+    # print([f"{hospital.inventory.index[i]}:{bi[i]}" for i in I])
     # print(br)
 
     # Matrices containing a 1 if product i∈I is compatible with request r∈R, 0 otherwise.
-    C = precompute_compatibility(SETTINGS, PARAMS, I, R)    # The product is compatible with the request on major and manditory antigens
-    T = timewise_possible(SETTINGS, PARAMS, I, R, day)      # The product is not outdated before issuing date of request.
+    C = precompute_compatibility(SETTINGS, PARAMS, hospital.inventory, hospital.requests)     # The product is compatible with the request on major and manditory antigens
+    T = timewise_possible(SETTINGS, PARAMS, hospital.inventory, hospital.requests, day)       # The product is not outdated before issuing date of request.
+
+    # For each product i∈I and request r∈R, the penalty for substituting antigens that r is positive for by a product that is negative for them,
+    # over all antigens (used to select between optimal solutions). The penalty is looked up per pair of distinct phenotypes.
+    _, penalty = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
+    S = mismatched_antigens(PARAMS, hospital.requests.keys, hospital.inventory.keys, fyb_rule = False).T
+    subst_all = penalty[hospital.requests.patgroup[np.newaxis,:], S]
 
     # For each request r∈R, t[r] = 1 if the issuing day is today, 0 if it lies in the future.
-    t = [1 - min(1, R[r].day_issuing - day) for r in R.keys()]
+    t = issuing_urgency(hospital.requests, day).tolist()
+
+    # Shortage penalty of each request, which is higher for requests with today as their issuing date.
+    shortage = ((len(R) if num_requests == None else num_requests) * np.array(t)) + 1
 
     ############
     ## GUROBI ##
     ############
 
-    model = Model(name="model")
-    if SETTINGS.show_gurobi_output == False:
-        model.Params.LogToConsole = 0
-    if SETTINGS.gurobi_threads != None:
-        model.setParam('Threads', SETTINGS.gurobi_threads)
-    if SETTINGS.gurobi_timeout != None:
-        model.setParam('TimeLimit', SETTINGS.gurobi_timeout)
+    # Classes of interchangeable products, only used in the aggregated formulation.
+    classes, counts = None, None
+
+    # Incremental mode: keep one model alive per hospital, and only update it with today's changes in products and requests.
+    if SETTINGS.model_builder == "incremental":
+        if hospital.model == None:
+            hospital.model = Incremental_minrar(new_minrar_model(SETTINGS))
+        model, x_vars, y_vars, z_vars = hospital.model.update(SETTINGS, PARAMS, hospital, day, (C == 1) & (T == 1), w, shortage)
+
+    else:
+        model = new_minrar_model(SETTINGS)
+
+        # All pairs of products i∈I and requests r∈R that are both compatible and timewise possible, and all pairs of
+        # requests r∈R and antigens k∈A that r is negative for, as r can never be mismatched on antigens it is positive for.
+        E = tuplelist(eligible_pairs(C, T))
+        Z = [(r,k) for r in R for k in A.values() if vr[r][k] == 0]
+
+        # Aggregated formulation: products with the same age that only differ on antigens without any effect in the model are interchangeable,
+        # so they are grouped into classes, each represented by its first product. Only representatives get x-variables, which count the
+        # products of the class issued to a request.
+        if SETTINGS.model_builder == "aggregated":
+            classes, counts = product_classes(SETTINGS, PARAMS, hospital.inventory)
+            E = tuplelist([(i, r) for i, r in E if classes[i] == i])
+
+        # For each product i∈I and request r∈R, M[i][r] is the packed set of antigens on which i mismatches r, and subst[i][r]
+        # the substitution penalty of the antigens that r is positive for and i is negative for, over the minor antigens only.
+        M = mismatched_antigens(PARAMS, hospital.inventory.keys, hospital.requests.keys).tolist()
+        subst = penalty[hospital.requests.patgroup[np.newaxis,:], S & antigens_to_key(PARAMS, PARAMS.minor)].tolist()
+
+        # Mismatch penalty of each z[r,k] with (r,k)∈Z, and the fifo penalty, usability penalty and minor antigen substitution
+        # penalty of each x[i,r] with (i,r)∈E, which together make up the second objective.
+        if "patgroups" in SETTINGS.strategy:
+            cz = [w[pg[r],k] for r, k in Z]
+        else:
+            cz = [w[k] for r, k in Z]
+        cx = [0.5 ** ((PARAMS.max_age - age[i] - 1) / 5) + (bi[i] - br[r]) + (subst[i][r] if pg[r] in [P["Wu45"], P["Other"]] else 0) for i, r in E]
+
+        # Build the model's variables, constraints and objectives, either with quicksum expressions or from sparse coefficient matrices.
+        if SETTINGS.model_builder == "matrix":
+            x_vars, y_vars, z_vars = build_minrar_matrix(model, I, R, E, Z, M, bits, num_units, shortage, cz, cx)
+        else:
+            x_vars, y_vars, z_vars = build_minrar_quicksum(model.model, I, R, E, Z, M, bits, num_units, shortage, cz, cx, counts)
+
+    stop = time.perf_counter()
+    print(f"model initialization: {(stop - start):0.4f} seconds")
+
+    # Instead of selecting between a pool of optimal solutions afterwards, let the solver apply the same tie-breaking criteria to today's requests.
+    if SETTINGS.tie_break == "hierarchical":
+        today = set([r for r in R if day_issuing[r] == day])
+        x_today = [(i, r) for i, r in x_vars.keys() if r in today]
+        z_today = [(r, k) for r, k in z_vars.keys() if r in today]
+        x_today_vars = [x_vars[key] for key in x_today]
+        set_tie_break_objectives(model, [([z_vars[key] for key in z_today], [w[pg[r],k] if "patgroups" in SETTINGS.strategy else w[k] for r, k in z_today])],
+                                    [(x_today_vars, [age[i] for i, r in x_today])],
+                                    [(x_today_vars, [bi[i] - br[r] for i, r in x_today])],
+                                    [(x_today_vars, [subst_all[i,r] for i, r in x_today])])
+
+    # Start from yesterday's assignments of products to requests that are both still present.
+    if SETTINGS.warm_start:
+        set_assignment_start(model, x_vars, hospital.inventory, hospital.requests, hospital.assigned, classes)
+
+    start = time.perf_counter()
+    time_to_optimal = model.optimize()
+    stop = time.perf_counter()
+    print(f"Optimize: {(stop - start):0.4f} seconds, optimal solution found after {time_to_optimal:0.4f} seconds")
+
+    # With hierarchical tie-breaking, the best solution found is already the preferred one.
+    sc = model.num_solutions
+    print(f"Solutions found: {sc}")
+
+    x = np.zeros([sc, len(I), len(R)])
+    y = np.zeros([sc, len(R)])
+    z = np.zeros([sc, len(R), len(A)])
+
+    # Get the variable values for all optimal solutions found.
+    for s in range(sc):
+
+        x[s] = variable_values(model, x_vars, [len(I), len(R)], s)
+        if SETTINGS.model_builder == "aggregated":
+            x[s] = disaggregate(x[s], classes)
+        y[s] = variable_values(model, y_vars, [len(R)], s)
+        z[s] = variable_values(model, z_vars, [len(R), len(A)], s)
+
+    if sc > 1:
+
+        # Score all solutions found on today's requests, and select the preferred one.
+        today = hospital.requests.day_issuing == day
+        weights = w[hospital.requests.patgroup] if "patgroups" in SETTINGS.strategy else np.broadcast_to(w, [len(R), len(A)])
+        best = select_solution(score_mismatches(z, today, weights), *score_assignments(x, today, hospital.inventory.age, np.subtract.outer(bi, br), subst_all))
+
+        x = x[best]
+        y = y[best]
+        z = z[best]
+
+    else:
+
+        x = x[0]
+        y = y[0]
+        z = z[0]
+
+    # Remember today's assignments, to warm-start tomorrow's solve.
+    hospital.assigned = assigned_pairs(x, hospital.inventory, hospital.requests)
+
+    df.set(day, hospital.name, "gurobi status", model.status_code)
+    df.set(day, hospital.name, "nvars", model.num_vars)
+    df.set(day, hospital.name, "calc time", model.optimization_time)
+    df.set(day, hospital.name, "time to optimal", time_to_optimal)
 
-    model.Params.PoolSearchMode = 2
-    model.Params.PoolSolutions = 50
-    model.Params.PoolGap = 0
+    return df, x, y, z
 
+# Add the variables, constraints and objectives of the single-hospital MINRAR model to the given model, using quicksum expressions.
+# The x, y and z variables are returned as tupledicts. If the number of products in each product's class is given (aggregated formulation),
+# x[i,r] is an integer counting the products of i's class issued to r, and only exists for the class representatives in E.
+def build_minrar_quicksum(model, I, R, E, Z, M, bits, num_units, shortage, cz, cx, counts = None):
 
     ###############
     ## VARIABLES ##
     ###############
 
-    # x: For each request r∈R and inventory product i∈I, x[i,r] = 1 if r is satisfied by i, 0 otherwise.
+    # x: For each eligible pair of inventory product i∈I and request r∈R, x[i,r] = 1 if r is satisfied by i, 0 otherwise.
     # y: For each request r∈R, y[r] = 1 if request r can not be fully satisfied (shortage), 0 otherwise.
-    # z: For each request r∈R and antigen k∈A, z[r,k] = 1 if request r is mismatched on antigen k, 0 otherwise.
-    x = model.addVars(len(I), len(R), name='x', vtype=GRB.BINARY, lb=0, ub=1)
+    # z: For each request r∈R and antigen k∈A that r is negative for, z[r,k] = 1 if request r is mismatched on antigen k, 0 otherwise.
+    if counts is None:
+        x = model.addVars(E, name='x', vtype=GRB.BINARY, lb=0, ub=1)
+    else:
+        x = model.addVars(E, name='x', vtype=GRB.INTEGER, lb=0, ub=[counts[i] for i, r in E])
+        I = np.flatnonzero(counts).tolist()
     y = model.addVars(len(R), name='y', vtype=GRB.BINARY, lb=0, ub=1)
-    z = model.addVars(len(R), len(A), name='z', vtype=GRB.BINARY, lb=0, ub=1)
+    z = model.addVars(Z, name='z', vtype=GRB.BINARY, lb=0, ub=1)
 
     model.update()
     model.ModelSense = GRB.MINIMIZE
 
-    # Remove variable x[i,r] if the match is not timewise or antigen compatible.
-    for r in R.keys():
-        for i in I.keys():
-            if (C[i,r] == 0) or (T[i,r] == 0):
-                model.remove(x[i,r])
-        for k in A.values():
-            if R[r].vector[k] == 1:
-                model.remove(z[r,k])
-
     #################
     ## CONSTRAINTS ##
     #################
 
     # Force y[r] to 1 if not all requested units are satisfied.
-    # model.addConstrs(R[r].num_units - quicksum(x[i,r] for i in I.keys()) <= R[r].num_units * y[r] for r in R.keys())
-    model.addConstrs((y[r] * R[r].num_units) + quicksum(x[i,r] for i in I.keys()) >= R[r].num_units for r in R.keys())
-
-    # For each inventory product i∈I, ensure that i can not be issued more than once.
-    model.addConstrs(quicksum(x[i,r] for r in R.keys()) <= 1 for i in I.keys())
+    # model.addConstrs(num_units[r] - quicksum(x[i,r] for i in I) <= num_units[r] * y[r] for r in R)
+    model.addConstrs((y[r] * num_units[r]) + x.sum('*', r) >= num_units[r] for r in R)
 
-    # Force x[i,r] to 0 if a match between product i∈I and request r∈R is incompatible on antigens that are a 'must'.
-    # Force x[i,r] to 0 if product i∈I is outdated before request r∈R has to be issued.
-    # model.addConstrs(x[i,r] <= C[i,r] * T[i,r] for i in I.keys() for r in R.keys())
+    # For each inventory product i∈I, ensure that i can not be issued more than once (or, for each class, not more than its number of products).
+    model.addConstrs(x.sum(i, '*') <= (1 if counts is None else counts[i]) for i in I)
 
     # Force z[r,k] to 1 if at least one of the products i∈I that are issued to request r∈R mismatches on antigen k∈A.
-    model.addConstrs(quicksum(x[i,r] * I[i].vector[k] * (1 - R[r].vector[k]) for i in I.keys()) <= z[r,k] * R[r].num_units for r in R.keys() for k in A_no_Fyb.values())
-    model.addConstrs(quicksum(x[i,r] * I[i].vector[A["Fyb"]] * (1 - R[r].vector[A["Fyb"]]) * R[r].vector[A["Fya"]] for i in I.keys()) <= z[r,A["Fyb"]] * R[r].num_units for r in R.keys())  
+    # A request can only be mismatched on Fyb if it is positive for Fya, which is already accounted for in M.
+    model.addConstrs(quicksum(x[i,r] for i, r in E.select('*', r) if M[i][r] & bits[k]) <= z[r,k] * num_units[r] for r, k in Z)
 
     ################
     ## OBJECTIVES ##
     ################
 
     # Assign a higher shortage penalty to requests with today as their issuing date.
-    model.setObjective(expr = quicksum(y[r] * ((len(R) * t[r]) + 1) for r in R.keys())) 
-    
+    model.setObjective(expr = quicksum(y[r] * shortage[r] for r in R)) 
+
     # Second objective: mismatches, fifo penalty, usability penalty, and minor antigen substitution.
-    if "patgroups" in SETTINGS.strategy:
-        model.setObjectiveN(expr = 5 * quicksum(z[r,k] * w[P[R[r].patgroup],k] for k in A.values() for r in R.keys())
-                                    + quicksum(0.5 ** ((PARAMS.max_age - I[i].age - 1) / 5) * x[i,r] for i in I.keys() for r in R.keys())
-                                    + quicksum((bi[i] - br[r]) * x[i,r] for i in I.keys() for r in R.keys())
-                                    + quicksum(x[i,r] * w[P[R[r].patgroup],k] * (1 - I[i].vector[k]) * R[r].vector[k]
-                                    for k in A_minor.values() for r in [r for r in R.keys() if R[r].patgroup in ["Wu45", "Other"]] for i in I.keys())
-                                    , index=1, priority=0, name="other")
-    else:
-        model.setObjectiveN(expr = 5 * quicksum(z[r,k] * w[k] for k in A.values() for r in R.keys())
-                                    + quicksum(0.5 ** ((PARAMS.max_age - I[i].age - 1) / 5) * x[i,r] for i in I.keys() for r in R.keys())
-                                    + quicksum((bi[i] - br[r]) * x[i,r] for i in I.keys() for r in R.keys())
-                                    + quicksum(x[i,r] * w[k] * (1 - I[i].vector[k]) * R[r].vector[k]
-                                    for k in A_minor.values() for r in [r for r in R.keys() if R[r].patgroup in ["Wu45", "Other"]] for i in I.keys())
-                                    , index=1, priority=0, name="other")
+    model.setObjectiveN(expr = 5 * quicksum(z[r,k] * cz[j] for j, (r, k) in enumerate(Z))
+                                + quicksum(x[i,r] * cx[e] for e, (i, r) in enumerate(E))
+                                , index=1, priority=0, name="other")
 
-    stop = time.perf_counter()
-    print(f"model initialization: {(stop - start):0.4f} seconds")
+    return x, y, z
 
-    start = time.perf_counter()
-    model.optimize()
-    stop = time.perf_counter()
-    print(f"Optimize: {(stop - start):0.4f} seconds")
 
-    sc = model.SolCount
-    print(f"Solutions found: {sc}")
+# Group the products in the given inventory into classes of products that are interchangeable in the MINRAR model: products of the same age
+# that have the same phenotype on all antigens that have an effect in the model (see relevant_antigens_key). For each product, the position
+# of the first product of its class (the class representative) is returned, and for each position the number of products that it represents
+# (0 for products that are not a representative).
+def product_classes(SETTINGS, PARAMS, inventory):
 
-    x = np.zeros([sc, len(I), len(R)])
-    y = np.zeros([sc, len(R)])
-    z = np.zeros([sc, len(R), len(A)])
+    keys = inventory.keys & relevant_antigens_key(SETTINGS, PARAMS)
+    _, first, inverse = np.unique(np.column_stack([keys, inventory.age]), axis=0, return_index=True, return_inverse=True)
+    classes = first[inverse.reshape(-1)]
+    return classes, np.bincount(classes, minlength=len(inventory))
 
-    # Get the variable values for all optimal solutions found.
-    for s in range(sc):
 
-        model.Params.SolutionNumber = s
-    
-        for var in model.getVars():
-            var_name = re.split(r'\W+', var.varName)[0]
-            if var_name == "x":
-                index0 = int(re.split(r'\W+', var.varName)[1])
-                index1 = int(re.split(r'\W+', var.varName)[2])
-                x[s, index0, index1] = var.Xn
-            if var_name == "y":
-                index0 = int(re.split(r'\W+', var.varName)[1])
-                y[s, index0] = var.Xn
-            if var_name == "z":
-                index0 = int(re.split(r'\W+', var.varName)[1])
-                index1 = int(re.split(r'\W+', var.varName)[2])
-                z[s, index0, index1] = var.Xn
+# Translate a solution of the aggregated formulation, where x[i,r] is the number of products of the class represented by i that is issued
+# to request r, back to one row per product. The products of each class are issued in the order of their positions, and in order of requests.
+def disaggregate(x, classes):
 
-    if sc > 1:
+    # Class and request of every single product issued, ordered by class.
+    c, r = np.nonzero(x > 0.5)
+    n = np.round(x[c, r]).astype(int)
+    c, r = np.repeat(c, n), np.repeat(r, n)
 
-        R_today = [r for r in R.keys() if R[r].day_issuing == day]
+    # The rank of each issued product within its class gives its position among the products of that class.
+    order = np.argsort(classes, kind="stable")
+    rank = np.arange(len(c)) - np.searchsorted(c, c)
+    products = order[np.searchsorted(classes[order], c) + rank]
 
-        # For each solution found, get the mismatch penalty for requests that need to be issued today, and select the lowest.
-        if "patgroups"in SETTINGS.strategy:
-            mismatch_today = {s : sum([z[s,r,k] * w[P[R[r].patgroup],k] for k in A.values() for r in R_today]) for s in range(sc)}
-        else:
-            mismatch_today = {s : sum([z[s,r,k] * w[k] for k in A.values() for r in R_today]) for s in range(sc)}
-        best = [s for s in mismatch_today.keys() if mismatch_today[s] == min(mismatch_today.values())]
-        print(best)
-        
-        if len(best) > 1:
-            # For each solution remaining, get the average age of products issued to today's requests, and select the oldest.
-            avg_age_today = {s : sum([sum([x[s,i,r] for r in R_today]) * I[i].age for i in I.keys()]) / sum(sum(x[s])) for s in best}
-            best = [s for s in avg_age_today.keys() if avg_age_today[s] == max(avg_age_today.values())]
-            print(best)
-
-            if len(best) > 1:
-                # For each solution remaining, get the usability penalty for today's requests, and select the lowest.
-                usab_today = {s : sum([(bi[i] - br[r]) * x[s,i,r] for i in I.keys() for r in R_today]) for s in best}
-                best = [s for s in usab_today.keys() if usab_today[s] == min(usab_today.values())]
-                print(best)
-
-                if len(best) > 1:
-                    # For each solution remaining, get the mismatch penalty for today's requests, and select the lowest.
-                    if "patgroups"in SETTINGS.strategy:
-                        substitution_today = {s : sum([x[s,i,r] * w[P[R[r].patgroup],k] * (1 - I[i].vector[k]) * R[r].vector[k] for k in A.values() for r in R_today for i in I.keys()]) for s in best}
-                    else:
-                        substitution_today = {s : sum([x[s,i,r] * w[k] * (1 - I[i].vector[k]) * R[r].vector[k] for k in A.values() for r in R_today for i in I.keys()]) for s in best}
-                    best = [s for s in substitution_today.keys() if substitution_today[s] == min(substitution_today.values())]
-                    print(best)
-
-        x = x[best[0]]
-        y = y[best[0]]
-        z = z[best[0]]
+    x = np.zeros(x.shape)
+    x[products, r] = 1
+    return x
 
-    else:
 
-        x = x[0]
-        y = y[0]
-        z = z[0]
+# Add the same variables, constraints and objectives as build_minrar_quicksum, but assembled from sparse coefficient matrices
+# (one column per variable), so that the model can be solved by any of the solvers of Solver_model. Only nonzero coefficients are visited,
+# so that the build time grows with the number of eligible pairs and mismatches instead of with the number of products × requests × antigens.
+def build_minrar_matrix(model, I, R, E, Z, M, bits, num_units, shortage, cz, cx):
 
-    df.loc[(day,hospital.name),"gurobi status"] = model.status
-    df.loc[(day,hospital.name),"nvars"] = len(model.getVars())
+    # Product and request of each eligible pair, and the index of each z-variable per request and antigen.
+    e_i = np.array([i for i, _ in E], dtype=int)
+    e_r = np.array([r for _, r in E], dtype=int)
+    z_index = np.full([len(R), len(bits)], -1)
+    for j, (r, k) in enumerate(Z):
+        z_index[r,k] = j
 
-    return df, x, y, z
\ No newline at end of file
+    ###############
+    ## VARIABLES ##
+    ###############
+
+    # x, y and z as in build_minrar_quicksum, with the same variable names.
+    x = model.add_vars(len(E), GRB.BINARY, names=[f"x[{i},{r}]" for i, r in E])
+    y = model.add_vars(len(R), GRB.BINARY, names=[f"y[{r}]" for r in R])
+    z = model.add_vars(len(Z), GRB.BINARY, names=[f"z[{r},{k}]" for r, k in Z])
+
+    #################
+    ## CONSTRAINTS ##
+    #################
+
+    # Incidence matrices of the eligible pairs with their requests and products.
+    ones = np.ones(len(E))
+    X_R = sp.csr_matrix((ones, (e_r, np.arange(len(E)))), shape=(len(R), len(E)))
+    X_I = sp.csr_matrix((ones, (e_i, np.arange(len(E)))), shape=(len(I), len(E)))
+
+    # Force y[r] to 1 if not all requested units are satisfied.
+    model.add_constrs([(sp.diags(np.array(num_units, dtype=float)), y), (X_R, x)], ">", np.array(num_units, dtype=float))
+
+    # For each inventory product i∈I, ensure that i can not be issued more than once.
+    model.add_constrs([(X_I, x)], "<", np.ones(len(I)))
+
+    # Force z[r,k] to 1 if at least one of the products i∈I that are issued to request r∈R mismatches on antigen k∈A,
+    # where X_Z[j,e] = 1 if the product of eligible pair e mismatches its request on the antigen of z-variable j.
+    M_E = np.array(M, dtype=np.uint32).reshape(len(I), len(R))[e_i, e_r]
+    e, k = np.nonzero((M_E[:,np.newaxis] & np.array(bits, dtype=np.uint32)[np.newaxis,:]) != 0)
+    X_Z = sp.csr_matrix((np.ones(len(e)), (z_index[e_r[e], k], e)), shape=(len(Z), len(E)))
+    model.add_constrs([(X_Z, x), (-sp.diags(np.array([num_units[r] for r, _ in Z], dtype=float)), z)], "<", np.zeros(len(Z)))
+
+    ################
+    ## OBJECTIVES ##
+    ################
+
+    # Assign a higher shortage penalty to requests with today as their issuing date.
+    model.set_objective([(y, np.array(shortage, dtype=float))])
+
+    # Second objective: mismatches, fifo penalty, usability penalty, and minor antigen substitution.
+    model.set_objective([(z, 5 * np.array(cz)), (x, np.array(cx))], index=1, priority=0, name="other")
+
+    # Return the variables as tupledicts with the same indices as those of build_minrar_quicksum.
+    return tupledict(zip(E, list(x))), tupledict(enumerate(list(y))), tupledict(zip(Z, list(z)))
+
+
+class Incremental_minrar():
+
+    # An instance of this class holds a single-hospital MINRAR model that is kept alive during the whole simulation. Every day, only the
+    # variables and constraints of products and requests that have left are removed, and those of newly arrived products and requests are
+    # added, after which the objective coefficients are updated to today's ages and issuing dates. Products and requests are identified
+    # by their index, as their positions in the hospital's stores change from day to day.
+    def __init__(self, model):
+
+        self.solver_model = model
+        self.model = model.model
+        self.model.ModelSense = GRB.MINIMIZE
+        self.model.NumObj = 2
+        self.model.Params.ObjNumber = 1
+        self.model.ObjNName = "other"
+
+        # Product and request index of each x-variable, request index and antigen of each z-variable, and the variables themselves.
+        self.x_keys = np.zeros([0, 2], dtype=int)
+        self.x_vars = np.zeros(0, dtype=object)
+        self.z_keys = np.zeros([0, 2], dtype=int)
+        self.z_vars = np.zeros(0, dtype=object)
+        self.y_vars = {}
+
+        # Constraints of each product, of each request, and of each z-variable (in the same order as z_keys).
+        self.c_product = {}
+        self.c_request = {}
+        self.c_mismatch = np.zeros(0, dtype=object)
+
+
+    # Update the model to the hospital's current inventory and requests, where eligible[i,r] is True if product i∈I may be issued to request r∈R,
+    # and shortage[r] is the shortage penalty of request r. The x, y and z variables are returned as tupledicts indexed by the positions of products
+    # and requests in the stores, as the other builders do.
+    def update(self, SETTINGS, PARAMS, hospital, day, eligible, w, shortage):
+
+        model = self.model
+        inventory, requests = hospital.inventory, hospital.requests
+        antigens = PARAMS.major + PARAMS.minor
+        bits = np.array([antigens_to_key(PARAMS, [ag]) for ag in antigens], dtype=np.uint32)
+
+        # Positions of all products and requests in today's stores.
+        I_pos = {pid : i for i, pid in enumerate(inventory.index.tolist())}
+        R_pos = {rid : r for r, rid in enumerate(requests.index.tolist())}
+
+        ############
+        ## REMOVE ##
+        ############
+
+        # Remove the variables and constraints of all products and requests that have been issued, outdated or are no longer requested.
+        keep_x = np.isin(self.x_keys[:,0], inventory.index) & np.isin(self.x_keys[:,1], requests.index)
+        keep_z = np.isin(self.z_keys[:,0], requests.index)
+        gone_products = [pid for pid in self.c_product.keys() if pid not in I_pos]
+        gone_requests = [rid for rid in self.c_request.keys() if rid not in R_pos]
+
+        model.remove(self.x_vars[~keep_x].tolist() + self.z_vars[~keep_z].tolist() + self.c_mismatch[~keep_z].tolist()
+                    + [self.y_vars.pop(rid) for rid in gone_requests] + [self.c_request.pop(rid) for rid in gone_requests] + [self.c_product.pop(pid) for pid in gone_products])
+
+        self.x_keys, self.x_vars = self.x_keys[keep_x], self.x_vars[keep_x]
+        self.z_keys, self.z_vars, self.c_mismatch = self.z_keys[keep_z], self.z_vars[keep_z], self.c_mismatch[keep_z]
+
+        #########
+        ## ADD ##
+        #########
+
+        new_i = np.array([pid not in self.c_product for pid in inventory.index.tolist()], dtype=bool)
+        new_r = np.array([rid not in self.c_request for rid in requests.index.tolist()], dtype=bool)
+        R_new = np.flatnonzero(new_r).tolist()
+
+        # y and z for all new requests, where z is only created for the antigens that the request is negative for.
+        y_new = {r : model.addVar(vtype=GRB.BINARY, lb=0, ub=1, name=f"y[{requests.index[r]}]") for r in R_new}
+        Z_new = [(r, k) for r in R_new for k in range(len(antigens)) if requests.vectors[r,k] == 0]
+        z_new = [model.addVar(vtype=GRB.BINARY, lb=0, ub=1, name=f"z[{requests.index[r]},{k}]") for r, k in Z_new]
+        z_lookup = {(int(rid), int(k)) : c for (rid, k), c in zip(self.z_keys.tolist(), self.c_mismatch.tolist())}
+
+        # All eligible pairs in which the product or the request is new. Eligibility of existing pairs does not change, as a product's
+        # age and the current day both increase by one every day. M[e] is the packed set of antigens on which pair e mismatches.
+        E_new = np.argwhere(eligible & (new_i[:,np.newaxis] | new_r[np.newaxis,:]))
+        M = mismatched_antigens(PARAMS, inventory.keys, requests.keys)[E_new[:,0], E_new[:,1]] if len(E_new) > 0 else np.zeros(0, dtype=np.uint32)
+
+        # x for all new pairs, directly entered in the constraints of products and requests that already existed.
+        x_new = []
+        for (i, r), m in zip(E_new.tolist(), M.tolist()):
+            column = Column()
+            if new_i[i] == False:
+                column.addTerms(1, self.c_product[inventory.index[i]])
+            if new_r[r] == False:
+                column.addTerms(1, self.c_request[requests.index[r]])
+                for k in np.flatnonzero(m & bits).tolist():
+                    column.addTerms(1, z_lookup[(int(requests.index[r]), k)])
+            x_new.append(model.addVar(vtype=GRB.BINARY, lb=0, ub=1, name=f"x[{inventory.index[i]},{requests.index[r]}]", column=column))
+
+        # For each new product, ensure that it can not be issued more than once.
+        for i in np.flatnonzero(new_i).tolist():
+            e = np.flatnonzero(E_new[:,0] == i).tolist()
+            self.c_product[inventory.index[i]] = model.addLConstr(LinExpr([1] * len(e), [x_new[j] for j in e]), GRB.LESS_EQUAL, 1)
+
+        # For each new request, force y[r] to 1 if not all requested units are satisfied, and force z[r,k] to 1 if at least one
+        # of the products issued to r mismatches on antigen k.
+        c_mismatch_new = []
+        for r in R_new:
+            e = np.flatnonzero(E_new[:,1] == r).tolist()
+            n = int(requests.num_units[r])
+            self.c_request[requests.index[r]] = model.addLConstr(LinExpr([n] + [1] * len(e), [y_new[r]] + [x_new[j] for j in e]), GRB.GREATER_EQUAL, n)
+            for j, (_, k) in enumerate(Z_new):
+                if Z_new[j][0] == r:
+                    e_k = [e_j for e_j in e if M[e_j] & bits[k]]
+                    c_mismatch_new.append(model.addLConstr(LinExpr([1] * len(e_k) + [-n], [x_new[e_j] for e_j in e_k] + [z_new[j]]), GRB.LESS_EQUAL, 0))
+
+        # Register the new variables and constraints.
+        for r in R_new:
+            self.y_vars[requests.index[r]] = y_new[r]
+        self.x_keys = np.concatenate([self.x_keys, np.column_stack([inventory.index[E_new[:,0]], requests.index[E_new[:,1]]]).reshape(-1, 2)])
+        self.x_vars = np.concatenate([self.x_vars, np.array(x_new + [None], dtype=object)[:-1]])
+        self.z_keys = np.concatenate([self.z_keys, np.array([(requests.index[r], k) for r, k in Z_new], dtype=int).reshape(-1, 2)])
+        self.z_vars = np.concatenate([self.z_vars, np.array(z_new + [None], dtype=object)[:-1]])
+        self.c_mismatch = np.concatenate([self.c_mismatch, np.array(c_mismatch_new + [None], dtype=object)[:-1]])
+
+        ################
+        ## OBJECTIVES ##
+        ################
+
+        model.update()
+
+        # Positions of the products and requests of all x- and z-variables in today's stores.
+        x_i = np.array([I_pos[pid] for pid in self.x_keys[:,0].tolist()], dtype=int)
+        x_r = np.array([R_pos[rid] for rid in self.x_keys[:,1].tolist()], dtype=int)
+        z_r = np.array([R_pos[rid] for rid in self.z_keys[:,0].tolist()], dtype=int)
+        z_k = self.z_keys[:,1]
+        y_vars = [self.y_vars[rid] for rid in requests.index.tolist()]
+
+        # Assign a higher shortage penalty to requests with today as their issuing date.
+        model.Params.ObjNumber = 0
+        model.setAttr("ObjN", y_vars, shortage.tolist())
+
+        # Second objective: mismatches, fifo penalty, usability penalty, and minor antigen substitution, the latter only for
+        # requests of the patient groups Wu45 and Other.
+        _, penalty = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
+        S = requests.keys[x_r] & ~inventory.keys[x_i] & antigens_to_key(PARAMS, PARAMS.minor)
+        subst = penalty[requests.patgroup[x_r], S]
+        subst = np.where(np.isin(requests.patgroup[x_r], [PARAMS.patgroups.index("Wu45"), PARAMS.patgroups.index("Other")]), subst, 0)
+        bi = inventory.get_usability(PARAMS, [hospital])
+        br = requests.get_usability(PARAMS, [hospital])
+        cx = 0.5 ** ((PARAMS.max_age - inventory.age[x_i] - 1) / 5) + (bi[x_i] - br[x_r]) + subst
+        cz = w[requests.patgroup[z_r], z_k] if "patgroups" in SETTINGS.strategy else w[z_k]
+
+        model.Params.ObjNumber = 1
+        model.setAttr("ObjN", self.z_vars.tolist() + self.x_vars.tolist(), (5 * cz).tolist() + cx.tolist())
+
+        return self.solver_model, tupledict(zip(zip(x_i.tolist(), x_r.tolist()), self.x_vars.tolist())), tupledict(enumerate(y_vars)), tupledict(zip(zip(z_r.tolist(), z_k.tolist()), self.z_vars.tolist()))
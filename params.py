@@ -1,4 +1,7 @@
 import pandas as pd
+import numpy as np
+
+from blood import Usability_cache
 
 class Params():
     
@@ -18,6 +21,9 @@ class Params():
         self.major = ["A", "B", "D"]
         self.minor = ["C", "c", "E", "e", "K", "k", "M", "N", "S", "s", "Fya", "Fyb", "Jka", "Jkb"] 
 
+        # Ethnicities of donors and patients, used for sampling phenotypes.
+        self.ethnicities = ["Caucasian", "African", "Asian"]
+
         ##################
         # PATIENT GROUPS #
         ##################
@@ -57,6 +63,9 @@ class Params():
                       [10,  10,  10,  0.0265, 0.0543, 0.1843, 0.0644, 0.2954, 0,  0,   0,   0.0034,   0.0013, 0.0227, 0.0067, 0.0429, 0.0017]] # Other
             )
 
+        # For each patient group, a binary mask over all antigens (major + minor) that are a 'must' to match, i.e. have weight 10.
+        self.patgroup_must_mask = np.array(self.patgroup_weights.loc[self.patgroups, self.major + self.minor] == 10, dtype=np.uint8)
+
 
         #####################
         # SUPPLY AND DEMAND #
@@ -193,6 +202,9 @@ class Params():
             "African" :     [0.   , 0.511, 0.081, 0.488],
             "Asian" :       [0.009, 0.232, 0.268, 0.491]}
 
+        # Cache of product usabilities per phenotype, shared by all days and episodes that are simulated with these parameters.
+        self.usability_cache = Usability_cache(SETTINGS.usability_cache_size)
+
         
         ##########
         # GUROBI #
@@ -0,0 +1,179 @@
+import numpy as np
+import copy
+
+from blood import *
+
+
+# For each product i and request r, the coefficient of x[i,r] in the second objective of the MINRAR models: the fifo penalty, the usability
+# penalty (with respect to the given hospitals) and the substitution penalty on the minor antigens for requests of the patient groups Wu45
+# and Other. The multi-hospital model does not charge the fifo and usability penalties for products of the distribution center (fifo = False).
+def assignment_costs(SETTINGS, PARAMS, products, requests, hospitals, fifo = True):
+
+    _, penalty = phenotype_lookup(PARAMS, SETTINGS.strategy, SETTINGS.patgroup_musts)
+    S = mismatched_antigens(PARAMS, requests.keys, products.keys, fyb_rule = False).T & antigens_to_key(PARAMS, PARAMS.minor)
+    cost = penalty[requests.patgroup[np.newaxis,:], S] * np.isin(requests.patgroup, [PARAMS.patgroups.index("Wu45"), PARAMS.patgroups.index("Other")])[np.newaxis,:]
+
+    if fifo:
+        cost = cost + (0.5 ** ((PARAMS.max_age - products.age - 1) / 5))[:,np.newaxis]
+        cost = cost + np.subtract.outer(products.get_usability(PARAMS, hospitals), requests.get_usability(PARAMS, hospitals))
+
+    return cost
+
+
+# For each product i and request r, a lower bound on the mismatch penalty (second objective) per unit of r that is satisfied by i: the weights
+# of the antigens on which i mismatches r, times 5 as in the MINRAR models, divided by the number of units of r. The mismatch variables of a
+# request count each antigen once, however many of its products mismatch on it, so together its products are charged at most its penalty.
+def mismatch_costs(SETTINGS, PARAMS, products, requests):
+
+    antigens = PARAMS.major + PARAMS.minor
+    if "patgroups" in SETTINGS.strategy:
+        w = np.array(PARAMS.patgroup_weights.loc[PARAMS.patgroups, antigens])[requests.patgroup]
+    elif "relimm" in SETTINGS.strategy:
+        w = np.broadcast_to(np.array(PARAMS.relimm_weights[antigens])[0], [len(requests), len(antigens)])
+    else:
+        w = np.zeros([len(requests), len(antigens)])
+
+    M = mismatched_antigens(PARAMS, products.keys, requests.keys)
+    cost = np.zeros(M.shape)
+    for k, ag in enumerate(antigens):
+        cost += ((M & antigens_to_key(PARAMS, [ag])) != 0) * w[np.newaxis,:,k]
+    return 5 * cost / requests.num_units[np.newaxis,:]
+
+
+# For each product i and request r, the cost of issuing i to r that the presolve compares products on: the coefficient of x[i,r] (see
+# assignment_costs) plus the lower bound on the mismatch penalty (see mismatch_costs), so that products of all inventories are compared on
+# the same basis, and a product that mismatches is not taken to be cheaper than a class that matches exactly.
+def presolve_costs(SETTINGS, PARAMS, products, requests, hospitals, fifo = True):
+    return assignment_costs(SETTINGS, PARAMS, products, requests, hospitals, fifo) + mismatch_costs(SETTINGS, PARAMS, products, requests)
+
+
+class Preassignment():
+
+    # An instance of this class holds the requests of one hospital whose assignment in an optimal solution of the MINRAR model can be fixed
+    # before solving it. Requests without any eligible product are short in every solution. Further, a class of interchangeable products
+    # (same age and same phenotype on all relevant antigens) is issued to all requests with exactly that phenotype that it is eligible for, if
+    #   1. the class contains enough products for these requests and for all other requests that the class is eligible for together,
+    #   2. no other eligible product is cheaper for these requests than a product of the class, and
+    #   3. satisfying such a request from the class costs less than the lowest shortage penalty (1).
+    # Swapping the products of such requests in any optimal solution for products of the class then never increases the objective, so an
+    # optimal solution exists in which they are satisfied by the class, and only the residual products and requests are left to the solver.
+    # eligible[i,r] and cost[i,r] give, for each product i and request r, whether i may be issued to r and the resulting cost (see presolve_costs).
+    # A class matches its requests exactly on all relevant antigens, so its own cost has no mismatch penalty. Products elsewhere (e.g. at the
+    # distribution center) are given by other_eligible and other_cost, priced as in the model (without fifo and usability penalties).
+    def __init__(self, SETTINGS, PARAMS, hospital, eligible, cost, other_eligible = None, other_cost = None):
+
+        products, requests = hospital.inventory, hospital.requests
+
+        self.pairs = []                                                 # Fixed assignments (i, r) of products to requests.
+        self.used = np.zeros(len(products), dtype=bool)                 # Products issued by the fixed assignments.
+        self.fixed = np.zeros(len(requests), dtype=bool)                # Requests satisfied by the fixed assignments.
+
+        # Requests without any eligible product, which are short in every solution.
+        self.short = eligible.any(axis=0) == False
+        if other_eligible is not None:
+            self.short &= other_eligible.any(axis=0) == False
+
+        # Classes of interchangeable products, visited from the youngest to the oldest, as younger products are cheaper.
+        relevant = relevant_antigens_key(SETTINGS, PARAMS)
+        keys_i, keys_r = products.keys & relevant, requests.keys & relevant
+        _, first, inverse = np.unique(np.column_stack([keys_i, products.age]), axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        for c in np.argsort(products.age[first], kind="stable").tolist():
+            members = np.flatnonzero(inverse == c)
+            rep = members[0]
+
+            # All remaining requests with exactly the class' phenotype that the class is eligible for, and all other requests competing for it.
+            R_c = np.flatnonzero((self.fixed == False) & (self.short == False) & (keys_r == keys_i[rep]) & eligible[rep])
+            if len(R_c) == 0:
+                continue
+            competing = (self.fixed == False) & eligible[rep]
+            competing[R_c] = False
+
+            units = requests.num_units[R_c]
+            if len(members) < units.sum() + requests.num_units[competing].sum():
+                continue
+            if (units * cost[rep,R_c] > 1).any():
+                continue
+
+            # No other remaining product that is eligible for these requests may be cheaper than the class' products.
+            others = eligible[:,R_c] & (self.used == False)[:,np.newaxis]
+            others[members] = False
+            if (cost[:,R_c] < cost[rep,R_c][np.newaxis,:])[others].any():
+                continue
+            if other_eligible is not None and (other_cost[:,R_c] < cost[rep,R_c][np.newaxis,:])[other_eligible[:,R_c]].any():
+                continue
+
+            # Issue the products of the class to the requests in the order of their issuing dates.
+            R_c = R_c[np.argsort(requests.day_issuing[R_c], kind="stable")]
+            issued = members[:units.sum()]
+            self.pairs += list(zip(issued.tolist(), np.repeat(R_c, requests.num_units[R_c]).tolist()))
+            self.used[issued] = True
+            self.fixed[R_c] = True
+
+        # Products and requests that remain for the solver.
+        self.kept_i = self.used == False
+        self.kept_r = (self.fixed | self.short) == False
+
+        # Packed set of antigens on which each fixed assignment mismatches, to set the mismatch variables of the fixed requests.
+        i, r = np.array(self.pairs, dtype=int).reshape(-1, 2).T
+        self.mismatches = mismatched_antigens(PARAMS, products.keys, requests.keys)[i, r] if len(self.pairs) > 0 else np.zeros(0, dtype=np.uint32)
+
+        self.issued_pairs = set(zip(products.index[i].tolist(), requests.index[r].tolist()))
+        print(f"Presolve: {int(self.fixed.sum())} requests fixed, {int(self.short.sum())} requests short, {int(self.used.sum())} products issued")
+
+
+    # Get the number of requests that were removed from the model.
+    def num_removed(self):
+        return int((self.kept_r == False).sum())
+
+
+    # Get a copy of the hospital with only the products and requests that remain for the solver. The other properties of the
+    # hospital are shared, and should be copied back after solving (see restore).
+    def residual(self, hospital):
+
+        residual = copy.copy(hospital)
+        residual.inventory = hospital.inventory.select(self.kept_i)
+        residual.requests = hospital.requests.select(self.kept_r)
+        return residual
+
+
+    # Copy the properties that were changed while solving the residual problem back to the hospital, adding the fixed assignments.
+    def restore(self, hospital, residual):
+
+        hospital.model = residual.model
+        hospital.assigned = residual.assigned | self.issued_pairs
+
+
+    # Expand the assignments x of the residual problem (products in the rows, requests in the columns) to all products and requests of the hospital,
+    # adding the fixed assignments. If other is True, x holds the products elsewhere, none of which was removed.
+    def expand_x(self, x, other = False):
+
+        rows = np.ones(len(x), dtype=bool) if other else self.kept_i
+        expanded = np.zeros([len(rows), len(self.kept_r)])
+        expanded[np.ix_(rows, self.kept_r)] = x
+        if other == False:
+            for i, r in self.pairs:
+                expanded[i,r] = 1
+        return expanded
+
+
+    # Expand the shortages y of the residual problem to all requests of the hospital, where the short requests are short.
+    def expand_y(self, y):
+
+        expanded = np.zeros(len(self.kept_r))
+        expanded[self.kept_r] = y
+        expanded[self.short] = 1
+        return expanded
+
+
+    # Expand the mismatches z of the residual problem (requests in the rows, antigens in the columns) to all requests of the hospital,
+    # where the fixed requests are mismatched on the antigens on which any of their fixed assignments mismatches.
+    def expand_z(self, PARAMS, z):
+
+        bits = np.array([antigens_to_key(PARAMS, [ag]) for ag in PARAMS.major + PARAMS.minor], dtype=np.uint32)
+        expanded = np.zeros([len(self.kept_r), len(bits)])
+        expanded[self.kept_r] = z
+        for (_, r), m in zip(self.pairs, self.mismatches.tolist()):
+            expanded[r] = np.maximum(expanded[r], (m & bits) != 0)
+        return expanded
@@ -1,95 +1,52 @@
 import numpy as np
-import re
 
-# Take a solved MINRAR model and get the value for each of the variables.
-def read_minrar_solution(SETTINGS, PARAMS, df, model, dc, hospitals, episode, day=0):
+# Take a solved MINRAR model and get the value for each of the variables, given the variables as returned by the model builder
+# (xh, xdc, y and z with one tupledict per hospital in the multi-hospital scenario, x, y, z, a and b in the single-hospital scenario).
+def read_minrar_solution(SETTINGS, PARAMS, df, model, variables, dc, hospitals, episode, day=0):
 
     # Variables for the multi-hospital scenario.
     if sum(SETTINGS.n_hospitals.values()) > 1:
 
-        # Create numpy arrays filled with zeros.
-        xh = [np.zeros([len(hospital.inventory), len(hospital.requests)]) for hospital in hospitals]
-        xdc = [np.zeros([len(dc.inventory), len(hospital.requests)]) for hospital in hospitals]
-        y = [np.zeros([len(hospital.requests)]) for hospital in hospitals]
-        z = [np.zeros([len(hospital.requests), len(PARAMS.major + PARAMS.minor)]) for hospital in hospitals]
-
-        # Get the values for all model variables and write them into the numpy arrays created above.
-        for h in range(len(hospitals)):
-            for var in model.getVars():
-                var_name = re.split(r'\W+', var.varName)[0]
-                if var_name == f"xh{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    xh[h][index0, index1] = var.X
-                if var_name == f"xdc{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    xdc[h][index0, index1] = var.X
-                if var_name == f"y{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    y[h][index0] = var.X
-                if var_name == f"z{h}":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    z[h][index0, index1] = var.X
+        # Write the values of all model variables into numpy arrays.
+        xh_vars, xdc_vars, y_vars, z_vars = variables
+        xh = [variable_values(model, xh_vars[h], [len(hospitals[h].inventory), len(hospitals[h].requests)]) for h in range(len(hospitals))]
+        xdc = [variable_values(model, xdc_vars[h], [len(dc.inventory), len(hospitals[h].requests)]) for h in range(len(hospitals))]
+        y = [variable_values(model, y_vars[h], [len(hospitals[h].requests)]) for h in range(len(hospitals))]
+        z = [variable_values(model, z_vars[h], [len(hospitals[h].requests), len(PARAMS.major + PARAMS.minor)]) for h in range(len(hospitals))]
 
         # Calculate the number of variables and add this information to the output dataframe.
-        nvars = sum([sum([np.product(var.shape) for var in [xh[h], xdc[h], y[h], z[h]]]) for h in range(len(hospitals))])
+        nvars = sum([sum([np.prod(var.shape) for var in [xh[h], xdc[h], y[h], z[h]]]) for h in range(len(hospitals))])
         print("nvars:",nvars)
-        df.loc[(day,hospitals[h].name),"nvars"] = nvars
+        for hospital in hospitals:
+            df.set(day, hospital.name, "nvars", nvars)
 
         return df, xh, xdc, y, z
 
     # Variables for the single-hospital scenario.
     else:
 
-        # Create numpy arrays filled with zeros.
-        x = np.zeros([len(hospitals[0].inventory), len(hospitals[0].requests)])
-        y = np.zeros([len(hospitals[0].requests)])
-        z = np.zeros([len(hospitals[0].requests), len(PARAMS.major + PARAMS.minor)])
-
-        # Get the values for all model variables and write them into the numpy arrays created above.
-        for var in model.getVars():
-            var_name = re.split(r'\W+', var.varName)[0]
-            if var_name == "x":
-                index0 = int(re.split(r'\W+', var.varName)[1])
-                index1 = int(re.split(r'\W+', var.varName)[2])
-                x[index0, index1] = var.X
-            if var_name == "y":
-                index0 = int(re.split(r'\W+', var.varName)[1])
-                y[index0] = var.X
-            if var_name == "z":
-                index0 = int(re.split(r'\W+', var.varName)[1])
-                index1 = int(re.split(r'\W+', var.varName)[2])
-                z[index0, index1] = var.X
+        # Write the values of all model variables into numpy arrays.
+        x = variable_values(model, variables[0], [len(hospitals[0].inventory), len(hospitals[0].requests)])
+        y = variable_values(model, variables[1], [len(hospitals[0].requests)])
+        z = variable_values(model, variables[2], [len(hospitals[0].requests), len(PARAMS.major + PARAMS.minor)])
 
         # Do the same for two other variables in case the offline optimization was performed.
         if SETTINGS.line == "off":
-            a = np.zeros([len(hospitals[0].inventory), SETTINGS.init_days + SETTINGS.test_days])
-            b = np.zeros([len(hospitals[0].inventory), SETTINGS.init_days + SETTINGS.test_days])
-            for var in model.getVars():
-                var_name = re.split(r'\W+', var.varName)[0]
-                if var_name == "a":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    a[index0, index1] = var.X
-                if var_name == "b":
-                    index0 = int(re.split(r'\W+', var.varName)[1])
-                    index1 = int(re.split(r'\W+', var.varName)[2])
-                    b[index0, index1] = var.X
+            a = variable_values(model, variables[3], [len(hospitals[0].inventory), SETTINGS.init_days + SETTINGS.test_days])
+            b = variable_values(model, variables[4], [len(hospitals[0].inventory), SETTINGS.init_days + SETTINGS.test_days])
 
             # Calculate the number of variables and add this information to the output dataframe.
-            nvars = sum([np.product(var.shape) for var in [x, y, z, a, b]])
+            nvars = sum([np.prod(var.shape) for var in [x, y, z, a, b]])
             print("nvars:",nvars)
-            df.loc[(day,hospitals[0].name),"nvars"] = nvars
+            df.set(day, hospitals[0].name, "nvars", nvars)
 
             return df, x, y, z, a, b
 
         else:
             # Calculate the number of variables and add this information to the output dataframe.
-            nvars = max(df.loc[(day,hospitals[0].name),"nvars"], sum([np.product(var.shape) for var in [x, y, z]]))
+            nvars = max(df.get(day, hospitals[0].name, "nvars"), sum([np.prod(var.shape) for var in [x, y, z]]))
             print("nvars:",nvars)
-            df.loc[(day,hospitals[0].name),"nvars"] = nvars
+            df.set(day, hospitals[0].name, "nvars", nvars)
 
             return df, x, y, z
 
@@ -103,16 +60,92 @@ def read_minrar_solution(SETTINGS, PARAMS, df, model, dc, hospitals, episode, da
 
 
 # Take a solved MINRAR model and abstract the optimal variable values.
-def read_transports_solution(model, size_I, size_H):
+def read_transports_solution(model, x, size_I, size_H):
 
     # Get the values of the model variable as found for the optimal solution.
-    x = np.zeros([size_I, size_H])
-    for var in model.getVars():
-        var_name = re.split(r'\W+', var.varName)[0]
-        if var_name == "x":
-            index0 = int(re.split(r'\W+', var.varName)[1])
-            index1 = int(re.split(r'\W+', var.varName)[2])
-            x[index0, index1] = var.X
+    return variable_values(model, x, [size_I, size_H])
 
-    return x
 
+# Write the values of the given variables (a tupledict of variable handles, indexed by one or more integers) in the solution with the
+# given number into a numpy array of the given shape, with zeros for all indices without a variable. All values are queried at once.
+def variable_values(model, variables, shape, solution = 0):
+
+    values = np.zeros(shape)
+    if len(variables) > 0:
+        index = np.array(list(variables.keys())).reshape(len(variables), -1)
+        values[tuple(index.T)] = model.values(list(variables.values()), solution)
+
+    return values
+
+
+# Get the assignments in the given solution of x, with products and requests in the rows and columns, as a set of pairs of the product's
+# index and the request's index, so that they can be recognized in the next day's model, where positions in the stores have changed.
+def assigned_pairs(x, products, requests):
+
+    i, r = np.nonzero(x > 0.5)
+    return set(zip(products.index[i].tolist(), requests.index[r].tolist()))
+
+
+# Set the MIP start of the given x-variables (a tupledict indexed by the positions of products and requests) to the given assignments,
+# as obtained from assigned_pairs: x[i,r] starts at 1 if product i was assigned to request r, and at 0 otherwise. If the products are
+# grouped into classes (given by each product's class representative), x[i,r] starts at the number of products of i's class assigned to r.
+# All other variables are left undefined, so that the solver completes the start with the shortages and mismatches that follow from these assignments.
+def set_assignment_start(model, x_vars, products, requests, assigned, classes = None):
+
+    if len(x_vars) > 0:
+        products_pos = {pid : i for i, pid in enumerate(products.index.tolist())}
+        requests_pos = {rid : r for r, rid in enumerate(requests.index.tolist())}
+
+        start = {}
+        for pid, rid in assigned:
+            if pid in products_pos and rid in requests_pos:
+                i = products_pos[pid] if classes is None else classes[products_pos[pid]]
+                start[(i, requests_pos[rid])] = start.get((i, requests_pos[rid]), 0) + 1
+
+        model.set_start(list(x_vars.values()), [start.get(key, 0) for key in x_vars.keys()])
+
+
+# Add the criteria by which the pool-based selection chooses between optimal solutions as objectives with decreasing priorities below the
+# model's own (blended) objectives 0 and 1: the mismatch penalty of today's requests, the age of the products issued to them (maximized),
+# and their usability and substitution penalties. A single solve then returns the preferred solution. The average issuing age of the pool-based
+# selection is replaced by the total age of the products issued to today's requests, as an average is not linear in the assignments.
+# Each criterion is given as a list of pairs of variable handles and their coefficients (see Solver_model.set_objective).
+def set_tie_break_objectives(model, mismatch, age, usability, substitution):
+
+    for n in [0, 1]:
+        model.set_priority(n, 5)
+
+    age = [(x, -np.asarray(c, dtype=float)) for x, c in age]
+    for n, (terms, name) in enumerate(zip([mismatch, age, usability, substitution], ["mismatch today", "age today", "usability today", "substitution today"])):
+        model.set_objective(terms, index = n + 2, priority = 4 - n, reltol = 0, name = name)
+
+
+# Score all sc solutions found at once on the criteria used to select between them, for the products of one inventory (x with shape [sc,I,R])
+# and the requests of one hospital, of which only those with today as their issuing date count (today[r] = True). Returned are the total age
+# of the products issued today, the number of products issued to all requests, and the usability and substitution penalties of today's issues.
+def score_assignments(x, today, age, usability, substitution):
+
+    x_today = x[:,:,today].reshape(len(x), -1)
+    pairs = np.column_stack([np.repeat(age, today.sum()), usability[:,today].reshape(-1), substitution[:,today].reshape(-1)])
+    age, usability, substitution = (x_today @ pairs).T
+    return np.array([age, x.sum(axis=(1,2)), usability, substitution])
+
+
+# Score all sc solutions found at once on the mismatch penalty of today's requests (z with shape [sc,R,A], weights with shape [R,A]).
+def score_mismatches(z, today, weights):
+    return z[:,today].reshape(len(z), -1) @ np.asarray(weights)[today].reshape(-1)
+
+
+# Select the preferred solution from the scores of all solutions found: the lowest mismatch penalty for today's requests, then the
+# highest average age of the products issued to them, then the lowest usability penalty, and finally the lowest substitution penalty.
+# Each next criterion is only used to select between solutions that are tied on all previous ones.
+def select_solution(mismatch, age, issued, usability, substitution):
+
+    avg_age = np.divide(age, issued, out=np.zeros(len(age)), where=issued > 0)
+
+    best = np.flatnonzero(mismatch == mismatch.min())
+    for score in [-avg_age, usability, substitution]:
+        if len(best) > 1:
+            best = best[score[best] == score[best].min()]
+
+    return best[0]
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+
+class Results_recorder():
+
+    # An instance of this class holds the output measures of one simulation episode, with one row for each combination of day and location.
+    # Numeric measures are stored in a preallocated numpy matrix, where each column's offset within a row is looked up once, so that a day's
+    # results can be written directly into its row. Text columns are kept apart, and the dataframe is only created when writing the results.
+    def __init__(self, header, index, text_columns = []):
+
+        self.header = header                                                                # All column names, in the order of the output file.
+        self.index = index                                                                  # (day, location) for each row.
+        self.rows = {idx : n for n, idx in enumerate(index)}                                # Row number for each (day, location).
+
+        self.text_columns = [col for col in header if col in text_columns]
+        self.numeric_columns = [col for col in header if col not in text_columns]
+        self.columns = {col : c for c, col in enumerate(self.numeric_columns)}              # Offset within a row for each numeric column.
+        self.text_offsets = {col : c for c, col in enumerate(self.text_columns)}            # Offset within a row for each text column.
+
+        self.values = np.zeros([len(index), len(self.numeric_columns)])
+        self.text = np.zeros([len(index), len(self.text_columns)], dtype=object)
+
+        # Column offsets of the results logged every day, computed once by the function logging them.
+        self.offsets = {}
+
+
+    # Get the numpy row holding all numeric results of the given day and location. Writing into it changes the recorded results.
+    def row(self, day, location):
+        return self.values[self.rows[(day, location)]]
+
+
+    # Set the value of a single column for the given day and location.
+    def set(self, day, location, column, value):
+        if column in self.text_offsets:
+            self.text[self.rows[(day, location)], self.text_offsets[column]] = value
+        else:
+            self.values[self.rows[(day, location)], self.columns[column]] = value
+
+
+    # Get the value of a single column for the given day and location.
+    def get(self, day, location, column):
+        if column in self.text_offsets:
+            return self.text[self.rows[(day, location)], self.text_offsets[column]]
+        else:
+            return self.values[self.rows[(day, location)], self.columns[column]]
+
+
+    # Set the value of a single column for all days of the given location, or for all rows if no location is given.
+    def set_column(self, column, value, location = None):
+        rows = [n for n, (_, loc) in enumerate(self.index) if location == None or loc == location]
+        if column in self.text_offsets:
+            self.text[rows, self.text_offsets[column]] = value
+        else:
+            self.values[rows, self.columns[column]] = value
+
+
+    # Create the dataframe with all recorded results, indexed by day and location, or only with the results of the given day. Numeric columns that
+    # only contain whole numbers are written as integers, except for the given float columns, and the 'logged' column is written as booleans.
+    def to_dataframe(self, day = None, float_columns = ["avg issuing age"]):
+
+        rows = [n for n, (d, _) in enumerate(self.index) if day == None or d == day]
+        values = self.values[rows]
+        integral = (values == np.round(values)).all(axis=0)
+
+        data = {}
+        for col in self.header:
+            if col in self.text_offsets:
+                data[col] = self.text[rows,self.text_offsets[col]]
+            elif col == "logged":
+                data[col] = values[:,self.columns[col]].astype(bool)
+            elif integral[self.columns[col]] and col not in float_columns:
+                data[col] = values[:,self.columns[col]].astype(np.int64)
+            else:
+                data[col] = values[:,self.columns[col]]
+
+        return pd.DataFrame(data, index = pd.MultiIndex.from_tuples([self.index[n] for n in rows], names = ["day", "location"]))
+
+
+    # Fill the recorder with the results in the given dataframe, as created by to_dataframe and indexed by day and location.
+    # Rows that are not in the dataframe are left unchanged.
+    def fill(self, df):
+
+        rows = [self.rows[idx] for idx in df.index]
+        self.values[rows] = df[self.numeric_columns].astype(float).fillna(0).to_numpy()
+        self.text[rows] = df[self.text_columns].fillna(0).to_numpy(dtype=object)
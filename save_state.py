@@ -1,46 +1,59 @@
 import pandas as pd
+import numpy as np
 import os
-import pickle
 
+from scenario import *
+
+# Get the path (without extension) of the files holding the work in progress of the given episode.
+def state_path(SETTINGS, e):
+	return SETTINGS.home_dir + f"wip/{SETTINGS.model_name}/{e}/{SETTINGS.strategy}_{'-'.join([str(SETTINGS.n_hospitals[ds]) + ds[:3] for ds in SETTINGS.n_hospitals.keys()])}"
+
+
+# At the end of a simulated day, append the day's results to the episode's results file, and every SETTINGS.checkpoint_interval days
+# save a checkpoint with the state that changes during the simulation: the inventories and requests of all hospitals, and the distribution
+# center's inventory and position in the supply scenario. All other state is read from the scenario files again when resuming.
 def save_state(SETTINGS, df, e, day, dc, hospitals):
 
-	path = SETTINGS.home_dir + "wip"
-	SETTINGS.check_dir_existence(path)
-	path += f"/{SETTINGS.model_name}"
-	SETTINGS.check_dir_existence(path)
-	path += f"/{e}"
-	SETTINGS.check_dir_existence(path)
-	path += f"/{SETTINGS.strategy}_{'-'.join([str(SETTINGS.n_hospitals[ds]) + ds[:3] for ds in SETTINGS.n_hospitals.keys()])}"	
+	path = state_path(SETTINGS, e)
+	SETTINGS.check_dir_existence(os.path.dirname(path))
 
+	results = df.to_dataframe(day)
+	results.to_csv(path + "_results.csv", sep=',', index=True, mode="a", header=not os.path.exists(path + "_results.csv"))
 
-	df.to_csv(path + "_df.csv", sep=',', index=True)
-	dc.pickle(path + "_dc.pickle")
-	for h in range(len(hospitals)):
-		hospitals[h].pickle(path + f"_h{h}.pickle")
+	if (day + 1) % SETTINGS.checkpoint_interval == 0:
+		arrays = {"day" : day, "supply_index" : dc.supply_index}
+		if hasattr(dc, "inventory"):
+			arrays.update(dc.inventory.to_arrays("dc_inventory_"))
+		for h in range(len(hospitals)):
+			arrays.update(hospitals[h].inventory.to_arrays(f"h{h}_inventory_"))
+			arrays.update(hospitals[h].requests.to_arrays(f"h{h}_requests_"))
 
+		write_atomically(path + "_checkpoint.npz", lambda f: np.savez(f, **arrays))
 
+
+# Resume an episode from its latest checkpoint, if any, given the distribution center and hospitals as initialized from the scenario files.
+# The results of all days up to the checkpoint are read from the episode's results file, where rows of days that were simulated again after
+# the checkpoint are replaced by their latest version. Returns the results, the first day to simulate, the distribution center and hospitals.
 def load_state(SETTINGS, e, df, dc, hospitals):
 
-	path = SETTINGS.home_dir + f"wip/{SETTINGS.model_name}/{e}/{SETTINGS.strategy}_{'-'.join([str(SETTINGS.n_hospitals[ds]) + ds[:3] for ds in SETTINGS.n_hospitals.keys()])}"	
+	path = state_path(SETTINGS, e)
 
-	if os.path.exists(path + "_df.csv") == True:
+	if os.path.exists(path + "_checkpoint.npz") == True:
 
-		df = pd.read_csv(path + "_df.csv")
-		day = max(df[df["logged"]==True]["day"]) + 1
-		df = df.set_index(["day", "location"])
-		
-		dc = unpickle(path + "_dc.pickle")
+		with np.load(path + "_checkpoint.npz") as arrays:
+			day = int(arrays["day"]) + 1
+			dc.supply_index = int(arrays["supply_index"])
+			if hasattr(dc, "inventory"):
+				dc.inventory.set_arrays(arrays, "dc_inventory_")
+			for h in range(len(hospitals)):
+				hospitals[h].inventory.set_arrays(arrays, f"h{h}_inventory_")
+				hospitals[h].requests.set_arrays(arrays, f"h{h}_requests_")
 
-		hospitals = []
-		for h in range(sum(SETTINGS.n_hospitals.values())):
-			hospitals.append(unpickle(path + f"_h{h}.pickle"))
+		results = pd.read_csv(path + "_results.csv")
+		results = results[results["day"] < day].drop_duplicates(["day", "location"], keep="last")
+		df.fill(results.set_index(["day", "location"]))
 
 	else:
 		day = 0
 
-	return df, day, dc, hospitals
-
-
-def unpickle(path):
-	with open(path, 'rb') as f:
-		return pickle.load(f)
\ No newline at end of file
+	return df, day, dc, hospitals
\ No newline at end of file
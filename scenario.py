@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from blood import *
+from blood_store import *
+
+
+# Record layouts of the binary scenario format. All antigens of a request or product are bit-packed into one phenotype key
+# (see vectors_to_keys), and patient group and ethnicity are stored as indices in PARAMS.patgroups and PARAMS.ethnicities.
+demand_dtype = np.dtype([("day_issuing", np.int32), ("day_available", np.int32), ("num_units", np.int8), ("patgroup", np.int8), ("ethnicity", np.int8), ("keys", np.uint32)])
+supply_dtype = np.dtype([("keys", np.uint32), ("ethnicity", np.int8), ("index", np.int64)])
+
+
+# Transform a demand scenario, as written to csv by generate_demand, to the binary record layout.
+def demand_to_records(PARAMS, df):
+
+    records = np.zeros(len(df), dtype=demand_dtype)
+    records["day_issuing"] = df["Day Needed"]
+    records["day_available"] = df["Day Available"]
+    records["num_units"] = df["Num Units"]
+    records["patgroup"] = pd.Categorical(df["Patient Type"], categories=PARAMS.patgroups).codes
+    records["ethnicity"] = pd.Categorical(df["Ethnicity"], categories=PARAMS.ethnicities).codes
+    records["keys"] = vectors_to_keys(np.array(df[PARAMS.major + PARAMS.minor]))
+    return records
+
+
+# Transform a supply scenario, as written to csv by generate_supply, to the binary record layout.
+def supply_to_records(PARAMS, df):
+
+    records = np.zeros(len(df), dtype=supply_dtype)
+    records["keys"] = vectors_to_keys(np.array(df[PARAMS.major + PARAMS.minor]))
+    records["ethnicity"] = pd.Categorical(df["Ethnicity"], categories=PARAMS.ethnicities).codes
+    records["index"] = df["Index"]
+    return records
+
+
+# Write a generated demand or supply scenario to the given path (without extension), either as csv or in the binary format (.npy).
+def write_scenario(SETTINGS, PARAMS, df, path, kind):
+
+    if SETTINGS.scenario_format == "npy":
+        records = demand_to_records(PARAMS, df) if kind == "demand" else supply_to_records(PARAMS, df)
+        write_atomically(path + ".npy", lambda f: np.save(f, records))
+    else:
+        write_atomically(path + ".csv", lambda f: df.to_csv(f, index=False))
+
+
+# Write a file by first writing to a temporary file in the same folder and then renaming it, so that a scenario file
+# either exists completely or not at all, even if the process writing it is interrupted.
+def write_atomically(path, write):
+
+    temp_path = path + f".{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+# Check whether a scenario exists at the given path (without extension), in any of the supported formats.
+def scenario_exists(path):
+    return os.path.exists(path + ".npy") or os.path.exists(path + ".csv")
+
+
+# Read the records of a demand or supply scenario from the given path (without extension). The binary format is used if available,
+# and is memory-mapped while loading, as load_demand and load_supply copy its columns into the store. Otherwise the csv file is parsed.
+def read_records(PARAMS, path, kind):
+
+    if os.path.exists(path + ".npy"):
+        return np.load(path + ".npy", mmap_mode="r")
+    elif kind == "demand":
+        return demand_to_records(PARAMS, pd.read_csv(path + ".csv"))
+    else:
+        return supply_to_records(PARAMS, pd.read_csv(path + ".csv"))
+
+
+# Load a demand scenario into a store of requests, in the order of the scenario file.
+def load_demand(PARAMS, path):
+
+    records = read_records(PARAMS, path, "demand")
+    return Blood_store(PARAMS, vectors = keys_to_vectors(records["keys"], len(PARAMS.major + PARAMS.minor)), ethnicity = records["ethnicity"],
+                        patgroup = records["patgroup"], num_units = records["num_units"], day_issuing = records["day_issuing"], day_available = records["day_available"])
+
+
+# Load a supply scenario into a store of inventory products, in the order in which they will be supplied.
+def load_supply(PARAMS, path):
+
+    records = read_records(PARAMS, path, "supply")
+    return Blood_store(PARAMS, vectors = keys_to_vectors(records["keys"], len(PARAMS.major + PARAMS.minor)), index = records["index"], ethnicity = records["ethnicity"])
+
+
+# Convert all csv scenarios in the demand and supply folders to the binary format, skipping scenarios that were already converted.
+def convert_scenarios(SETTINGS, PARAMS):
+
+    for kind in ["demand", "supply"]:
+        for root, _, files in os.walk(SETTINGS.home_dir + kind):
+            for file in sorted(files):
+                path = os.path.join(root, file[:-4])
+                if file.endswith(".csv") and not os.path.exists(path + ".npy"):
+                    print(f"Converting {kind} scenario '{path}'.")
+                    records = read_records(PARAMS, path, kind)
+                    write_atomically(path + ".npy", lambda f: np.save(f, records))
+
+
+# Generate the scenario files with the given indices, written to the given path followed by the index, where each scenario is sampled by
+# calling sample(SETTINGS, PARAMS, *args, rng). Scenario files that already exist are not overwritten. If SETTINGS.generation_workers > 1,
+# scenarios are generated in parallel processes, which gives the same files as generating them one by one.
+def generate_scenarios(SETTINGS, PARAMS, sample, args, path, kind, indices):
+
+    seed = SETTINGS.seed if SETTINGS.seed is not None else np.random.SeedSequence().entropy
+    print(f"Generating {kind} with seed {seed}.")
+
+    indices = [i for i in indices if not scenario_exists(f"{path}_{i}")]
+    if SETTINGS.generation_workers > 1:
+        with ProcessPoolExecutor(max_workers = SETTINGS.generation_workers) as pool:
+            futures = [pool.submit(generate_scenario, SETTINGS, PARAMS, sample, args, path, kind, seed, i) for i in indices]
+            for future in futures:
+                future.result()
+    else:
+        for i in indices:
+            generate_scenario(SETTINGS, PARAMS, sample, args, path, kind, seed, i)
+
+
+# Generate and write a single scenario file, using a random number generator that is derived from the base seed, the scenario's path
+# relative to the home directory and its index only, so that the scenario does not depend on the order in which scenarios are generated.
+def generate_scenario(SETTINGS, PARAMS, sample, args, path, kind, seed, index):
+
+    print(f"Generating {kind} '{os.path.basename(path)}_{index}'.")
+    rng = np.random.default_rng([seed, zlib.crc32(os.path.relpath(path, SETTINGS.home_dir).replace(os.sep, "/").encode()), index])
+    write_scenario(SETTINGS, PARAMS, sample(SETTINGS, PARAMS, *args, rng), f"{path}_{index}", kind)
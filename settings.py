@@ -1,6 +1,8 @@
 import pandas as pd
 import os
 
+from results_recorder import *
+
 class Settings():
 
     def __init__(self):
@@ -10,6 +12,7 @@ class Settings():
         # "demand": generate demand data
         # "supply": generate supply data
         # "optimize": run simulations and optimize matching
+        # "convert": convert all csv demand and supply scenarios to the binary scenario format
         self.mode = "optimize"
 
         # Output files will be stored in directory results/[model_name].
@@ -21,8 +24,15 @@ class Settings():
 
         # "LP": Use linear programming.
         # "RL": Use reinforcement learning.
+        # "heuristic": Use a fast matching policy instead of solving the MINRAR model (online only, see heuristic_policy).
         self.method = "LP"
 
+        # Matching policy used if method is "heuristic" (see heuristics.py).
+        # "fifo": serve requests in order of issuing date, each by the oldest compatible products.
+        # "greedy": serve requests in order of issuing date and usability, each by the products with the lowest mismatch, fifo and usability penalties.
+        # "flow": match all requested units at once by a minimum cost assignment, with the penalties of the MINRAR model as costs.
+        self.heuristic_policy = "greedy"
+
         # "on": online optimization.
         # "off": offline optimization.
         self.line = "on"
@@ -39,6 +49,13 @@ class Settings():
         # The total number of simulations executed will thus be y - x.
         self.episodes = (0,10)
 
+        # Number of episodes simulated concurrently, each in its own process. The machine's cores are divided over
+        # the concurrent episodes, which also limits the number of threads used by the solver (see gurobi_threads).
+        self.episode_workers = 1
+
+        # Number of days between checkpoints from which an interrupted episode can be resumed. The results of each day are always saved.
+        self.checkpoint_interval = 1
+
         # Number of hospitals considered. If more than 1 (regional and university combined), a distribution center is included.
         # "regional": Use the patient group distribution of the OLVG, a regional hospital, with average daily demand of 50 products.
         # "university": Use the patient group distribution of the AMC, a university hospital, with average daily demand of 100 products.
@@ -65,11 +82,26 @@ class Settings():
         self.strategy = "patgroups"
         self.patgroup_musts = True 
 
+        # Maximum number of phenotypes (per set of antigens and hospital demand mix) for which product usabilities are cached.
+        self.usability_cache_size = 100000
+
         ##############################
         # GENERATING DEMAND / SUPPLY #
         ##############################
 
         self.donor_eth_distr = [1, 0, 0]  # [Caucasian, African, Asian]
+
+        # "csv": write generated scenarios as csv files.
+        # "npy": write generated scenarios in a compact binary format, with bit-packed antigens (see scenario.py).
+        # Scenarios are always read from the binary format if available, and from csv otherwise.
+        self.scenario_format = "csv"
+
+        # Base seed from which the random number generator of each scenario file is derived, so that every scenario can be regenerated
+        # exactly, regardless of the number of workers. If None, a random base seed is drawn and printed when generating.
+        self.seed = None
+
+        # Number of processes generating scenario files in parallel.
+        self.generation_workers = 1
         
         if sum(self.n_hospitals.values()) > 1:
             self.supply_size = (self.init_days + self.test_days) * self.inv_size_factor_dc * sum([self.n_hospitals[htype] * self.avg_daily_demand[htype] for htype in self.n_hospitals.keys()])
@@ -96,18 +128,58 @@ class Settings():
         # GUROBI OPTIMIZER #
         ####################
 
-        self.show_gurobi_output = False     # True or False
-        self.gurobi_threads = None          # Number of threads available, or None in case of no limit
-        self.gurobi_timeout = None          # Number of minutes allowed for optimization, None in case of no limit
+        # "gurobi": solve all models with Gurobi.
+        # "highs": solve the online MINRAR models and the distribution center's allocation model with the open-source solver HiGHS (requires the highspy
+        #          package and model_builder "matrix"). HiGHS does not keep a pool of optimal solutions, so it requires tie_break "hierarchical" to select
+        #          between optimal solutions. The offline model is always solved with Gurobi.
+        self.solver = "gurobi"
+
+        # Despite their names, the three settings below apply to the solver given by 'solver', so to HiGHS as well as to Gurobi.
+        self.show_gurobi_output = False     # True or False, to show the solver's log
+        self.gurobi_threads = None          # Number of threads available to the solver, or None in case of no limit
+        self.gurobi_timeout = None          # Number of seconds allowed for each optimization by the solver, None in case of no limit
+
+        # "quicksum": build the single-hospital MINRAR model term by term with quicksum expressions.
+        # "matrix": build the single- and multi-hospital MINRAR models from sparse coefficient matrices, for any of the solvers.
+        # "incremental": keep one single-hospital MINRAR model per hospital alive, and only add and remove the variables and constraints
+        #                of arriving and leaving products and requests each day (the multi-hospital model is built with quicksum).
+        # "aggregated": build the single-hospital MINRAR model with quicksum, over classes of products with the same phenotype and age,
+        #               with integer variables counting the products of each class issued to each request (the multi-hospital model is built with quicksum).
+        # All builders except "matrix" build Gurobi models directly, and can only be used with solver "gurobi".
+        self.model_builder = "quicksum"
+
+        # True: start each day's online MINRAR solve from yesterday's assignments of products to requests that still exist (MIP start).
+        self.warm_start = False
+
+        # "pool": search for up to 50 optimal solutions of each online MINRAR model, and select between them on today's requests afterwards.
+        # "hierarchical": apply the same selection criteria as lower-priority objectives, so that a single solve gives the preferred solution.
+        self.tie_break = "pool"
+
+        # True: before solving the online MINRAR models, fix the requests whose assignment in an optimal solution does not depend on the rest of
+        # the problem (see presolve.py), and only pass the remaining products and requests to Gurobi.
+        self.presolve = False
+
+        # None: solve the multi-hospital MINRAR model as a single model.
+        # "lagrangian" or "rationing": solve one subproblem per hospital, against its own inventory and the products of the distribution center, and
+        #                              coordinate the products of the distribution center that are issued by several hospitals with prices or by rationing
+        #                              them over at most decomposition_rounds rounds (see solve_minrar_decomposed in minrar_multi.py). Both are heuristics
+        #                              without monotone improvement over the rounds: the best feasible allocation found in any round is used.
+        self.decomposition = None
+        self.decomposition_rounds = 10
+
+        # Number of hospital subproblems solved concurrently, each in its own process, when the multi-hospital model is decomposed.
+        self.decomposition_workers = 1
 
 
     # Generate a file name for exporting log or result files.
     def generate_filename(self, output_type):
 
+        if self.method == "heuristic":
+            return self.home_dir + f"{output_type}/{self.model_name}/{self.heuristic_policy}_"
         return self.home_dir + f"{output_type}/{self.model_name}/{self.method.lower()}_"
 
 
-    # Create the dataframe with all required columns, to store outputs during the simulations.
+    # Create the results recorder with all required columns, to store outputs during the simulations.
     def initialize_output_dataframe(self, PARAMS, hospitals, episode):
 
         ##########
@@ -128,7 +200,7 @@ class Settings():
         header = ["logged", "day", "location", "model name", "supply scenario", "demand scenario", "avg daily demand", "inventory size", "test days", "init days"]
 
         # Gurobi optimizer info.
-        header += ["gurobi status", "nvars", "calc time"]
+        header += ["gurobi status", "nvars", "calc time", "time to optimal", "num presolved requests"]
         header += ["objval shortages", "objval mismatches", "objval substitution", "objval fifo", "objval usability"]
         
         # Information about patients, donors, demand and supply.
@@ -156,44 +228,32 @@ class Settings():
         header += [f"num mismatches {p} {k}" for p in patgroups for k in antigens] + [f"num mismatched units {p} {k}" for p in patgroups for k in antigens]
         header += [f"num mismatches {eth} {k}" for eth in ethnicities for k in antigens]
 
-        df = pd.DataFrame(columns = header)
-
-        # Set the dataframe's index to each combination of day and location name.
-        locations = []
+        # Create a row for each combination of day and location name.
+        index = []
         for hospital in hospitals:
-            locations += [hospital.name] * len(days)
-
-        if len(hospitals) == 1:
-            df["day"] = days
-        else:
-            df["day"] = days * (1 + len(hospitals))
-            locations += [f"dc_{episode}"] * len(days)
-            
-        df["location"] = locations
+            index += [(day, hospital.name) for day in days]
+        if len(hospitals) > 1:
+            index += [(day, f"dc_{episode}") for day in days]
 
-        df = df.set_index(['day', 'location'])
-        df = df.fillna(0)
+        df = Results_recorder([col for col in header if col not in ["day", "location"]], index, text_columns = ["model name", "supply scenario", "demand scenario", "products available today", "products in inventory today"])
 
         ##################
         # ADD BASIC INFO #
         ##################
 
-        df.loc[:,"logged"] = False
-        df.loc[:,"model name"] = self.model_name
-        df.loc[:,"test days"] = self.test_days
-        df.loc[:,"init days"] = self.init_days
-        df.loc[:,"supply scenario"] = f"cau{round(self.donor_eth_distr[0]*100)}_afr{round(self.donor_eth_distr[1]*100)}_asi{round(self.donor_eth_distr[2]*100)}_{episode}"
+        df.set_column("model name", self.model_name)
+        df.set_column("test days", self.test_days)
+        df.set_column("init days", self.init_days)
+        df.set_column("supply scenario", f"cau{round(self.donor_eth_distr[0]*100)}_afr{round(self.donor_eth_distr[1]*100)}_asi{round(self.donor_eth_distr[2]*100)}_{episode}")
         
         for hospital in hospitals:
-            indices = [(day,hospital.name) for day in days]
-            df.loc[indices,"demand scenario"] = f"{hospital.htype}_{episode}"
-            df.loc[indices,"avg daily demand"] = hospital.avg_daily_demand
-            df.loc[indices,"inventory size"] = hospital.inventory_size
+            df.set_column("demand scenario", f"{hospital.htype}_{episode}", hospital.name)
+            df.set_column("avg daily demand", hospital.avg_daily_demand, hospital.name)
+            df.set_column("inventory size", hospital.inventory_size, hospital.name)
         
         return df
 
 
     # Check whether a given path exists, and create the path if it doesn't.
     def check_dir_existence(self, path):
-        if os.path.exists(path) == False:
-            os.mkdir(path)
\ No newline at end of file
+        os.makedirs(path, exist_ok=True)
\ No newline at end of file
@@ -1,8 +1,13 @@
 import numpy as np
 import pandas as pd
 import pickle
+import copy
+import os
+import queue
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 # import csv
-# import os
 
 from blood import *
 from hospital import *
@@ -10,130 +15,182 @@ from dc import *
 from minrar_single import *
 from minrar_multi import *
 from minrar_offline import *
+from heuristics import *
 from read_solution import *
 from save_state import *
 
-# Run the simulation.
+# Run the simulation for the given range of episodes. If SETTINGS.episode_workers > 1, episodes are simulated concurrently in
+# separate processes, where the machine's cores are divided over the concurrent episodes to limit the number of Gurobi threads.
 def simulation(SETTINGS, PARAMS):
 
-    # Multi-hospital setup: perform matching simultaniously for multiple hospitals, and strategically distribute new supply over all hospitals.
-    if sum(SETTINGS.n_hospitals.values()) > 1:
+    episodes = range(SETTINGS.episodes[0], SETTINGS.episodes[1])
+    workers = min(SETTINGS.episode_workers, len(episodes))
 
-        # Run the simulation for the given range of episodes.
-        for e in range(SETTINGS.episodes[0], SETTINGS.episodes[1]):
-            print(f"\nEpisode: {e}")
+    if workers > 1:
+        SETTINGS = copy.copy(SETTINGS)
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        SETTINGS.gurobi_threads = threads if SETTINGS.gurobi_threads == None else min(threads, SETTINGS.gurobi_threads)
+        print(f"Simulating {len(episodes)} episodes in {workers} processes, with {SETTINGS.gurobi_threads} solver threads each.")
 
-            # Initialize all hospitals and the distribution center.
-            hospitals = []
-            for htype in SETTINGS.n_hospitals.keys():
-                hospitals += [Hospital(SETTINGS, PARAMS, htype, (e*SETTINGS.n_hospitals[htype])+i) for i in range(SETTINGS.n_hospitals[htype])]
-            dc = Distribution_center(SETTINGS, PARAMS, hospitals, e)
+        # Each process reports every simulated day to a shared queue, which is used to show the progress of all episodes.
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers = workers) as pool:
+            progress = manager.Queue()
+            futures = [pool.submit(simulate_episode_in_worker, SETTINGS, PARAMS, e, progress) for e in episodes]
+            show_progress(SETTINGS, episodes, futures, progress)
 
-            # Initialize all hospital inventories with random supply, where the product's age is uniformly distributed between 0 and the maximum shelf life.
-            for hospital in hospitals:
-                # Fill the initial inventory with product only of age 0.
-                hospital.inventory += dc.sample_supply_single_day(PARAMS, hospital.inventory_size, 0)
+    else:
+        for e in episodes:
+            simulate_episode(SETTINGS, PARAMS, e)
 
-                # # Fill the initial inventory with products of uniformly distributed age.
-                # n_products = round(hospital.inventory_size / PARAMS.max_age)
-                # for age in range(PARAMS.max_age):
-                #     hospital.inventory += dc.sample_supply_single_day(PARAMS, n_products, age)
 
-            # Create a dataframe to be filled with output measures for every simulated day.
-            df = SETTINGS.initialize_output_dataframe(PARAMS, hospitals, e)
+# Simulate one episode in a worker process, writing everything that would be printed to a log file in the results folder.
+def simulate_episode_in_worker(SETTINGS, PARAMS, e, progress):
 
-            days = range(SETTINGS.init_days + SETTINGS.test_days)
+    with open(SETTINGS.generate_filename("results") + f"{SETTINGS.strategy}_episode_{e}.log", "w") as f, contextlib.redirect_stdout(f):
+        simulate_episode(SETTINGS, PARAMS, e, progress)
 
-            df, day, dc, hospitals = load_state(SETTINGS, e, df, dc, hospitals)
-            days = [d for d in days if d >= day]
-            
-            # Run the simulation for the given number of days, and write outputs for all 'test days' to the dataframe.
-            for day in days:
-                print(f"\nDay {day}")
-                df = simulate_multiple_hospitals(SETTINGS, PARAMS, df, dc, hospitals, e, day)
 
-                # if day % 5 == 0:
-                save_state(SETTINGS, df, e, day, dc, hospitals)
+# Show the number of days simulated for each of the concurrent episodes on a single line, until all episodes are finished.
+def show_progress(SETTINGS, episodes, futures, progress):
 
-            # Write the created output dataframe to a csv file in the 'results' directory.
-            df.to_csv(SETTINGS.generate_filename("results") + f"{SETTINGS.strategy}_{'-'.join([str(SETTINGS.n_hospitals[ds]) + ds[:3] for ds in SETTINGS.n_hospitals.keys()])}_{e}.csv", sep=',', index=True)        
-         
+    days_simulated = {e : 0 for e in episodes}
+    while not all([future.done() for future in futures]) or not progress.empty():
+        try:
+            e, day = progress.get(timeout=1)
+            days_simulated[e] = day + 1
+        except queue.Empty:
+            pass
+        print("\r" + " | ".join([f"{e}: {days_simulated[e]}/{SETTINGS.init_days + SETTINGS.test_days}" for e in episodes]), end="", flush=True)
+    print()
+
+    # Raise any error that occurred in one of the episodes.
+    for future in futures:
+        future.result()
+
+
+# Run the simulation for a single episode. If a progress queue is given, each simulated day is reported to it.
+def simulate_episode(SETTINGS, PARAMS, e, progress=None):
+
+    print(f"\nEpisode: {e}")
+
+    # Multi-hospital setup: perform matching simultaniously for multiple hospitals, and strategically distribute new supply over all hospitals.
+    if sum(SETTINGS.n_hospitals.values()) > 1:
+
+        # Initialize all hospitals and the distribution center.
+        hospitals = []
+        for htype in SETTINGS.n_hospitals.keys():
+            hospitals += [Hospital(SETTINGS, PARAMS, htype, (e*SETTINGS.n_hospitals[htype])+i) for i in range(SETTINGS.n_hospitals[htype])]
+        dc = Distribution_center(SETTINGS, PARAMS, hospitals, e)
+
+        # Initialize all hospital inventories with random supply, where the product's age is uniformly distributed between 0 and the maximum shelf life.
+        for hospital in hospitals:
+            # Fill the initial inventory with product only of age 0.
+            hospital.inventory.extend(dc.sample_supply_single_day(PARAMS, hospital.inventory_size, 0))
+
+            # # Fill the initial inventory with products of uniformly distributed age.
+            # n_products = round(hospital.inventory_size / PARAMS.max_age)
+            # for age in range(PARAMS.max_age):
+            #     hospital.inventory.extend(dc.sample_supply_single_day(PARAMS, n_products, age))
+
+        # Create a dataframe to be filled with output measures for every simulated day.
+        df = SETTINGS.initialize_output_dataframe(PARAMS, hospitals, e)
+
+        days = range(SETTINGS.init_days + SETTINGS.test_days)
+
+        df, day, dc, hospitals = load_state(SETTINGS, e, df, dc, hospitals)
+        days = [d for d in days if d >= day]
+        
+        # Run the simulation for the given number of days, and write outputs for all 'test days' to the dataframe.
+        for day in days:
+            print(f"\nDay {day}")
+            df = simulate_multiple_hospitals(SETTINGS, PARAMS, df, dc, hospitals, e, day)
+
+            # Append today's results to the episode's results file, and save a checkpoint every SETTINGS.checkpoint_interval days.
+            save_state(SETTINGS, df, e, day, dc, hospitals)
+            if progress != None:
+                progress.put((e, day))
+
+        # Write the created output dataframe to a csv file in the 'results' directory.
+        df.to_dataframe().to_csv(SETTINGS.generate_filename("results") + f"{SETTINGS.strategy}_{'-'.join([str(SETTINGS.n_hospitals[ds]) + ds[:3] for ds in SETTINGS.n_hospitals.keys()])}_{e}.csv", sep=',', index=True)        
+        print(f"Usability cache: {PARAMS.usability_cache.hits} hits, {PARAMS.usability_cache.misses} misses")
+     
     # Single-hospital setup: perform matching within one hospital.
     else:
 
         # Get the hospital's type ('regional' or 'university')
         htype = max(SETTINGS.n_hospitals, key = lambda i: SETTINGS.n_hospitals[i])
 
-        # Run the simulation for the given range of episodes.
-        for e in range(SETTINGS.episodes[0], SETTINGS.episodes[1]):
-            print(f"\nEpisode: {e}")
+        # Initialize the hospital. A distribution center is also initialized to provide the hospital with random supply.
+        hospital = Hospital(SETTINGS, PARAMS, htype, e)
+        dc = Distribution_center(SETTINGS, PARAMS, [hospital], e)
 
-            # Initialize the hospital. A distribution center is also initialized to provide the hospital with random supply.
-            hospital = Hospital(SETTINGS, PARAMS, htype, e)
-            dc = Distribution_center(SETTINGS, PARAMS, [hospital], e)
+        # Online model: each day in the simulation is solved iteratively, without knowledge about future days.
+        if SETTINGS.line == "on":
 
-            # Online model: each day in the simulation is solved iteratively, without knowledge about future days.
-            if SETTINGS.line == "on":
+            # Fill the initial inventory with product only of age 0.
+            hospital.inventory.extend(dc.sample_supply_single_day(PARAMS, hospital.inventory_size, 0))
 
-                # Fill the initial inventory with product only of age 0.
-                hospital.inventory += dc.sample_supply_single_day(PARAMS, hospital.inventory_size, 0)
+            # # Fill the initial inventory with products of uniformly distributed age.
+            # n_products = round(hospital.inventory_size / PARAMS.max_age)
+            # for age in range(PARAMS.max_age):
+            #     hospital.inventory.extend(dc.sample_supply_single_day(PARAMS, n_products, age))
 
-                # # Fill the initial inventory with products of uniformly distributed age.
-                # n_products = round(hospital.inventory_size / PARAMS.max_age)
-                # for age in range(PARAMS.max_age):
-                #     hospital.inventory += dc.sample_supply_single_day(PARAMS, n_products, age)
-
-                # Create a dataframe to be filled with output measures for every simulated day.
-                df = SETTINGS.initialize_output_dataframe(PARAMS, [hospital], e)
+            # Create a dataframe to be filled with output measures for every simulated day.
+            df = SETTINGS.initialize_output_dataframe(PARAMS, [hospital], e)
 
-                days = range(SETTINGS.init_days + SETTINGS.test_days)
+            days = range(SETTINGS.init_days + SETTINGS.test_days)
 
-                df, day, dc, hospitals = load_state(SETTINGS, e, df, dc, [hospital])
-                hospital = hospitals[0]
-                days = [d for d in days if d >= day]
+            df, day, dc, hospitals = load_state(SETTINGS, e, df, dc, [hospital])
+            hospital = hospitals[0]
+            days = [d for d in days if d >= day]
 
-                # Run the simulation for the given number of days, and write outputs for all 'test days' to the dataframe.
-                for day in days:
-                    print(f"\nDay {day}")
-                    df = simulate_single_hospital(SETTINGS, PARAMS, df, dc, hospital, e, day)
+            # Run the simulation for the given number of days, and write outputs for all 'test days' to the dataframe.
+            for day in days:
+                print(f"\nDay {day}")
+                df = simulate_single_hospital(SETTINGS, PARAMS, df, dc, hospital, e, day)
 
-                    # if day % 5 == 0:
-                    save_state(SETTINGS, df, e, day, dc, [hospital])
+                # Append today's results to the episode's results file, and save a checkpoint every SETTINGS.checkpoint_interval days.
+                save_state(SETTINGS, df, e, day, dc, [hospital])
+                if progress != None:
+                    progress.put((e, day))
 
-                # Write the created output dataframe to a csv file in the 'results' directory.
-                df.to_csv(SETTINGS.generate_filename("results") + f"{SETTINGS.strategy}_{htype[:3]}_{e}.csv", sep=',', index=True)
+            # Write the created output dataframe to a csv file in the 'results' directory.
+            df.to_dataframe().to_csv(SETTINGS.generate_filename("results") + f"{SETTINGS.strategy}_{htype[:3]}_{e}.csv", sep=',', index=True)
+            print(f"Usability cache: {PARAMS.usability_cache.hits} hits, {PARAMS.usability_cache.misses} misses")
 
 
-            # Offline model: all days in the simulation are solved simultaniously, having full knowledge about all demand and supply involved.
-            elif SETTINGS.line == "off":
+        # Offline model: all days in the simulation are solved simultaniously, having full knowledge about all demand and supply involved.
+        elif SETTINGS.line == "off":
 
-                # Get the full range of days to simulate.
-                days = range(SETTINGS.init_days + SETTINGS.test_days)
+            # Get the full range of days to simulate.
+            days = range(SETTINGS.init_days + SETTINGS.test_days)
 
-                # Load all sampled supply products into the hospital's inventory. Note that the inventory is stored as an
-                # ordered list, and within the model it is ensured that products can only become available in the supplied order.
-                hospital.inventory = dc.sample_supply_single_day(PARAMS, SETTINGS.supply_size)
-                
-                # Load all requests, containing both the day of becoming known and the day of issuing as properties.
-                for day in days:
-                    hospital.sample_requests_single_day(PARAMS, day=day)
+            # Load all sampled supply products into the hospital's inventory. Note that the inventory is stored as an
+            # ordered list, and within the model it is ensured that products can only become available in the supplied order.
+            hospital.inventory = dc.sample_supply_single_day(PARAMS, SETTINGS.supply_size)
+            
+            # Load all requests, containing both the day of becoming known and the day of issuing as properties.
+            for day in days:
+                hospital.sample_requests_single_day(PARAMS, day=day)
 
-                # Create a dataframe to be filled with output measures for every simulated day.
-                df = SETTINGS.initialize_output_dataframe(PARAMS, [hospital], e)
-                
-                # Run the simulation for the full range of days.
-                model = minrar_offline(SETTINGS, PARAMS, hospital, days)
-                
-                # Abstract the optimal variable values from the solved model and write the corresponding results to a csv file.
-                df, x, y, z, a, b = read_minrar_solution(SETTINGS, PARAMS, df, model, [hospital], e)
-                for day in days:
-                    df = log_results(SETTINGS, PARAMS, df, hospital, day, x=x, y=y, z=z, a=a, b=b)
+            # Create a dataframe to be filled with output measures for every simulated day.
+            df = SETTINGS.initialize_output_dataframe(PARAMS, [hospital], e)
+            
+            # Run the simulation for the full range of days.
+            model, variables = minrar_offline(SETTINGS, PARAMS, hospital, days)
+            
+            # Abstract the optimal variable values from the solved model and write the corresponding results to a csv file.
+            df, x, y, z, a, b = read_minrar_solution(SETTINGS, PARAMS, df, model, variables, dc, [hospital], e)
+            for day in days:
+                df = log_results(SETTINGS, PARAMS, df, hospital, day, x=x, y=y, z=z, a=a, b=b)
 
-                # Write the created output dataframe to a csv file in the 'results' directory.
-                df.to_csv(SETTINGS.generate_filename("results") + f"offline_{SETTINGS.strategy}_{htype[:3]}_{e}.csv", sep=',', index=True)
+            # Write the created output dataframe to a csv file in the 'results' directory.
+            df.to_dataframe().to_csv(SETTINGS.generate_filename("results") + f"offline_{SETTINGS.strategy}_{htype[:3]}_{e}.csv", sep=',', index=True)
+            if progress != None:
+                progress.put((e, days[-1]))
 
-            else:
-                print("Please set the 'line' variable in settings.py to a valid value (either 'off' or 'on').")
+        else:
+            print("Please set the 'line' variable in settings.py to a valid value (either 'off' or 'on').")
 
 
 # Single-hospital setup: perform matching within one hospital.
@@ -141,11 +198,14 @@ def simulate_single_hospital(SETTINGS, PARAMS, df, dc, hospital, e, day):
 
     # Update the set of available requests, by removing requests for previous days (regardless of 
     # whether they were satisfied or not) and sampling new requests that become known today.
-    hospital.requests = [r for r in hospital.requests if r.day_issuing >= day]
+    hospital.requests.remove(hospital.requests.day_issuing < day)
     hospital.sample_requests_single_day(PARAMS, day=day)
 
-    # Solve the MINRAR model, matching the hospital's inventory products to the available requests.
-    df, x, y, z = minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df)
+    # Solve the MINRAR model, or apply a heuristic matching policy, matching the hospital's inventory products to the available requests.
+    if SETTINGS.method == "heuristic":
+        df, x, y, z = heuristic_single_hospital(SETTINGS, PARAMS, hospital, day, df)
+    else:
+        df, x, y, z = minrar_single_hospital(SETTINGS, PARAMS, hospital, day, df)
 
     # Abstract the optimal variable values from the solved model and write the corresponding results to a csv file.
     # df, x, y, z = read_minrar_solution(SETTINGS, PARAMS, df, model, dc, [hospital], e, day)
@@ -153,7 +213,7 @@ def simulate_single_hospital(SETTINGS, PARAMS, df, dc, hospital, e, day):
     
     # Update the hospital's inventory, by removing issued or outdated products, increasing product age, and sampling new supply.
     supply_size = hospital.update_inventory(SETTINGS, PARAMS, x, day)
-    hospital.inventory += dc.sample_supply_single_day(PARAMS, supply_size)
+    hospital.inventory.extend(dc.sample_supply_single_day(PARAMS, supply_size))
 
     return df
 
@@ -164,25 +224,25 @@ def simulate_multiple_hospitals(SETTINGS, PARAMS, df, dc, hospitals, e, day):
     # For each hospital, update the set of available requests, by removing requests for previous days 
     # (regardless of whether they were satisfied or not) and sampling new requests that become known today.
     for hospital in hospitals:
-        hospital.requests = [r for r in hospital.requests if r.day_issuing >= day]
+        hospital.requests.remove(hospital.requests.day_issuing < day)
         hospital.sample_requests_single_day(PARAMS, day=day)
 
-        for rq in hospital.requests:
-            rq.allocated_from_dc = 0
+        hospital.requests.allocated_from_dc[:] = 0
 
-    # Solve the MINRAR model, matching the inventories of all hospitals and the distribution center to all available requests.
-    df, xh, xdc, y, z = minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df)
+    # Solve the MINRAR model, or apply a heuristic matching policy, matching the inventories of all hospitals and the distribution center to all available requests.
+    if SETTINGS.method == "heuristic":
+        df, xh, xdc, y, z = heuristic_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df)
+    else:
+        df, xh, xdc, y, z = minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, day, df)
 
     # Get all distribution center products that were allocated to requests with tomorrow as their issuing date.
     allocations_from_dc = np.zeros([len(dc.inventory),len(hospitals)])
     for h in range(len(hospitals)):
-        for r in range(len(hospitals[h].requests)):
-            if hospitals[h].requests[r].day_issuing == (day + 1):
-                
-                issued = np.where(xdc[h][:,r]==1)[0]
-                for i in issued:
-                    allocations_from_dc[i,h] = 1
-                    hospitals[h].requests[r].allocated_from_dc += 1     # total number of products allocated to this request from DC
+        tomorrow = hospitals[h].requests.day_issuing == (day + 1)
+        issued = xdc[h][:,tomorrow] == 1
+
+        allocations_from_dc[issued.any(axis=1),h] = 1
+        hospitals[h].requests.allocated_from_dc[tomorrow] += issued.sum(axis=0)     # total number of products allocated to this request from DC
 
         # Write the results to a csv file.
         df = log_results(SETTINGS, PARAMS, df, hospitals[h], day, x=xh[h], y=y[h], z=z[h])
@@ -191,12 +251,14 @@ def simulate_multiple_hospitals(SETTINGS, PARAMS, df, dc, hospitals, e, day):
     supply_sizes = [hospitals[h].update_inventory(SETTINGS, PARAMS, xh[h], day) for h in range(len(hospitals))]
 
     # Allocate products to each of the hospitals to restock them upto their maximum capacity.
-    model = allocate_remaining_supply_from_dc(SETTINGS, PARAMS, day, dc.inventory, hospitals, supply_sizes, allocations_from_dc)
+    model, x = allocate_remaining_supply_from_dc(SETTINGS, PARAMS, day, dc.inventory, hospitals, supply_sizes, allocations_from_dc)
     
     # Abstract the remaining supply from the solved model, and ship all allocated products to the hospitals.
-    x = read_transports_solution(model, len(dc.inventory), len(hospitals))
+    x = read_transports_solution(model, x, len(dc.inventory), len(hospitals))
     for h in range(len(hospitals)):
-        hospitals[h].inventory += [dc.inventory[i] for i in range(len(dc.inventory)) if x[i,h] >= 1]
+        shipment = dc.inventory.select(x[:,h] >= 1)
+        shipment.increase_age(PARAMS)       # shipped products age along with the distribution center's inventory
+        hospitals[h].inventory.extend(shipment)
 
     # Update the distribution centers's inventory, by removing shipped or outdated products, and increasing product age.
     dc.update_inventory(SETTINGS, PARAMS, x, day)
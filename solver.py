@@ -0,0 +1,275 @@
+import numpy as np
+import scipy.sparse as sp
+
+from gurobipy import Model, GRB, LinExpr
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+
+class Solver_model():
+
+    # An instance of this class holds one optimization model, solved by the backend given by SETTINGS.solver ("gurobi" or "highs"). Models
+    # are built in matrix form: variables are added in blocks, constraints as sparse coefficient matrices over blocks of variables, and
+    # objectives as coefficient vectors. Objectives with equal priority are blended, and objectives with a higher priority are optimized first,
+    # as in Gurobi's multi-objective models. Variables are referred to by the handles returned by add_vars: Gurobi variables for the "gurobi"
+    # backend and column indices for the "highs" backend. Builders that only exist for Gurobi can build directly into the Gurobi model (self.model).
+    def __init__(self, SETTINGS, name = "model", solver = None):
+
+        self.solver = SETTINGS.solver if solver == None else solver
+        self.objectives = {}                # Coefficients (as pairs of handles and values), priority, name and relative tolerance of each objective.
+        self.pool_size = 1                  # Maximum number of optimal solutions to search for.
+
+        if self.solver == "gurobi":
+            self.model = Model(name=name)
+            if SETTINGS.show_gurobi_output == False:
+                self.model.Params.LogToConsole = 0
+            if SETTINGS.gurobi_threads != None:
+                self.model.setParam('Threads', SETTINGS.gurobi_threads)
+            if SETTINGS.gurobi_timeout != None:
+                self.model.setParam('TimeLimit', SETTINGS.gurobi_timeout)
+            self.model.ModelSense = GRB.MINIMIZE
+
+        else:
+            self.model = highspy.Highs()
+            self.model.setOptionValue("output_flag", SETTINGS.show_gurobi_output)
+            if SETTINGS.gurobi_threads != None:
+                self.model.setOptionValue("threads", SETTINGS.gurobi_threads)
+            if SETTINGS.gurobi_timeout != None:
+                self.model.setOptionValue("time_limit", float(SETTINGS.gurobi_timeout))
+            self.start = {}
+            self.solutions = []
+            self.status = 1
+            self.runtime = 0
+
+
+    # Search for up to the given number of optimal solutions. HiGHS does not keep a pool of solutions, so it only returns the optimal solution found.
+    def set_pool(self, size):
+
+        self.pool_size = size
+        if self.solver == "gurobi":
+            self.model.Params.PoolSearchMode = 2
+            self.model.Params.PoolSolutions = size
+            self.model.Params.PoolGap = 0
+
+
+    # Set the relative optimality gap at which the solver stops.
+    def set_gap(self, gap):
+
+        if self.solver == "gurobi":
+            self.model.Params.MIPGap = gap
+        else:
+            self.model.setOptionValue("mip_rel_gap", float(gap))
+
+
+    # Add a block of n variables of the given type ("B" binary, "I" integer or "C" continuous) with the given bounds, and return their handles.
+    def add_vars(self, n, vtype, lb = 0, ub = 1, names = None):
+
+        if self.solver == "gurobi":
+            x = self.model.addMVar(n, name=names, vtype=vtype, lb=lb, ub=ub)
+            self.model.update()
+            return x.tolist()
+
+        start = self.model.getNumCol()
+        self.model.addVars(n, np.broadcast_to(np.asarray(lb, dtype=float), n).copy(), np.broadcast_to(np.asarray(ub, dtype=float), n).copy())
+        x = np.arange(start, start + n, dtype=np.int32)
+        if vtype != "C" and n > 0:
+            self.model.changeColsIntegrality(n, x, np.array([highspy.HighsVarType.kInteger] * n))
+        return x
+
+
+    # Add the constraints A_1 x_1 + A_2 x_2 + ... (sense) rhs, one for each row, where terms is the list of pairs (A_j, x_j) of a sparse matrix
+    # and the handles of the variables of its columns, and sense is "<", ">" or "=".
+    def add_constrs(self, terms, sense, rhs):
+
+        A = sp.hstack([A_j for A_j, _ in terms], format="csr")
+        x = [v for _, x_j in terms for v in list(x_j)]
+        rhs = np.broadcast_to(np.asarray(rhs, dtype=float), A.shape[0])
+
+        if self.solver == "gurobi":
+            self.model.addMConstr(A, x, sense, rhs)
+
+        else:
+            A = sp.csr_matrix((A.data, np.asarray(x, dtype=np.int32)[A.indices], A.indptr), shape=(A.shape[0], self.model.getNumCol()))
+            lower = rhs if sense in [">", "="] else np.full(len(rhs), -highspy.kHighsInf)
+            upper = rhs if sense in ["<", "="] else np.full(len(rhs), highspy.kHighsInf)
+            self.model.addRows(A.shape[0], lower.copy(), upper.copy(), A.nnz, A.indptr[:-1].astype(np.int32), A.indices.astype(np.int32), A.data.astype(float))
+
+
+    # Set the objective with the given index to the sum of the given terms, where each term is a pair of variable handles and their coefficients.
+    # The model minimizes the blend of all objectives of the highest priority first, then the blend of the next priority among the solutions
+    # that are optimal for all higher priorities (within the relative tolerance reltol), and so on.
+    def set_objective(self, terms, index = 0, priority = 0, name = None, reltol = None):
+
+        self.objectives[index] = [[(list(x), list(c)) for x, c in terms], priority, name, reltol]
+
+        if self.solver == "gurobi":
+            expr = LinExpr([c_j for _, c in terms for c_j in c], [x_j for x, _ in terms for x_j in x])
+            if index == 0:
+                self.model.setObjective(expr)
+            elif reltol == None:
+                self.model.setObjectiveN(expr, index, priority, name=name)
+            else:
+                self.model.setObjectiveN(expr, index, priority, name=name, reltol=reltol)
+
+
+    # Change the priority of the objective with the given index.
+    def set_priority(self, index, priority):
+
+        if index in self.objectives:
+            self.objectives[index][1] = priority
+        if self.solver == "gurobi":
+            self.model.Params.ObjNumber = index
+            self.model.ObjNPriority = priority
+
+
+    # Start the optimization from the given values of the given variables. All other variables are left for the solver to complete.
+    def set_start(self, x, values):
+
+        if self.solver == "gurobi":
+            self.model.setAttr("Start", list(x), list(values))
+        else:
+            self.start.update(zip(list(x), list(values)))
+
+
+    # Optimize the model and return the time (in seconds since the start of the optimization) at which its optimal solution was first
+    # found, which is the time of the first incumbent with the lowest objective value. Incumbents are recorded by a callback. With several
+    # priority levels, only the incumbents of the first level (the highest priority) are recorded, as the objective values of different
+    # levels can not be compared.
+    def optimize(self):
+
+        incumbents = []
+        if self.solver == "gurobi":
+            levels_done = [0]
+            def callback(model, where):
+                if where == GRB.Callback.MULTIOBJ:
+                    levels_done[0] = model.cbGet(GRB.Callback.MULTIOBJ_OBJCNT)
+                elif where == GRB.Callback.MIPSOL and levels_done[0] == 0:
+                    incumbents.append((model.cbGet(GRB.Callback.MIPSOL_OBJ), model.cbGet(GRB.Callback.RUNTIME)))
+
+            self.model.optimize(callback)
+            runtime = self.model.Runtime
+
+        else:
+            runtime = self.optimize_highs(incumbents)
+
+        if len(incumbents) == 0:
+            return runtime
+        best = min([obj for obj, _ in incumbents])
+        return min([t for obj, t in incumbents if obj <= best + 1e-9 * max(1, abs(best))])
+
+
+    # Optimize the model with HiGHS, one priority level at a time: after optimizing the blend of the objectives of one level, their value is
+    # bounded by the optimum found (within the level's tolerance), and the solution is used as the start for the next level. Incumbents of the
+    # first level are recorded in the given list. Returns the total runtime.
+    def optimize_highs(self, incumbents):
+
+        n = self.model.getNumCol()
+        columns = np.arange(n, dtype=np.int32)
+        levels = sorted(set([priority for _, priority, _, _ in self.objectives.values()]), reverse=True)
+        callback = lambda e: incumbents.append((e.data_out.objective_function_value, e.data_out.running_time))
+        self.model.cbMipImprovingSolution.subscribe(callback)
+
+        start, runtime = self.start, 0
+        for l, level in enumerate(levels):
+
+            # Blend all objectives of this level into the cost vector.
+            cost = np.zeros(n)
+            reltol = 0
+            for terms, priority, _, tol in self.objectives.values():
+                if priority == level:
+                    for x, c in terms:
+                        np.add.at(cost, np.asarray(x, dtype=int), np.asarray(c, dtype=float))
+                    reltol = max(reltol, 0 if tol == None else tol)
+            self.model.changeColsCost(n, columns, cost)
+
+            if len(start) > 0:
+                self.model.setSolution(len(start), np.array(list(start.keys()), dtype=np.int32), np.array(list(start.values()), dtype=float))
+            self.model.run()
+            runtime += self.model.getRunTime()
+            if l == 0:
+                self.model.cbMipImprovingSolution.unsubscribe(callback)
+
+            self.status = highs_status(self.model.getModelStatus())
+            self.solutions = [np.array(self.model.getSolution().col_value)] if self.status in [2, 9] and n > 0 else []
+            if len(self.solutions) == 0 or l == len(levels) - 1:
+                break
+
+            # Keep the optimum of this level for all following levels.
+            value = cost @ self.solutions[0]
+            bound = value + max(1e-6, reltol * abs(value))
+            nonzero = np.flatnonzero(cost)
+            self.model.addRows(1, np.array([-highspy.kHighsInf]), np.array([bound]), len(nonzero), np.array([0], dtype=np.int32), nonzero.astype(np.int32), cost[nonzero])
+            start = dict(zip(columns.tolist(), self.solutions[0].tolist()))
+
+        self.runtime = runtime
+        return runtime
+
+
+    # Get the values of the given variables in the solution with the given number (0 for the best solution found).
+    def values(self, x, solution = 0):
+
+        if self.solver == "gurobi":
+            self.model.Params.SolutionNumber = solution
+            return self.model.getAttr("Xn", list(x))
+        return self.solutions[solution][np.asarray(x, dtype=int)]
+
+
+    # Number of solutions found.
+    @property
+    def num_solutions(self):
+        if self.solver == "gurobi":
+            return self.model.SolCount if self.pool_size > 1 else min(1, self.model.SolCount)
+        return len(self.solutions)
+
+
+    # Status of the optimization, as a Gurobi status code (see PARAMS.status_code).
+    @property
+    def status_code(self):
+        return self.model.status if self.solver == "gurobi" else self.status
+
+
+    # Number of variables in the model.
+    @property
+    def num_vars(self):
+        return self.model.NumVars if self.solver == "gurobi" else self.model.getNumCol()
+
+
+    # Time spent on the last optimization, in seconds.
+    @property
+    def optimization_time(self):
+        return self.model.Runtime if self.solver == "gurobi" else self.runtime
+
+
+# Create an empty model for the single- or multi-hospital MINRAR model, for the solver and with the solver parameters given in the settings.
+def new_minrar_model(SETTINGS):
+
+    model = Solver_model(SETTINGS)
+
+    # Search for up to 50 optimal solutions, to select between them afterwards.
+    if SETTINGS.tie_break == "pool":
+        model.set_pool(50)
+
+    # Otherwise, solve every level of the hierarchical objective to optimality, so that ties are broken between truly optimal solutions only.
+    else:
+        model.set_gap(0)
+
+    return model
+
+
+# Translate a HiGHS model status into the Gurobi status code with the same meaning.
+def highs_status(status):
+
+    codes = {
+        highspy.HighsModelStatus.kOptimal : 2,
+        highspy.HighsModelStatus.kInfeasible : 3,
+        highspy.HighsModelStatus.kUnboundedOrInfeasible : 4,
+        highspy.HighsModelStatus.kUnbounded : 5,
+        highspy.HighsModelStatus.kIterationLimit : 7,
+        highspy.HighsModelStatus.kTimeLimit : 9,
+        highspy.HighsModelStatus.kSolutionLimit : 10,
+        highspy.HighsModelStatus.kInterrupt : 11,
+    }
+    return codes.get(status, 1)
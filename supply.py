@@ -1,8 +1,10 @@
 import math
 import os
+import numpy as np
 import pandas as pd
 
 from blood import *
+from scenario import *
 
 
 # Generate a given number of supply files, where each file contains enough supply for one simulation episode.
@@ -21,67 +23,50 @@ def generate_supply(SETTINGS, PARAMS):
     if os.path.exists(path) == False:
         os.mkdir(path)
 
-    # Find already existing supply files of the chosen size and duration, and make sure not to overwrite them.
-    i = 0
-    while os.path.exists(SETTINGS.home_dir + f"supply/{size}/{name}_{i}.csv"):
-        i += 1
-
-    # For every episode in the given range, generate enough supply for each simulation.
-    for _ in range(SETTINGS.episodes[0],SETTINGS.episodes[1]):
-
-        print(f"Generating supply '{name}_{i}'.")
-
-        # Generate the required number of products and write to a pandas dataframe.
-        products = generate_products(SETTINGS, PARAMS, size)
-        df = pd.DataFrame(products, columns = PARAMS.major + PARAMS.minor + ["Ethnicity"])
-        
-        # Shuffle the supplied products.
-        index = list(df.index)
-        random.shuffle(index)
-        df = df.loc[index]
-
-        # # Uncomment the code below to let the initial inventory consist of products of only one major blood type.
-        # if sum(SETTINGS.n_hospitals.values()) > 1:
-        #     inventory_size = SETTINGS.inv_size_factor_dc * sum([SETTINGS.n_hospitals[htype] * SETTINGS.avg_daily_demand[htype] for htype in SETTINGS.n_hospitals.keys()])
-        # else:
-        #     inventory_size = SETTINGS.inv_size_factor_hosp * sum([SETTINGS.n_hospitals[htype] * SETTINGS.avg_daily_demand[htype] for htype in SETTINGS.n_hospitals.keys()])
-        # products = []
-        # for _ in range(inventory_size):
-        #     ip = Blood(PARAMS, ethnicity="Caucasian", major="AB+")    # Change the 'major' argument to the major blood group to use for the initial inventory.
-        #     products.append(ip.vector + [ip.ethnicity])
-        # df = pd.concat([pd.DataFrame(products, columns = PARAMS.major+PARAMS.minor+["Ethnicity"]), df.iloc[inventory_size:]])
-
-        df["Index"] = range(len(df))
-        
-        # Write the dataframe to a csv file.
-        df.to_csv(SETTINGS.home_dir + f"supply/{size}/{name}_{i}.csv", index=False)
-
-        i += 1
-
-# Generate a list of products with a specific ethnic distribution and a specific ABODistribution, in random order
-def generate_products(SETTINGS, PARAMS, size):
-
-    products = []
-    majors_sampled = {major : 0 for major in PARAMS.ABOD}
-
-    # Sample African donors.
-    for _ in range(round(size * SETTINGS.donor_eth_distr[1])):
-        ip = Blood(PARAMS, ethnicity="African")
-        products.append(ip.vector + [ip.ethnicity])
-        majors_sampled[ip.major] += 1
-
-    # Sample Asian donors.
-    for _ in range(round(size * SETTINGS.donor_eth_distr[2])):
-        ip = Blood(PARAMS, ethnicity="Asian")
-        products.append(ip.vector + [ip.ethnicity])
-        majors_sampled[ip.major] += 1
+    # Generate one supply file for every episode in the given range, each containing enough supply for one simulation.
+    generate_scenarios(SETTINGS, PARAMS, sample_supply_scenario, (), path + f"/{name}", "supply", range(SETTINGS.episodes[0], SETTINGS.episodes[1]))
+
+
+# Sample a single supply scenario, with products in random order.
+def sample_supply_scenario(SETTINGS, PARAMS, rng):
+
+    # Generate the required number of products and write to a pandas dataframe.
+    vectors, ethnicity = generate_products(SETTINGS, PARAMS, SETTINGS.supply_size, rng)
+    df = pd.DataFrame(vectors, columns = PARAMS.major + PARAMS.minor)
+    df["Ethnicity"] = np.array(PARAMS.ethnicities)[ethnicity]
+
+    # Shuffle the supplied products.
+    df = df.iloc[rng.permutation(len(df))]
+
+    # # Uncomment the code below to let the initial inventory consist of products of only one major blood type.
+    # if sum(SETTINGS.n_hospitals.values()) > 1:
+    #     inventory_size = SETTINGS.inv_size_factor_dc * sum([SETTINGS.n_hospitals[htype] * SETTINGS.avg_daily_demand[htype] for htype in SETTINGS.n_hospitals.keys()])
+    # else:
+    #     inventory_size = SETTINGS.inv_size_factor_hosp * sum([SETTINGS.n_hospitals[htype] * SETTINGS.avg_daily_demand[htype] for htype in SETTINGS.n_hospitals.keys()])
+    # products = []
+    # for _ in range(inventory_size):
+    #     ip = Blood(PARAMS, ethnicity="Caucasian", major="AB+")    # Change the 'major' argument to the major blood group to use for the initial inventory.
+    #     products.append(ip.vector + [ip.ethnicity])
+    # df = pd.concat([pd.DataFrame(products, columns = PARAMS.major+PARAMS.minor+["Ethnicity"]), df.iloc[inventory_size:]])
+
+    df["Index"] = range(len(df))
+
+    return df
+
+
+# Generate the antigen vectors and ethnicities (as indices in PARAMS.ethnicities) of products with a specific ethnic distribution and a specific ABODistribution.
+def generate_products(SETTINGS, PARAMS, size, rng):
+
+    # Sample African and Asian donors.
+    ethnicity = np.repeat([PARAMS.ethnicities.index("African"), PARAMS.ethnicities.index("Asian")], [round(size * SETTINGS.donor_eth_distr[1]), round(size * SETTINGS.donor_eth_distr[2])])
+    vectors = sample_phenotypes(PARAMS, ethnicity, rng)
+
+    # Count the major blood groups sampled, by their A, B and RhD antigens.
+    codes = vectors[:,[(PARAMS.major + PARAMS.minor).index(ag) for ag in ["A", "B", "D"]]] @ np.array([4, 2, 1])
+    majors_sampled = dict(zip(PARAMS.ABOD, np.bincount(codes, minlength=8)[[4 * ("A" in major) + 2 * ("B" in major) + ("+" in major) for major in PARAMS.ABOD]]))
 
     # For each major blood group determine how many products should be additionally sampled, to make sure that the overall list has the correct ABOD distribution
-    for major in PARAMS.ABOD:
-        num_to_sample = round(PARAMS.donor_ABOD_distr[major] * size) - majors_sampled[major]
-        
-        for _ in range(max(0,num_to_sample)):
-            ip = Blood(PARAMS, ethnicity="Caucasian", major=major)
-            products.append(ip.vector + [ip.ethnicity])
-
-    return products
+    majors = np.repeat(PARAMS.ABOD, [max(0, round(PARAMS.donor_ABOD_distr[major] * size) - majors_sampled[major]) for major in PARAMS.ABOD])
+    caucasian = np.full(len(majors), PARAMS.ethnicities.index("Caucasian"))
+
+    return np.vstack([vectors, sample_phenotypes(PARAMS, caucasian, rng, majors)]), np.concatenate([ethnicity, caucasian])
@@ -0,0 +1,63 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from settings import *
+from params import *
+from blood import *
+from blood_store import *
+from hospital import *
+from presolve import *
+from results_recorder import *
+
+
+# Settings for a small simulation with the given number of regional hospitals, and any other settings given by keyword.
+def make_settings(n_hospitals, **settings):
+
+    SETTINGS = Settings()
+    SETTINGS.n_hospitals = {"regional" : n_hospitals, "university" : 0}
+    for key, value in settings.items():
+        setattr(SETTINGS, key, value)
+    return SETTINGS
+
+
+# Random products or requests, with phenotypes sampled from the Caucasian population and uniformly drawn patient groups.
+def random_store(PARAMS, rng, n, requests = False):
+
+    vectors = sample_phenotypes(PARAMS, np.full(n, PARAMS.ethnicities.index("Caucasian")), rng)
+    if requests:
+        return Blood_store(PARAMS, vectors, index = np.arange(n), patgroup = rng.integers(len(PARAMS.patgroups), size=n),
+                            num_units = rng.integers(1, 3, size=n), day_issuing = rng.integers(0, 4, size=n))
+    return Blood_store(PARAMS, vectors, index = np.arange(n), age = rng.integers(0, PARAMS.max_age, size=n))
+
+
+# A regional hospital with a random inventory and random requests, without reading any demand scenario.
+def random_hospital(SETTINGS, PARAMS, rng, e, n_products, n_requests):
+
+    hospital = Hospital.__new__(Hospital)
+    hospital.htype = "regional"
+    hospital.name = f"reg_{e}"
+    hospital.avg_daily_demand = SETTINGS.avg_daily_demand["regional"]
+    hospital.inventory = random_store(PARAMS, rng, n_products)
+    hospital.requests = random_store(PARAMS, rng, n_requests, requests = True)
+    hospital.model = None
+    hospital.assigned = set()
+    return hospital
+
+
+# Results recorder for the given hospitals on the given day, with the columns written by the MINRAR solves.
+def new_recorder(hospitals, day):
+    return Results_recorder(["gurobi status", "nvars", "calc time", "time to optimal", "num presolved requests"], [(day, hospital.name) for hospital in hospitals])
+
+
+# Objective of the full MINRAR model for a hospital's assignments x (one pair of assignments and products per inventory), shortages y and
+# mismatches z, where requests issued today (urgency 1) or earlier (urgency 2 in the multi-hospital model) get a higher shortage penalty.
+def full_objective(SETTINGS, PARAMS, hospital, day, assignments, y, z):
+
+    w = np.array(PARAMS.patgroup_weights.loc[PARAMS.patgroups, PARAMS.major + PARAMS.minor])[hospital.requests.patgroup]
+    objective = (y * ((len(hospital.requests) * issuing_urgency(hospital.requests, day)) + 1)).sum() + (5 * z * w).sum()
+    for x, products, fifo in assignments:
+        objective += (x * assignment_costs(SETTINGS, PARAMS, products, hospital.requests, [hospital], fifo)).sum()
+    return objective
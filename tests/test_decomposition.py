@@ -0,0 +1,31 @@
+import types
+import numpy as np
+import pytest
+
+from helpers import *
+from minrar_multi import *
+
+
+# Objective of the full multi-hospital MINRAR model for the allocation found by the given decomposition method in the given number of rounds.
+def decomposed_allocation_objective(seed, decomposition, rounds):
+
+    SETTINGS = make_settings(4, decomposition = decomposition, decomposition_rounds = rounds)
+    PARAMS = Params(SETTINGS)
+    rng = np.random.default_rng(seed)
+    hospitals = [random_hospital(SETTINGS, PARAMS, rng, e, 6, 12) for e in range(4)]
+    dc = types.SimpleNamespace(inventory = random_store(PARAMS, rng, 12))
+
+    _, xh, xdc, y, z = minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, 0, new_recorder(hospitals, 0))
+
+    # No product of the distribution center may be issued more than once.
+    assert (sum([np.round(x).sum(axis=1) for x in xdc]) <= 1).all()
+    return sum([full_objective(SETTINGS, PARAMS, hospitals[h], 1, [(xh[h], hospitals[h].inventory, True), (xdc[h], dc.inventory, False)], y[h], z[h])
+                for h in range(len(hospitals))])
+
+
+# The best allocation over all rounds is returned, so more rounds never give a worse allocation, even though the prices need not improve it.
+# The seeds are instances where the allocation of the last round was worse than that of the first.
+@pytest.mark.parametrize("seed", [8, 9, 11])
+def test_more_lagrangian_rounds_are_not_worse(seed):
+
+    assert decomposed_allocation_objective(seed, "lagrangian", 5) <= decomposed_allocation_objective(seed, "lagrangian", 1) + 1e-6
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from helpers import *
+from minrar_single import *
+
+
+# The incremental builder keeps the hospital's model alive between solves, and warm-starts each solve from the previous assignments.
+# The shortages must be the same as those of a model built from scratch, and no product may be issued more than once.
+@pytest.mark.parametrize("seed", range(3))
+def test_incremental_builder_with_warm_start(seed):
+
+    shortages = []
+    for model_builder in ["quicksum", "incremental"]:
+        SETTINGS = make_settings(1, model_builder = model_builder, warm_start = True)
+        PARAMS = Params(SETTINGS)
+        hospital = random_hospital(SETTINGS, PARAMS, np.random.default_rng(seed), 0, 20, 15)
+
+        for solve in range(2):
+            _, x, y, z = minrar_single_hospital(SETTINGS, PARAMS, hospital, 0, new_recorder([hospital], 0))
+            assert (np.round(x).sum(axis=1) <= 1).all()
+        shortages.append((y * ((len(hospital.requests) * issuing_urgency(hospital.requests, 0)) + 1)).sum())
+
+    assert shortages[1] == pytest.approx(shortages[0])
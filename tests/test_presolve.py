@@ -0,0 +1,71 @@
+import types
+import numpy as np
+import pytest
+
+from helpers import *
+from minrar_single import *
+from minrar_multi import *
+
+
+# The presolve only removes requests whose assignment is the same in an optimal solution, so the objective of the full model is unchanged.
+# The seeds are instances where solving the residual with its own, smaller number of requests in the shortage penalties changes the optimum.
+@pytest.mark.parametrize("seed", [5, 11, 37])
+def test_presolve_keeps_single_hospital_objective(seed):
+
+    objectives = []
+    for presolve in [False, True]:
+        SETTINGS = make_settings(1, presolve = presolve)
+        PARAMS = Params(SETTINGS)
+        hospital = random_hospital(SETTINGS, PARAMS, np.random.default_rng(seed), 0, 20, 20)
+
+        _, x, y, z = minrar_single_hospital(SETTINGS, PARAMS, hospital, 0, new_recorder([hospital], 0))
+        objectives.append(full_objective(SETTINGS, PARAMS, hospital, 0, [(x, hospital.inventory, True)], y, z))
+
+    assert objectives[1] == pytest.approx(objectives[0], rel=1e-6)
+
+
+@pytest.mark.parametrize("seed", [5, 9, 10, 11])
+def test_presolve_keeps_multi_hospital_objective(seed):
+
+    objectives = []
+    for presolve in [False, True]:
+        SETTINGS = make_settings(3, presolve = presolve)
+        PARAMS = Params(SETTINGS)
+        rng = np.random.default_rng(seed)
+        hospitals = [random_hospital(SETTINGS, PARAMS, rng, e, 8, 8) for e in range(3)]
+        dc = types.SimpleNamespace(inventory = random_store(PARAMS, rng, 15))
+
+        _, xh, xdc, y, z = minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, 0, new_recorder(hospitals, 0))
+        objectives.append(sum([full_objective(SETTINGS, PARAMS, hospitals[h], 1, [(xh[h], hospitals[h].inventory, True), (xdc[h], dc.inventory, False)], y[h], z[h])
+                                for h in range(len(hospitals))]))
+
+    assert objectives[1] == pytest.approx(objectives[0], rel=1e-6)
+
+
+# In the multi-hospital model, a request with a future issuing date may also be satisfied from the distribution center. A product there that
+# mismatches the request on K is not cheaper than the hospital's own products with exactly the request's phenotype, so the request is fixed.
+def test_presolve_fixes_multi_hospital_requests():
+
+    objectives, presolved = [], []
+    for presolve in [False, True]:
+        SETTINGS = make_settings(2, presolve = presolve)
+        PARAMS = Params(SETTINGS)
+        antigens = PARAMS.major + PARAMS.minor
+        phenotype = np.array([[0, 0, 1, 1, 1, 0, 1, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1]])
+        kell = phenotype.copy()
+        kell[0,antigens.index("K")] = 1
+
+        hospitals = [random_hospital(SETTINGS, PARAMS, np.random.default_rng(e), e, 6, 4) for e in range(2)]
+        hospitals[0].inventory = Blood_store(PARAMS, np.repeat(phenotype, 2, axis=0), index = np.arange(2), age = np.array([5, 5]))
+        hospitals[0].requests = Blood_store(PARAMS, phenotype, index = np.arange(1), patgroup = np.array([PARAMS.patgroups.index("Other")]),
+                                            num_units = np.array([1]), day_issuing = np.array([1]))
+        dc = types.SimpleNamespace(inventory = Blood_store(PARAMS, kell, index = np.arange(1), age = np.array([5])))
+
+        df = new_recorder(hospitals, 0)
+        _, xh, xdc, y, z = minrar_multiple_hospitals(SETTINGS, PARAMS, dc, hospitals, 0, df)
+        objectives.append(sum([full_objective(SETTINGS, PARAMS, hospitals[h], 1, [(xh[h], hospitals[h].inventory, True), (xdc[h], dc.inventory, False)], y[h], z[h])
+                                for h in range(len(hospitals))]))
+        presolved.append(df.get(0, hospitals[0].name, "num presolved requests"))
+
+    assert presolved[1] == 1
+    assert objectives[1] == pytest.approx(objectives[0], rel=1e-6)